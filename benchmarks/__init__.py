@@ -0,0 +1 @@
+"""Benchmarks (run from the repository root, e.g. python -m benchmarks.xml_parsing, or python -m benchmarks.suite for all of them)."""
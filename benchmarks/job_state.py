@@ -0,0 +1,140 @@
+import itertools
+import os.path
+import pickle
+import sys
+import tempfile
+import time
+
+from tabulate import tabulate
+
+from multi_tasking import JobJournal, TimerTask
+from multi_tasking.task_state import decode_states
+from tasks import Attempt, FollowSymbolTask, OrderWhenOpen, SellTrailing
+
+task_classes = {c.__name__: c for c in (TimerTask, Attempt, FollowSymbolTask, OrderWhenOpen, SellTrailing)}
+
+
+#
+#
+#
+def make_tasks(n_jobs: int) -> list:
+    """n_jobs tasks, the same number of each class with a saved state"""
+    task_list = []
+    for j in range(n_jobs):
+        kind = j % 5
+        if kind == 0:
+            task = TimerTask(j)
+        elif kind == 1:
+            task = Attempt(j)
+            task.operation_started = j % 2 == 0
+        elif kind == 2:
+            task = OrderWhenOpen(j)
+            task.order_data.update({'action': 'BUY', 'symbol': 'S' + str(j % 500), 'quantity': 10 + j % 90,
+                                    'limit_price': 100.0 + (j % 1000) / 100.0, 'order_term': 'GOOD_UNTIL_CANCEL',
+                                    'prev_order_id': None, 'order_no': 1000 + j, 'check': True})
+        elif kind == 3:
+            task = SellTrailing(j)
+            task.set_order_data('S' + str(j % 500), 10 + j % 90, -0.02, 'GOOD_FOR_DAY', None, 5)
+        else:
+            task = FollowSymbolTask(j)
+            task._symbol = 'S' + str(j % 500)
+        task_list.append(task)
+    return task_list
+
+
+#
+#
+#
+def _same_states(task_list: list, loaded_list: list) -> bool:
+    return [(a.__class__, a.state()) for a in task_list] == [(a.__class__, a.state()) for a in loaded_list]
+
+
+#
+#
+#
+def save_pickle(task_list: list, path: str) -> None:
+    """status.pickle of the previous versions"""
+    status = [len(task_list), []]
+    for a in task_list:
+        status.append([a.__class__.__name__, a.state()])
+    with open(path, 'wb') as fp:
+        pickle.dump(status, fp)
+
+
+def load_pickle(path: str) -> list:
+    with open(path, 'rb') as fp:
+        o = pickle.load(fp)
+    return [task_classes[class_name](None, state) for class_name, state in o[2:]]
+
+
+#
+#
+#
+def save_journal(task_list: list, path: str) -> (float, float):
+    """-> encode time, checkpoint time (sec)"""
+    t0 = time.perf_counter()
+    journal = JobJournal(path)
+    for a in task_list:
+        journal.append_add(a)
+    t1 = time.perf_counter()
+    journal.write_checkpoint(journal.begin_checkpoint(len(task_list)))
+    journal.close()
+    return t1 - t0, time.perf_counter() - t1
+
+
+def load_journal(path: str) -> list:
+    """as JobServer.load_or_create"""
+    _, groups, _ = JobJournal(path).load()
+    tasks = dict()
+    for class_name, version, fields, ids, rows in groups:
+        class_type = task_classes[class_name]
+        tasks.update(zip(ids, map(class_type, itertools.repeat(None), decode_states(class_type, version, fields, rows))))
+    return [tasks[identifier] for identifier in sorted(tasks)]
+
+
+#
+#
+#
+def run(n_jobs: int = 10000, repeat: int = 3) -> list:
+    """
+        bulk save and load of n_jobs tasks (best of repeat, ms)
+            pickle  -> status.pickle of the previous versions, written at exit
+            journal -> JobJournal checkpoint, save = checkpoint (at exit and periodically)
+                       encode = json text of the states, done by append_* while running (once per add or change)
+    """
+    task_list = make_tasks(n_jobs)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'status.pickle')
+        t_save = min(_timed(save_pickle, task_list, path) for _ in range(repeat))
+        t_load = min(_timed(load_pickle, path) for _ in range(repeat))
+        if not _same_states(task_list, load_pickle(path)):
+            raise ValueError('run: pickle round trip changed the states.')
+        results.append({'format': 'pickle', 'jobs': n_jobs, 'encode_ms': 0.0, 'save_ms': t_save * 1e3,
+                        'load_ms': t_load * 1e3, 'bytes': os.path.getsize(path)})
+
+        path = os.path.join(directory, 'status.journal')
+        t_encode, t_save = min(save_journal(task_list, path) for _ in range(repeat))
+        t_load = min(_timed(load_journal, path) for _ in range(repeat))
+        if not _same_states(task_list, load_journal(path)):
+            raise ValueError('run: journal round trip changed the states.')
+        results.append({'format': 'journal', 'jobs': n_jobs, 'encode_ms': t_encode * 1e3, 'save_ms': t_save * 1e3,
+                        'load_ms': t_load * 1e3, 'bytes': os.path.getsize(path)})
+    return results
+
+
+#
+#
+#
+def _timed(f, *args) -> float:
+    t0 = time.perf_counter()
+    f(*args)
+    return time.perf_counter() - t0
+
+
+#
+#
+#
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    print(tabulate([list(x.values()) for x in run(n)], headers=['format', 'jobs', 'encode (ms)', 'save (ms)', 'load (ms)', 'bytes'], floatfmt='.1f'))
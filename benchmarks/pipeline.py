@@ -0,0 +1,351 @@
+import datetime
+import sys
+import threading
+import time
+import timeit
+import tracemalloc
+from typing import Optional, Sequence
+
+import numpy
+from tabulate import tabulate
+
+from multi_tasking import JobServer, Task
+from tasks import SellTrailing, OrderWhenOpen
+from trade_interface import TradeInterface, ReplayBroker, simulate_market_session
+from trading_platform_servers import QuoteServer, TickBuffer
+
+replay_keys = {'sandbox': {'consumer_key': '', 'consumer_secret': ''},
+               'production': {'consumer_key': '', 'consumer_secret': ''}}
+
+
+#
+#
+#
+def percentiles(samples: Sequence[float]) -> dict:
+    """samples (ms) -> count, mean, p50, p90, p99, max"""
+    if len(samples) == 0:
+        return {'count': 0}
+    samples = numpy.asarray(samples, dtype=numpy.float64)
+    p50, p90, p99 = numpy.percentile(samples, [50, 90, 99])
+    return {'count': len(samples), 'mean': float(samples.mean()), 'p50': float(p50), 'p90': float(p90), 'p99': float(p99), 'max': float(samples.max())}
+
+
+#
+#
+#
+class TimedSellTrailing(SellTrailing):
+    """
+        SellTrailing that records the delay between a new tick and the decision taken on it (ms)
+    """
+    latencies = None
+    __last_tick = None
+
+    def f(self, parent, data):
+        result = super().f(parent, data)
+        decision_ns = time.time_ns()
+        data_x, _ = data['quote_server'].get_quote(symbol=self._symbol, all_data=False)
+        if data_x is not None and len(data_x) != 0:
+            tick_ns = int(data_x[-1].astype(numpy.int64))
+            if self.__last_tick is not None and tick_ns != self.__last_tick:
+                self.latencies.append((decision_ns - tick_ns) / 1e6)
+            self.__last_tick = tick_ns
+        return result
+
+
+#
+#
+#
+class TimedOrderWhenOpen(OrderWhenOpen):
+    """
+        OrderWhenOpen that records the time spent placing the order (ms)
+    """
+    latencies = None
+
+    def start_operation(self, parent, data):
+        t0 = time.perf_counter()
+        result = super().start_operation(parent, data)
+        self.latencies.append((time.perf_counter() - t0) * 1e3)
+        return result
+
+
+#
+#
+#
+class CountingTask(Task):
+    """
+        Task that runs at every JobServer tick and never ends
+    """
+    runs = 0
+
+    def start(self, parent, data) -> None:
+        pass
+
+    def run(self, parent, data) -> (bool, tuple, Optional[str]):
+        self.runs += 1
+        return False, [], None
+
+    def stop(self, parent, data) -> None:
+        pass
+
+
+#
+#
+#
+class IdleTask(CountingTask):
+    """
+        Task that runs once and then sleeps (never due again during a benchmark)
+    """
+    def next_run_time(self) -> Optional[datetime.datetime]:
+        return datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=1)
+
+
+#
+#
+#
+class ChurnTask(CountingTask):
+    """
+        Task done at its first run and replaced by a new one (a done task + an added task per run)
+    """
+    completed = None        # shared list, one item per run (list.append is thread safe)
+
+    def run(self, parent, data) -> (bool, tuple, Optional[str]):
+        self.completed.append(self.identifier)
+        new_task = ChurnTask(parent.next_valid_task_id())
+        new_task.completed = self.completed
+        return True, [new_task], None
+
+
+#
+#
+#
+def tick_to_decision(n_symbols: int = 50, tasks_per_symbol: int = 2, n_orders: int = 20, tick_sec: float = 0.25,
+                     duration_sec: float = 10.0, broker_latency_sec: float = 0.0) -> dict:
+    """
+        QuoteServer -> JobServer -> SellTrailing / OrderWhenOpen against the replay broker
+        - the market session is simulated as REGULAR
+        - the SellTrailing tasks never sell (margin = -100%), they are woken up by their quote listener
+    """
+    symbols = ['S%03d' % j for j in range(n_symbols)]
+    broker = ReplayBroker(latency_sec=broker_latency_sec, seed=0)
+    trade = TradeInterface(keys=replay_keys, use_sandbox=False, browser_path='')
+    trade.replay_broker = broker
+    if not trade.connect():
+        raise ValueError('tick_to_decision: cannot connect to the replay broker.')
+    trade.select_account(0)
+
+    quote_server = QuoteServer(trade)
+    quote_server.time_frequency_sec = tick_sec
+    job_server = JobServer()
+    job_server.time_frequency_sec = tick_sec
+    job_server.aux_data = {'job_server': job_server, 'trade': trade, 'quote_server': quote_server}
+
+    decisions = []
+    placements = []
+    for symbol in symbols:
+        for _ in range(tasks_per_symbol):
+            task = TimedSellTrailing(job_server.next_valid_task_id())
+            task.set_order_data(symbol, 1, -1.0, 'GOOD_FOR_DAY', None, 3600)
+            task.latencies = decisions
+            job_server.add(task)
+    for j in range(n_orders):
+        task = TimedOrderWhenOpen(job_server.next_valid_task_id())
+        task.order_data = {'action': 'BUY', 'symbol': symbols[j % n_symbols], 'quantity': 1, 'limit_price': 'MARKET_PRICE',
+                           'order_term': 'GOOD_FOR_DAY', 'prev_order_id': None}
+        task.latencies = placements
+        job_server.add(task)
+
+    simulate_market_session('REGULAR')
+    try:
+        quote_server.start()
+        job_server.start()
+        time.sleep(duration_sec)
+        job_server.quit()
+        quote_server.quit()
+        job_server.join()
+        quote_server.join()
+    finally:
+        simulate_market_session(None)
+        trade.disconnect()
+    if len(decisions) == 0:
+        raise ValueError('tick_to_decision: no SellTrailing decision in ' + str(duration_sec) + ' sec.')
+    if len(placements) == 0:
+        raise ValueError('tick_to_decision: no order placed in ' + str(duration_sec) + ' sec.')
+
+    return {'symbols': n_symbols, 'tasks': n_symbols * tasks_per_symbol + n_orders, 'tick_sec': tick_sec,
+            'duration_sec': duration_sec, 'broker_latency_sec': broker_latency_sec,
+            'tick_to_decision_ms': percentiles(decisions), 'order_placement_ms': percentiles(placements),
+            'broker_requests': broker.stats()['requests']}
+
+
+#
+#
+#
+def order_history(order_counts: Sequence[int] = (10, 60)) -> list:
+    """
+        TradeInterface.list_orders against the replay broker (pages of 25 orders, 0.5 sec between the pages)
+    """
+    results = []
+    for n in order_counts:
+        broker = ReplayBroker(seed=0)
+        trade = TradeInterface(keys=replay_keys, use_sandbox=False, browser_path='')
+        trade.replay_broker = broker
+        if not trade.connect():
+            raise ValueError('order_history: cannot connect to the replay broker.')
+        trade.select_account(0)
+        simulate_market_session('REGULAR')
+        try:
+            for j in range(n):
+                trade.place_limit_order('BUY', 'S%03d' % (j % 10), 1, 1.0, 'REGULAR', None)
+            requests_0 = broker.stats()['requests']
+            t0 = time.perf_counter()
+            order_list = trade.list_orders()
+            t1 = time.perf_counter()
+        finally:
+            simulate_market_session(None)
+            trade.disconnect()
+        if len(order_list) != n:
+            raise ValueError('order_history: ' + str(len(order_list)) + ' orders listed out of ' + str(n) + '.')
+        results.append({'orders': n, 'requests': broker.stats()['requests'] - requests_0, 'list_ms': (t1 - t0) * 1e3})
+    return results
+
+
+#
+#
+#
+def job_server_loop(task_counts: Sequence[int] = (10, 100, 1000, 10000), duration_sec: float = 2.0) -> list:
+    """
+        scheduling overhead: every task is due at every tick (time_frequency_sec = 0)
+    """
+    results = []
+    for n in task_counts:
+        job_server = JobServer()
+        job_server.time_frequency_sec = 0.0
+        job_server.aux_data = dict()
+        task_list = [CountingTask(job_server.next_valid_task_id()) for _ in range(n)]
+        for task in task_list:
+            job_server.add(task)
+        job_server.start()
+        time.sleep(min(duration_sec, 0.5))
+
+        runs_0 = sum(task.runs for task in task_list)
+        t0 = time.perf_counter()
+        time.sleep(duration_sec)
+        runs_1 = sum(task.runs for task in task_list)
+        t1 = time.perf_counter()
+
+        job_server.quit()
+        job_server.join()
+        rate = (runs_1 - runs_0) / (t1 - t0)
+        results.append({'tasks': n, 'runs_per_sec': rate,
+                        'loop_ms': (n / rate) * 1e3 if rate != 0 else None,
+                        'us_per_run': 1e6 / rate if rate != 0 else None})
+    return results
+
+
+#
+#
+#
+def job_server_churn(idle_counts: Sequence[int] = (0, 1000, 10000), churn_tasks: int = 10, duration_sec: float = 2.0) -> list:
+    """
+        done + add overhead next to idle tasks: churn_tasks tasks are done at every run and replaced
+        by new ones, the idle tasks are never due (the cost per run should not depend on them)
+    """
+    results = []
+    for n in idle_counts:
+        job_server = JobServer()
+        job_server.time_frequency_sec = 0.0
+        job_server.aux_data = dict()
+        for _ in range(n):
+            job_server.add(IdleTask(job_server.next_valid_task_id()))
+        completed = []
+        for _ in range(churn_tasks):
+            task = ChurnTask(job_server.next_valid_task_id())
+            task.completed = completed
+            job_server.add(task)
+        job_server.start()
+        time.sleep(min(duration_sec, 0.5))
+
+        runs_0 = len(completed)
+        t0 = time.perf_counter()
+        time.sleep(duration_sec)
+        runs_1 = len(completed)
+        t1 = time.perf_counter()
+
+        job_server.quit()
+        job_server.join()
+        rate = (runs_1 - runs_0) / (t1 - t0)
+        results.append({'idle_tasks': n, 'runs_per_sec': rate, 'us_per_run': 1e6 / rate if rate != 0 else None})
+    return results
+
+
+#
+#
+#
+def quote_store_memory(n_symbols: int = 100) -> dict:
+    """
+        memory allocated by QuoteServer.add_quote (the buffers are preallocated to maxlen samples)
+    """
+    quote_server = QuoteServer(None)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for j in range(n_symbols):
+        quote_server.add_quote('S%03d' % j)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    bytes_per_symbol = (after - before) / n_symbols
+    capacity_hours = quote_server.maxlen * quote_server.time_frequency_sec / 3600.0
+    return {'symbols': n_symbols, 'samples_per_symbol': quote_server.maxlen, 'capacity_hours': capacity_hours,
+            'bytes_per_symbol': bytes_per_symbol, 'bytes_per_symbol_hour': bytes_per_symbol / capacity_hours}
+
+
+#
+#
+#
+def quote_copy_cost(capacity: Optional[int] = None, number: int = 200) -> list:
+    """
+        cost of the copies returned by get_quote (TickBuffer.last under the symbol lock) and get_quote_since
+        capacity = None -> QuoteServer.maxlen
+    """
+    if capacity is None:
+        capacity = QuoteServer(None).maxlen
+    results = []
+    lock = threading.Lock()
+    for fill in (capacity // 2, capacity, capacity + capacity // 3):
+        buffer = TickBuffer(capacity)
+        times = numpy.arange(fill, dtype=numpy.int64) * 1000000000
+        buffer.extend(times.view('datetime64[ns]'), numpy.random.default_rng(0).random(fill))
+
+        def copy(n):
+            lock.acquire()
+            data = buffer.last(n)
+            lock.release()
+            return data
+
+        def since():
+            lock.acquire()
+            data = buffer.since(buffer.count - 1)
+            lock.release()
+            return data
+
+        t_all = min(timeit.repeat(lambda: copy(None), number=number, repeat=3)) / number
+        t_last = min(timeit.repeat(lambda: copy(1), number=number * 10, repeat=3)) / (number * 10)
+        t_since = min(timeit.repeat(since, number=number * 10, repeat=3)) / (number * 10)
+        results.append({'samples': len(buffer), 'wrapped': fill > capacity, 'bytes': len(buffer) * 16,
+                        'all_data_us': t_all * 1e6, 'last_us': t_last * 1e6, 'since_last_us': t_since * 1e6})
+    return results
+
+
+#
+#
+#
+if __name__ == '__main__':
+    quick = len(sys.argv) > 1 and sys.argv[1] == 'quick'
+    r = tick_to_decision(duration_sec=3.0 if quick else 10.0)
+    print(tabulate([[name] + [r[name].get(k) for k in ('count', 'p50', 'p90', 'p99', 'max')] for name in ('tick_to_decision_ms', 'order_placement_ms')],
+                   headers=['latency', 'count', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)', 'max (ms)'], floatfmt='.2f'))
+    print(tabulate([list(x.values()) for x in order_history()], headers=['orders', 'requests', 'list (ms)'], floatfmt='.2f'))
+    print(tabulate([list(x.values()) for x in job_server_loop(duration_sec=0.5 if quick else 2.0)], headers=['tasks', 'runs/sec', 'loop (ms)', 'us/run'], floatfmt='.2f'))
+    print(tabulate([list(x.values()) for x in job_server_churn(duration_sec=0.5 if quick else 2.0)], headers=['idle tasks', 'done+add/sec', 'us/run'], floatfmt='.2f'))
+    print(tabulate([list(quote_store_memory().values())], headers=['symbols', 'samples/symbol', 'hours', 'bytes/symbol', 'bytes/symbol-hour'], floatfmt='.1f'))
+    print(tabulate([list(x.values()) for x in quote_copy_cost()], headers=['samples', 'wrapped', 'bytes', 'all data (us)', 'last (us)', 'since last (us)'], floatfmt='.2f'))
@@ -0,0 +1,53 @@
+import sys
+import timeit
+
+from tabulate import tabulate
+
+from benchmarks.xml_parsing import load_fixture
+from trade_interface.e_trade_api import EtradeApi
+from trade_interface.e_trade_xml import parse_quotes, parse_orders, parse_positions
+
+
+#
+# (name, fixture, EtradeApi parser of the full response, streaming xml parser)
+#
+cases = [
+    ('quote ALL x25', 'quote_all_25', lambda resp: EtradeApi._parse_quotes(resp, False), lambda text: parse_quotes(text, False)),
+    ('quote INTRADAY x25', 'quote_intraday_25', lambda resp: EtradeApi._parse_quotes(resp, True), lambda text: parse_quotes(text, True)),
+    ('orders x25', 'orders_25', EtradeApi._parse_orders, parse_orders),
+    ('portfolio x25', 'portfolio_25', EtradeApi._parse_positions, parse_positions),
+]
+
+
+#
+#
+#
+def run(number: int = 500) -> list:
+    """xml (xmltodict), xml (streaming) and json responses of the same data, side by side."""
+    results = []
+    for name, fixture, api_parser, streaming_parser in cases:
+        xml_text = load_fixture(fixture + '.xml')
+        json_text = load_fixture(fixture + '.json')
+
+        def parse_xml():
+            return api_parser(EtradeApi._parse_response(xml_text))
+
+        def parse_json():
+            return api_parser(EtradeApi._parse_response(json_text, data_format='json'))
+
+        def parse_streaming():
+            return streaming_parser(xml_text)
+
+        if not (parse_xml() == parse_json() == parse_streaming()):
+            raise ValueError('run: ' + name + ' parsers disagree.')
+        timings = [min(timeit.repeat(f, number=number, repeat=3)) / number * 1e6 for f in (parse_xml, parse_streaming, parse_json)]
+        results.append([name, len(xml_text), len(json_text)] + timings)
+    return results
+
+
+#
+#
+#
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print(tabulate(run(n), headers=['response', 'xml bytes', 'json bytes', 'xmltodict (us)', 'xml streaming (us)', 'json (us)'], floatfmt='.1f'))
@@ -0,0 +1,96 @@
+import datetime
+import json
+import os.path
+import platform
+import subprocess
+import sys
+from typing import Optional
+
+from benchmarks import job_state, pipeline, response_formats, xml_parsing
+
+default_output_path = 'benchmark_results.json'
+
+
+#
+#
+#
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+#
+#
+#
+def run(quick: bool = False) -> dict:
+    """
+        runs all the benchmarks, the result can be saved as json and compared between commits
+        quick = shorter runs (noisier)
+    """
+    n = 50 if quick else 500
+    results = {'version': 1,
+               'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+               'commit': git_commit(),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'quick': quick}
+
+    results['tick_to_decision'] = pipeline.tick_to_decision(duration_sec=3.0 if quick else 10.0)
+    results['order_history'] = pipeline.order_history()
+    results['job_server_loop'] = pipeline.job_server_loop(duration_sec=0.5 if quick else 2.0)
+    results['job_server_churn'] = pipeline.job_server_churn(duration_sec=0.5 if quick else 2.0)
+    results['quote_store_memory'] = pipeline.quote_store_memory()
+    results['quote_copy_cost'] = pipeline.quote_copy_cost(number=20 if quick else 200)
+    results['job_state'] = job_state.run(n_jobs=10000, repeat=1 if quick else 3)
+
+    headers = ['response', 'bytes', 'xmltodict_us', 'streaming_us', 'speedup']
+    results['xml_parsing'] = [dict(zip(headers, row)) for row in xml_parsing.run(n)]
+    headers = ['response', 'xml_bytes', 'json_bytes', 'xmltodict_us', 'xml_streaming_us', 'json_us']
+    results['response_formats'] = [dict(zip(headers, row)) for row in response_formats.run(n)]
+    return results
+
+
+#
+#
+#
+def summary(results: dict) -> str:
+    lines = []
+    for name in ('tick_to_decision_ms', 'order_placement_ms'):
+        r = results['tick_to_decision'][name]
+        if r['count'] != 0:
+            lines.append(name.ljust(22) + ' p50 = %.2f  p90 = %.2f  p99 = %.2f  (%d samples)' % (r['p50'], r['p90'], r['p99'], r['count']))
+    for r in results['order_history']:
+        lines.append(('order_history x' + str(r['orders'])).ljust(22) + ' %.2f ms (%d requests)' % (r['list_ms'], r['requests']))
+    for r in results['job_server_loop']:
+        lines.append(('job_server_loop x' + str(r['tasks'])).ljust(22) + ' %.2f us/run' % r['us_per_run'])
+    for r in results['job_server_churn']:
+        lines.append(('job_server_churn +' + str(r['idle_tasks'])).ljust(22) + ' %.2f us/run' % r['us_per_run'])
+    r = results['quote_store_memory']
+    lines.append('quote_store_memory'.ljust(22) + ' %.0f bytes/symbol-hour' % r['bytes_per_symbol_hour'])
+    r = results['quote_copy_cost'][-1]
+    lines.append('get_quote all_data'.ljust(22) + ' %.2f us (%d samples)' % (r['all_data_us'], r['samples']))
+    for r in results['job_state']:
+        line = ('job_state ' + r['format']).ljust(22) + ' save %.1f ms  load %.1f ms  %d bytes (%d jobs)' % (r['save_ms'], r['load_ms'], r['bytes'], r['jobs'])
+        if r['encode_ms'] != 0.0:
+            line += ', encode %.1f ms while running' % r['encode_ms']
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+#
+#
+#
+if __name__ == '__main__':
+    #
+    # python -m benchmarks.suite [quick] [output.json]
+    #
+    args = sys.argv[1:]
+    output_path = next((arg for arg in args if arg.lower().endswith('.json')), default_output_path)
+    benchmark_results = run(quick='quick' in args)
+    with open(output_path, 'w') as fp:
+        json.dump(benchmark_results, fp, indent=2)
+    print(summary(benchmark_results))
+    print('saved in ' + output_path)
@@ -0,0 +1,60 @@
+import os.path
+import sys
+import timeit
+
+from tabulate import tabulate
+
+from trade_interface.e_trade_api import EtradeApi
+from trade_interface.e_trade_xml import parse_quotes, parse_orders, parse_positions
+
+fixtures_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+#
+#
+#
+def load_fixture(name: str) -> bytes:
+    with open(os.path.join(fixtures_path, name), 'rb') as fp:
+        return fp.read()
+
+
+#
+# (name, fixture, xmltodict parser, streaming parser)
+#
+cases = [
+    ('quote ALL x25', 'quote_all_25.xml',
+     lambda text: EtradeApi._parse_quotes(EtradeApi._parse_response(text), False),
+     lambda text: parse_quotes(text, False)),
+    ('quote INTRADAY x25', 'quote_intraday_25.xml',
+     lambda text: EtradeApi._parse_quotes(EtradeApi._parse_response(text), True),
+     lambda text: parse_quotes(text, True)),
+    ('orders x25', 'orders_25.xml',
+     lambda text: EtradeApi._parse_orders(EtradeApi._parse_response(text)),
+     parse_orders),
+    ('portfolio x25', 'portfolio_25.xml',
+     lambda text: EtradeApi._parse_positions(EtradeApi._parse_response(text)),
+     parse_positions),
+]
+
+
+#
+#
+#
+def run(number: int = 500) -> list:
+    results = []
+    for name, fixture, xmltodict_parser, streaming_parser in cases:
+        text = load_fixture(fixture)
+        if xmltodict_parser(text) != streaming_parser(text):
+            raise ValueError('run: ' + name + ' parsers disagree.')
+        t_xmltodict = min(timeit.repeat(lambda: xmltodict_parser(text), number=number, repeat=3)) / number
+        t_streaming = min(timeit.repeat(lambda: streaming_parser(text), number=number, repeat=3)) / number
+        results.append([name, len(text), t_xmltodict * 1e6, t_streaming * 1e6, t_xmltodict / t_streaming])
+    return results
+
+
+#
+#
+#
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print(tabulate(run(n), headers=['response', 'bytes', 'xmltodict (us)', 'streaming (us)', 'speedup'], floatfmt='.1f'))
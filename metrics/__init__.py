@@ -0,0 +1,3 @@
+from metrics.registry import Counter, Histogram, counter, histogram, snapshot, reset, dump, dumps
+from metrics.instrumented_lock import InstrumentedLock
+from metrics.metrics_server import MetricsServer
@@ -0,0 +1,61 @@
+import threading
+import time
+from typing import Any
+
+from metrics.registry import histogram
+
+
+#
+#
+#
+class InstrumentedLock:
+    """
+        - drop-in wrapper of a Lock / RLock (acquire, release, with)
+        - records in the histograms:
+            <name>.wait = time spent waiting in acquire
+            <name>.hold = time from the outermost acquire to the matching release
+    """
+    __lock = None
+    __wait = None
+    __hold = None
+    __depth = None          # owner only
+    __acquired_at = None    # owner only
+
+    def __init__(self, name: str, lock: Any = None):
+        self.__lock = lock if lock is not None else threading.Lock()
+        self.__wait = histogram(name + '.wait')
+        self.__hold = histogram(name + '.hold')
+        self.__depth = 0
+        self.__acquired_at = 0.0
+
+    #
+    #
+    #
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        t0 = time.perf_counter()
+        if not self.__lock.acquire(blocking, timeout):
+            return False
+        t1 = time.perf_counter()
+        self.__depth += 1
+        if self.__depth == 1:
+            self.__acquired_at = t1
+            self.__wait.observe(t1 - t0)
+        return True
+
+    #
+    #
+    #
+    def release(self) -> None:
+        self.__depth -= 1
+        if self.__depth == 0:
+            self.__hold.observe(time.perf_counter() - self.__acquired_at)
+        self.__lock.release()
+
+    #
+    #
+    #
+    def __enter__(self) -> bool:
+        return self.acquire()
+
+    def __exit__(self, *args) -> None:
+        self.release()
@@ -0,0 +1,89 @@
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional
+
+from metrics.registry import dump, dumps
+
+
+#
+#
+#
+class MetricsServer(threading.Thread):
+    """
+        - writes the snapshot of all metrics to file_path every interval_sec (and when it quits)
+        - http_port: serves the same json at http://127.0.0.1:http_port/metrics (None = no http)
+    """
+    __file_path = None
+    __interval_sec = None
+    __exiting = None
+    __http_server = None
+
+    def __init__(self, file_path: Optional[str], interval_sec: float = 10.0, http_port: Optional[int] = None):
+        super().__init__()
+        self.setName('MetricsServer')
+        self.daemon = True
+        self.__file_path = file_path
+        self.__interval_sec = interval_sec
+        self.__exiting = threading.Event()
+        self.__http_server = None
+        if http_port is not None:
+            self.__http_server = ThreadingHTTPServer(('127.0.0.1', http_port), _MetricsRequestHandler)
+            self.__http_server.daemon_threads = True
+
+    #
+    #
+    #
+    @property
+    def http_url(self) -> Optional[str]:
+        if self.__http_server is None:
+            return None
+        host, port = self.__http_server.server_address[:2]
+        return 'http://' + host + ':' + str(port) + '/metrics'
+
+    #
+    #
+    #
+    def __dump(self) -> None:
+        if self.__file_path:
+            try:
+                dump(self.__file_path)
+            except OSError as e:
+                print('MetricsServer: ' + str(e))
+
+    #
+    #
+    #
+    def run(self):
+        if self.__http_server is not None:
+            threading.Thread(target=self.__http_server.serve_forever, name='MetricsServerHttp', daemon=True).start()
+        while not self.__exiting.wait(self.__interval_sec):
+            self.__dump()
+        if self.__http_server is not None:
+            self.__http_server.shutdown()
+            self.__http_server.server_close()
+        self.__dump()
+
+    #
+    #
+    #
+    def quit(self):
+        self.__exiting.set()
+
+
+#
+#
+#
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = dumps().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,192 @@
+import bisect
+import datetime
+import json
+import threading
+from typing import Optional, Union
+
+#
+# histogram buckets (sec): upper bounds from 1us to 100s, 8 per decade (last bucket = above 100s)
+#
+bucket_bounds = [10.0 ** (e / 8.0) for e in range(-48, 17)]
+
+
+#
+#
+#
+class Counter:
+    """
+        - monotonic counter, thread safe
+    """
+    __mutex = None
+    __value = None
+
+    def __init__(self):
+        self.__mutex = threading.Lock()
+        self.__value = 0
+
+    def inc(self, n: int = 1) -> None:
+        self.__mutex.acquire()
+        self.__value += n
+        self.__mutex.release()
+
+    @property
+    def value(self) -> int:
+        return self.__value
+
+    def reset(self) -> None:
+        self.__mutex.acquire()
+        self.__value = 0
+        self.__mutex.release()
+
+    def snapshot(self) -> dict:
+        return {'type': 'counter', 'value': self.__value}
+
+
+#
+#
+#
+class Histogram:
+    """
+        - distribution of durations (sec) in log spaced buckets (bucket_bounds), thread safe
+        - count, sum, min and max are exact, percentiles are approximated by the bucket upper bound
+    """
+    __mutex = None
+    __buckets = None
+    __count = None
+    __sum = None
+    __min = None
+    __max = None
+
+    def __init__(self):
+        self.__mutex = threading.Lock()
+        self.reset()
+
+    def observe(self, value_sec: float) -> None:
+        j = bisect.bisect_left(bucket_bounds, value_sec)
+        self.__mutex.acquire()
+        self.__buckets[j] += 1
+        self.__count += 1
+        self.__sum += value_sec
+        if self.__min is None or value_sec < self.__min:
+            self.__min = value_sec
+        if self.__max is None or value_sec > self.__max:
+            self.__max = value_sec
+        self.__mutex.release()
+
+    @property
+    def count(self) -> int:
+        return self.__count
+
+    def reset(self) -> None:
+        self.__mutex.acquire()
+        self.__buckets = [0] * (len(bucket_bounds) + 1)
+        self.__count = 0
+        self.__sum = 0.0
+        self.__min = None
+        self.__max = None
+        self.__mutex.release()
+
+    def __percentile(self, q: float) -> Optional[float]:
+        if self.__count == 0:
+            return None
+        rank = q / 100.0 * self.__count
+        cumulative = 0
+        for j in range(len(self.__buckets)):
+            cumulative += self.__buckets[j]
+            if cumulative >= rank and self.__buckets[j] != 0:
+                if j == len(bucket_bounds):
+                    return self.__max
+                return min(bucket_bounds[j], self.__max)
+        return self.__max
+
+    def snapshot(self) -> dict:
+        self.__mutex.acquire()
+        snapshot = {'type': 'histogram',
+                    'count': self.__count,
+                    'sum': self.__sum,
+                    'mean': self.__sum / self.__count if self.__count != 0 else None,
+                    'min': self.__min,
+                    'max': self.__max,
+                    'p50': self.__percentile(50),
+                    'p90': self.__percentile(90),
+                    'p99': self.__percentile(99)}
+        self.__mutex.release()
+        return snapshot
+
+
+#
+# registry: name -> Counter or Histogram
+#
+_registry_mutex = threading.Lock()
+_registry = dict()
+
+
+#
+#
+#
+def _get_or_create(name: str, metric_type: type) -> Union[Counter, Histogram]:
+    _registry_mutex.acquire()
+    metric = _registry.get(name)
+    if metric is None:
+        metric = metric_type()
+        _registry[name] = metric
+    _registry_mutex.release()
+    if not isinstance(metric, metric_type):
+        raise ValueError('metrics: ' + name + ' is not a ' + metric_type.__name__ + '.')
+    return metric
+
+
+#
+#
+#
+def counter(name: str) -> Counter:
+    """Counter registered as name (created at the first call)."""
+    return _get_or_create(name, Counter)
+
+
+#
+#
+#
+def histogram(name: str) -> Histogram:
+    """Histogram registered as name (created at the first call)."""
+    return _get_or_create(name, Histogram)
+
+
+#
+#
+#
+def snapshot() -> dict:
+    """name -> snapshot of the metric, sorted by name."""
+    _registry_mutex.acquire()
+    metrics = sorted(_registry.items())
+    _registry_mutex.release()
+    return {name: metric.snapshot() for name, metric in metrics}
+
+
+#
+#
+#
+def reset() -> None:
+    """Clears all the values (the metrics stay registered)."""
+    _registry_mutex.acquire()
+    metrics = list(_registry.values())
+    _registry_mutex.release()
+    for metric in metrics:
+        metric.reset()
+
+
+#
+#
+#
+def dumps() -> str:
+    return json.dumps({'time': datetime.datetime.now(datetime.timezone.utc).isoformat(), 'metrics': snapshot()}, indent=1)
+
+
+#
+#
+#
+def dump(path: str) -> None:
+    """Writes the snapshot of all metrics to path (json)."""
+    text = dumps()
+    with open(path, 'w') as fp:
+        fp.write(text)
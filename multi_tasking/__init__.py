@@ -1,4 +1,6 @@
+from multi_tasking.job_journal import JobJournal
 from multi_tasking.job_server import JobServer
 from multi_tasking.sub_process_manager import SubProcessManager
 from multi_tasking.task import Task
+from multi_tasking.task_profiler import TaskProfiler
 from multi_tasking.timer_task import TimerTask
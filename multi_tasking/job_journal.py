@@ -0,0 +1,419 @@
+import json
+import os
+import threading
+import zlib
+from typing import Any, Optional
+
+from multi_tasking.task_state import encode_state
+
+
+#
+#
+#
+class JobJournal:
+    """
+        - append-only journal (write-ahead log) of the tasks of a JobServer
+        - path      = checkpoint, snapshot of the live tasks when the segment first_segment started
+          path.<k>  = segments, the records appended after the checkpoint (k >= first_segment)
+        - segments = json lines, one record (array) per line
+            ["schema", k, class name, version, [fields]]            fields of the states of class name / version
+            ["add", id, k, [values]]                                task added, its state has schema k
+            ["state", id, k, [values]]                              state changed after a run
+            ["remove", id]                                          remove requested
+            ["drop", id]                                            task done or removed
+          values = json form of state() (see multi_tasking.task_state), version = state_version of the class
+          k      = number of the schema in the segment, declared once per segment before its first use
+        - checkpoint = a json line, then a json array of records compressed with zlib (format_version)
+            ["checkpoint", format, next_valid_id, first_segment]
+            [["tasks", class name, version, [fields], [ids], [[values], ...]],     one per class name / version
+             ["remove", [ids]]]
+        - append_* write to the file buffer, sync() flushes and fsyncs all of them at once (group commit)
+        - checkpoint in two steps, only the first one holds __mutex
+            begin_checkpoint()  -> copy of the live tasks (already encoded), the next records go to a new segment
+            write_checkpoint()  -> writes path.tmp, os.replace to path, then deletes the old segments
+          a crash in the middle leaves the previous checkpoint and all its segments
+        - load() drops a torn or corrupted line at the end of a segment (crash during a write) and all the following ones
+        - tasks with state() = None are not journaled
+        - thread safe
+    """
+    format_version = 2
+    encoder = json.JSONEncoder(separators=(',', ':'))
+
+    __path = None
+    __mutex = None
+    __fp = None
+    __segment = None        # segment of the appended records (None = not open yet, in memory only)
+    __last_segment = None
+    __tasks = None          # identifier -> [(class name, state version), json text of the values]
+    __removing = None       # identifiers of the remove requests
+    __schemas = None        # (class name, state version) -> fields
+    __declared = None       # (class name, state version) -> k of the schemas declared in the segment
+    __dirty = None
+    #
+    records = None          # records since the last checkpoint
+
+    def __init__(self, path: str):
+        self.__path = path
+        self.__mutex = threading.Lock()
+        self.__fp = None
+        self.__segment = None
+        # after the segments on disk, also when they are not loaded (cleared or imported tasks)
+        self.__last_segment = max(self.__segments(), default=0)
+        self.__tasks = dict()
+        self.__removing = set()
+        self.__schemas = dict()
+        self.__declared = dict()
+        self.__dirty = False
+        self.records = 0
+
+    #
+    #
+    #
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    #
+    #
+    #
+    def __segment_path(self, k: int) -> str:
+        return self.__path + '.' + str(k)
+
+    #
+    #
+    #
+    def __segments(self) -> list:
+        """-> numbers of the segments on disk (sorted)"""
+        directory = os.path.dirname(os.path.abspath(self.__path))
+        prefix = os.path.basename(self.__path) + '.'
+        return sorted(int(f[len(prefix):]) for f in os.listdir(directory) if f.startswith(prefix) and f[len(prefix):].isdigit())
+
+    #
+    #
+    #
+    def load(self) -> (int, list, list):
+        """
+            replays the checkpoint and its segments
+            -> next_valid_id, [[class name, state version, fields, ids, [[values], ...]]] of the live tasks,
+               identifiers of the remove requests
+            the tasks are not kept, the JobServer journals them again when it adds them
+        """
+        self.__tasks = dict()
+        self.__removing = set()
+        self.records = 0
+        next_valid_id, first_segment, groups, removing = 0, None, [], []
+        if os.path.isfile(self.__path):
+            next_valid_id, first_segment, groups, removing = self.__read_checkpoint()
+        removing = set(removing)
+
+        # identifier -> [((class name, state version), fields), values], only if there are records after the checkpoint
+        tasks = None
+        segments = self.__segments()
+        for k in segments:
+            if first_segment is None or k >= first_segment:
+                records = self.__read_segment(self.__segment_path(k))
+                if tasks is None and len(records) != 0:
+                    tasks = dict()
+                    for class_name, version, fields, ids, rows in groups:
+                        entry = ((class_name, version), tuple(fields))
+                        for identifier, values in zip(ids, rows):
+                            tasks[identifier] = [entry, values]
+                if len(records) != 0:
+                    self.__replay(records, tasks, removing)
+        self.__last_segment = max(segments + [first_segment if first_segment is not None else 0])
+
+        if tasks is None:
+            ids = set()
+            for group in groups:
+                ids.update(group[3])
+        else:
+            ids = set(tasks)
+            by_schema = dict()
+            for identifier in sorted(tasks):
+                entry, values = tasks[identifier]
+                group = by_schema.get(entry)
+                if group is None:
+                    group = by_schema[entry] = [entry[0][0], entry[0][1], entry[1], [], []]
+                group[3].append(identifier)
+                group[4].append(values)
+            groups = list(by_schema.values())
+        if len(ids) != 0:
+            next_valid_id = max(next_valid_id, max(ids) + 1)
+        return next_valid_id, groups, [identifier for identifier in removing if identifier in ids]
+
+    #
+    #
+    #
+    def __read_checkpoint(self) -> (int, int, list, list):
+        """-> next_valid_id, first_segment, [[class name, state version, fields, ids, rows]], remove requests"""
+        with open(self.__path, 'rb') as fp:
+            data = fp.read()
+        n = data.find(b'\n')
+        try:
+            header = json.loads(data[:n])
+            if header[0] != 'checkpoint' or header[1] != self.format_version:
+                raise ValueError('format')
+            records = json.loads(zlib.decompress(data[n + 1:]))
+        except (ValueError, IndexError, TypeError, zlib.error):
+            raise ValueError('JobJournal: ' + self.__path + ' is not a journal checkpoint of format ' + str(self.format_version) + '.')
+        groups, removing = [], []
+        for record in records:
+            if record[0] == 'tasks':
+                groups.append(record[1:])
+            elif record[0] == 'remove':
+                removing.extend(record[1])
+        return header[2], header[3], groups, removing
+
+    #
+    #
+    #
+    @staticmethod
+    def __read_segment(path: str) -> list:
+        """-> records of the segment up to a torn or corrupted line"""
+        with open(path, 'rb') as fp:
+            lines = fp.read().decode('utf-8', errors='replace').split('\n')
+        # the text after the last new line is a torn line (or empty)
+        dropped = len(lines[-1])
+        lines = lines[:-1]
+        try:
+            # all at once (fast path)
+            records = json.loads('[' + ','.join(lines) + ']')
+        except ValueError:
+            # line by line up to the corrupted one
+            records = []
+            for line in lines:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+            dropped += sum(len(x) + 1 for x in lines[len(records):])
+        if dropped != 0:
+            print('JobJournal: ' + str(dropped) + ' bytes dropped at the end of ' + path)
+        return records
+
+    #
+    #
+    #
+    def __replay(self, records: list, tasks: dict, removing: set) -> None:
+        schemas = dict()        # k -> ((class name, state version), fields)
+        for record in records:
+            kind = record[0] if isinstance(record, list) and len(record) != 0 else None
+            if kind == 'add':
+                tasks[record[1]] = [schemas[record[2]], record[3]]
+            elif kind == 'state':
+                entry = tasks.get(record[1])
+                if entry is not None:
+                    entry[0] = schemas[record[2]]
+                    entry[1] = record[3]
+            elif kind == 'remove':
+                removing.add(record[1])
+            elif kind == 'drop':
+                tasks.pop(record[1], None)
+                removing.discard(record[1])
+            elif kind == 'schema':
+                schemas[record[1]] = ((record[2], record[3]), tuple(record[4]))
+            self.records += 1
+
+    #
+    #
+    #
+    def __write(self, kind: str, identifier: int, key: Optional[tuple] = None, text: Optional[str] = None) -> None:
+        """
+            __mutex held
+            before the first checkpoint only the tasks in memory are updated, the checkpoint writes them
+        """
+        if self.__segment is None:
+            return
+        if self.__fp is None:
+            self.__fp = open(self.__segment_path(self.__segment), 'a', encoding='utf-8', newline='\n')
+        if key is None:
+            self.__fp.write('["' + kind + '",' + str(identifier) + ']\n')
+        else:
+            k = self.__declared.get(key)
+            if k is None:
+                k = self.__declared[key] = len(self.__declared)
+                self.__fp.write(self.encoder.encode(['schema', k, key[0], key[1], self.__schemas[key]]) + '\n')
+            self.__fp.write('["' + kind + '",' + str(identifier) + ',' + str(k) + ',' + text + ']\n')
+        self.__dirty = True
+        self.records += 1
+
+    #
+    #
+    #
+    def __state(self, task: Any) -> (Optional[tuple], Optional[str]):
+        """-> (class name, state version), json text of the values of the state of task (None, None if not journaled)"""
+        state = task.state()
+        if state is None:
+            return None, None
+        task_class = task.__class__
+        try:
+            text = encode_state(task_class, state)
+        except (ValueError, TypeError) as e:
+            print('JobJournal: ' + str(task.identifier) + ' not journaled -> ' + str(e))
+            return None, None
+        key = (task_class.__name__, task_class.state_version)
+        if key not in self.__schemas:
+            self.__schemas[key] = list(task_class.state_schema)
+        return key, text
+
+    #
+    #
+    #
+    def append_add(self, task: Any) -> None:
+        key, text = self.__state(task)
+        if key is None:
+            return
+        self.__mutex.acquire()
+        self.__tasks[task.identifier] = [key, text]
+        self.__write('add', task.identifier, key, text)
+        self.__mutex.release()
+
+    #
+    #
+    #
+    def append_state(self, task: Any) -> None:
+        """Records the state of task only if it changed since the last record."""
+        key, text = self.__state(task)
+        if key is None:
+            return
+        self.__mutex.acquire()
+        entry = self.__tasks.get(task.identifier)
+        if entry is not None and (entry[1] != text or entry[0] != key):
+            entry[0] = key
+            entry[1] = text
+            self.__write('state', task.identifier, key, text)
+        self.__mutex.release()
+
+    #
+    #
+    #
+    def append_remove(self, identifier: int) -> None:
+        self.__mutex.acquire()
+        if identifier in self.__tasks and identifier not in self.__removing:
+            self.__removing.add(identifier)
+            self.__write('remove', identifier)
+        self.__mutex.release()
+
+    #
+    #
+    #
+    def append_drop(self, identifier: int) -> None:
+        self.__mutex.acquire()
+        if identifier in self.__tasks:
+            del self.__tasks[identifier]
+            self.__removing.discard(identifier)
+            self.__write('drop', identifier)
+        self.__mutex.release()
+
+    #
+    #
+    #
+    def sync(self) -> bool:
+        """
+            makes the records appended so far durable
+            -> True if something was written
+        """
+        self.__mutex.acquire()
+        if not self.__dirty:
+            self.__mutex.release()
+            return False
+        self.__fp.flush()
+        fd = self.__fp.fileno()
+        self.__dirty = False
+        self.__mutex.release()
+        # no lock held, the records appended in the meantime go to the next sync
+        os.fsync(fd)
+        return True
+
+    #
+    #
+    #
+    def begin_checkpoint(self, next_valid_id: int) -> tuple:
+        """
+            fast, __mutex held only to copy the live tasks (their texts are replaced, never modified) and to switch segment
+            -> checkpoint to pass to write_checkpoint
+        """
+        self.__mutex.acquire()
+        previous_fp = self.__fp
+        self.__last_segment += 1
+        self.__segment = self.__last_segment
+        self.__fp = None
+        self.__dirty = False
+        self.__declared = dict()
+        self.records = 0
+        tasks = [(identifier, entry[0], entry[1]) for identifier, entry in self.__tasks.items()]
+        removing = list(self.__removing)
+        schemas = dict(self.__schemas)
+        self.__mutex.release()
+        return next_valid_id, self.__segment, tasks, removing, schemas, previous_fp
+
+    #
+    #
+    #
+    def write_checkpoint(self, checkpoint: tuple) -> int:
+        """
+            slow, no lock held (can run on another thread, one checkpoint at a time)
+            -> size of the checkpoint (bytes)
+        """
+        next_valid_id, segment, tasks, removing, schemas, previous_fp = checkpoint
+        if previous_fp is not None:
+            # the records of the previous segment not synced yet
+            previous_fp.flush()
+            os.fsync(previous_fp.fileno())
+            previous_fp.close()
+
+        groups = dict()         # (class name, state version) -> ids, texts
+        for identifier, key, text in tasks:
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = ([], [])
+            group[0].append(identifier)
+            group[1].append(text)
+        encode = self.encoder.encode
+        # the texts of the values are already json
+        records = [encode(['tasks', key[0], key[1], schemas[key], ids])[:-1] + ',[' + ','.join(texts) + ']]'
+                   for key, (ids, texts) in groups.items()]
+        if len(removing) != 0:
+            records.append(encode(['remove', removing]))
+        data = zlib.compress(('[' + ',\n'.join(records) + ']').encode('utf-8'), 1)
+
+        tmp_path = self.__path + '.tmp'
+        with open(tmp_path, 'wb') as fp:
+            fp.write(encode(['checkpoint', self.format_version, next_valid_id, segment]).encode('utf-8') + b'\n')
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+            size = fp.tell()
+        os.replace(tmp_path, self.__path)
+        self.__fsync_directory()
+
+        # segments covered by the checkpoint
+        for k in self.__segments():
+            if k < segment:
+                os.remove(self.__segment_path(k))
+        return size
+
+    #
+    #
+    #
+    def __fsync_directory(self) -> None:
+        if os.name != 'posix':
+            return
+        fd = os.open(os.path.dirname(os.path.abspath(self.__path)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    #
+    #
+    #
+    def close(self) -> None:
+        """the next records are kept in memory only"""
+        self.sync()
+        self.__mutex.acquire()
+        if self.__fp is not None:
+            self.__fp.close()
+            self.__fp = None
+        self.__segment = None
+        self.__mutex.release()
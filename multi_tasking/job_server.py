@@ -1,8 +1,17 @@
-import copy
+import heapq
 import importlib
+import itertools
 import os.path
 import pickle
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from metrics import InstrumentedLock, counter, histogram
+from multi_tasking.job_journal import JobJournal
+from multi_tasking.task_state import decode_states
+from multi_tasking.task_profiler import TaskProfiler
 
 
 #
@@ -11,16 +20,67 @@ import threading
 class JobServer(threading.Thread):
     #
     aux_data = None
+    profiler = None                 # TaskProfiler of start, run and stop (opt-in: profiler.enabled)
     time_frequency_sec = 1.0
+    max_sleep_sec = 60.0
+    max_workers = 4
+    checkpoint_interval_sec = 60.0      # checkpoint of the journal (None = only at start and exit)
+    journal_compact_records = 10000     # or after this many records
 
     #
     # core (_mutex)
+    #     _tasks            = identifier -> task (in order of insertion), the identifiers are unique
+    #     __remove_requests = identifiers to remove (running tasks are removed once completed)
     #
     _mutex = None
-    _task_list = None
-    __remove_list = None
+    _tasks = None
+    __remove_requests = None
     __exiting = None
 
+    #
+    # scheduler (_mutex)
+    #     __schedule  = heap of [due_time (epoch sec), seq, task]
+    #     __scheduled = identifier -> valid entry of __schedule (the others are stale)
+    #
+    __schedule = None
+    __scheduled = None
+    __schedule_seq = None
+    __wakeup = None
+
+    #
+    # workers
+    #     __running   = identifiers of the tasks running on the workers (_mutex)
+    #     __completed = [task, (done, new_tasks, msg)] of the completed tasks (__completed_mutex)
+    #
+    __executor = None
+    __running = None
+    __completed_mutex = None
+    __completed = None
+
+    #
+    # woken up tasks    (__woken_mutex)
+    #
+    __woken_mutex = None
+    __woken = None
+
+    #
+    # metrics
+    #     job_server.loop            -> scheduler loop (_mutex held)
+    #     job_server.task_run        -> start + run of each task, also per task class (job_server.task_run.<class>)
+    #     job_server.mutex.*         -> wait and hold times of _mutex
+    #     job_server.journal_sync    -> flush + fsync of the journal records of a loop
+    #     job_server.checkpoint_capture -> copy of the tasks and segment switch (scheduler thread)
+    #     job_server.checkpoint      -> write + rename of the checkpoint (JobServerCheckpoint thread)
+    #     job_server.checkpoint_mb   -> size of the checkpoint
+    #
+    __loop_latency = None
+    __task_latency = None
+    __task_failures = None
+    __journal_sync_latency = None
+    __checkpoint_capture_latency = None
+    __checkpoint_latency = None
+    __checkpoint_size = None
+
     #
     # Id    (__next_id_mutex)
     #
@@ -33,7 +93,16 @@ class JobServer(threading.Thread):
     _done_list_feedback = None
     _removed_list_feedback = None
     _msg_feedback = None
-    __status_file_path = None
+
+    #
+    # journal (JobJournal, None = not persistent)
+    #     every add, remove, state change and done task is appended (_mutex),
+    #     and made durable at the end of the loop
+    #     the checkpoints are written by __checkpoint_thread, one at a time
+    #
+    __journal = None
+    __checkpoint_thread = None
+    __last_checkpoint = None
 
     #
     #
@@ -41,17 +110,36 @@ class JobServer(threading.Thread):
     def __init__(self):
         super().__init__()
         self.setName('JobServer')
-        self.__status_file_path = None
+        self.__journal = None
         #
         #
         #
-        self._mutex = threading.Lock()
-        self._task_list = []
-        self.__remove_list = []
+        self._mutex = InstrumentedLock('job_server.mutex')
+        self._tasks = dict()
+        self.__remove_requests = set()
         self.__exiting = threading.Event()
+        self.__schedule = []
+        self.__scheduled = dict()
+        self.__schedule_seq = itertools.count()
+        self.__wakeup = threading.Event()
+        self.__woken_mutex = threading.Lock()
+        self.__woken = set()
+        self.__running = set()
+        self.__completed_mutex = threading.Lock()
+        self.__completed = []
         self._done_list_feedback = []
         self._removed_list_feedback = []
         self._msg_feedback = []
+        self.profiler = TaskProfiler()
+        self.__loop_latency = histogram('job_server.loop')
+        self.__task_latency = histogram('job_server.task_run')
+        self.__task_failures = counter('job_server.task_failures')
+        self.__journal_sync_latency = histogram('job_server.journal_sync')
+        self.__checkpoint_capture_latency = histogram('job_server.checkpoint_capture')
+        self.__checkpoint_latency = histogram('job_server.checkpoint')
+        self.__checkpoint_size = histogram('job_server.checkpoint_mb')
+        self.__checkpoint_thread = None
+        self.__last_checkpoint = time.monotonic()
         #
         #
         #
@@ -71,87 +159,223 @@ class JobServer(threading.Thread):
         self.__next_id_mutex.release()
         return n
 
+    #
+    # scheduler (_mutex)
+    #
+    def __schedule_task(self, task, now: float, due_time: float = None) -> None:
+        """
+            due time = task.next_run_time()
+                       tasks without a time, or already due, run at the next tick (now + time_frequency_sec)
+        """
+        if due_time is None:
+            when = task.next_run_time() if task.started else None
+            if when is None:
+                due_time = now if not task.started else now + self.time_frequency_sec
+            else:
+                due_time = when.timestamp()
+                if task.started and due_time <= now:
+                    due_time = now + self.time_frequency_sec
+        entry = [due_time, next(self.__schedule_seq), task]
+        self.__scheduled[task.identifier] = entry
+        heapq.heappush(self.__schedule, entry)
+
+    #
+    # core (_mutex)
+    #
+    def __insert_task(self, task, now: float) -> bool:
+        """
+            adds and schedules task, False if its identifier is already used (task not added)
+        """
+        if task.identifier in self._tasks:
+            print('duplicate identifier ' + str(task.identifier) + ' -> ' + str(task).strip() + ' not added')
+            return False
+        self._tasks[task.identifier] = task
+        self.__schedule_task(task, now)
+        if self.__journal is not None:
+            self.__journal.append_add(task)
+        return True
+
+    #
+    # scheduler (_mutex)
+    #
+    def __time_to_next_task(self) -> float:
+        self._mutex.acquire()
+        if len(self.__schedule) == 0:
+            timeout = self.max_sleep_sec
+        else:
+            timeout = min(max(self.__schedule[0][0] - time.time(), 0.0), self.max_sleep_sec)
+        self._mutex.release()
+        return timeout
+
+    #
+    # scheduler (_mutex)
+    #
+    def __pop_due_tasks(self, now: float) -> list:
+        due_tasks = []
+        while len(self.__schedule) != 0 and self.__schedule[0][0] <= now:
+            entry = heapq.heappop(self.__schedule)
+            if self.__scheduled.get(entry[2].identifier) is entry:
+                del self.__scheduled[entry[2].identifier]
+                due_tasks.append(entry[2])
+        return due_tasks
+
+    #
+    # scheduler (_mutex)
+    #
+    def __process_woken_tasks(self, now: float) -> None:
+        self.__woken_mutex.acquire()
+        woken = self.__woken
+        self.__woken = set()
+        self.__woken_mutex.release()
+        for identifier in woken:
+            if identifier in self.__scheduled:
+                task = self.__scheduled[identifier][2]
+                task.wake_up()
+                self.__schedule_task(task, now, due_time=now)
+            elif identifier in self.__running:
+                # wake it up once completed
+                self.__woken_mutex.acquire()
+                self.__woken.add(identifier)
+                self.__woken_mutex.release()
+
+    #
+    # worker (no lock held)
+    #
+    def __run_task(self, task) -> None:
+        t0 = time.perf_counter()
+        try:
+            if not task.started:
+                self.profiler.call(task, 'start', task.start, self, self.aux_data)  # Start
+                task.started = True
+            result = self.profiler.call(task, 'run', task.run, self, self.aux_data)  # Run
+        except Exception as e:
+            self.__task_failures.inc()
+            result = True, [], str(task.identifier) + ': failed -> ' + str(e)
+        duration = time.perf_counter() - t0
+        self.__task_latency.observe(duration)
+        histogram('job_server.task_run.' + task.__class__.__name__).observe(duration)
+        self.__completed_mutex.acquire()
+        self.__completed.append([task, result])
+        self.__completed_mutex.release()
+        self.__wakeup.set()
+
+    #
+    # scheduler (_mutex)
+    #
+    def __collect_completed_tasks(self) -> None:
+        self.__completed_mutex.acquire()
+        completed = self.__completed
+        self.__completed = []
+        self.__completed_mutex.release()
+
+        #
+        # results
+        #
+        now = time.time()
+        to_add_list = []
+        done_list = []
+        for a, (done, new_tasks, msg) in completed:
+            self.__running.discard(a.identifier)
+            if done:
+                done_list.append(a.identifier)
+            else:
+                self.__schedule_task(a, now)                                        # Next run
+                if self.__journal is not None:
+                    self.__journal.append_state(a)
+            for new_task in new_tasks:
+                to_add_list.append(new_task)
+            if msg is not None:
+                self._msg_feedback.append(msg)
+
+        #
+        # Remove done tasks.
+        #
+        for identifier in done_list:
+            a = self._tasks.pop(identifier, None)
+            self.__remove_requests.discard(identifier)
+            if a is None:
+                continue
+            self.profiler.call(a, 'stop', a.stop, self, self.aux_data)              # Stop
+            if self.__journal is not None:
+                self.__journal.append_drop(identifier)
+        self._done_list_feedback += done_list
+
+        #
+        # Add new tasks.
+        #
+        for a in to_add_list:
+            self.__insert_task(a, now)
+
     #
     #
     #
     def run(self):
+        self.__executor = ThreadPoolExecutor(max_workers=max(self.max_workers, 1), thread_name_prefix='JobServer')
         while True:
             #
-            # wait and check exiting
+            # sleep until the earliest deadline, or until woken up (add, remove, wake_up, task completed, quit)
             #
-            if self.__exiting.wait(self.time_frequency_sec):
+            if self.__wakeup.wait(self.__time_to_next_task()):
+                self.__wakeup.clear()
+            if self.__exiting.is_set():
                 break
 
             #
             # Start
             #
             self._mutex.acquire()
+            loop_start = time.perf_counter()
 
             #
-            # process remove requests
+            # collect the tasks completed by the workers
             #
-            tmp_list = []
-            for a in self._task_list:
-                if a.identifier in self.__remove_list:
-                    a.stop(self, self.aux_data)
-                    self._removed_list_feedback.append(a.identifier)
-                else:
-                    tmp_list.append(a)
-            self._task_list = tmp_list
-            self.__remove_list = []
+            self.__collect_completed_tasks()
 
             #
-            # Consistency check
+            # process remove requests
+            #     running tasks are removed once completed
             #
-            identifiers = [a.identifier for a in self._task_list]
-            if len(set(identifiers)) != len(identifiers):
-                print('duplicate identifiers')
-                exit(1)
+            if len(self.__remove_requests) != 0:
+                for identifier in [x for x in self.__remove_requests if x not in self.__running]:
+                    self.__remove_requests.discard(identifier)
+                    a = self._tasks.pop(identifier, None)
+                    if a is None:
+                        continue
+                    self.profiler.call(a, 'stop', a.stop, self, self.aux_data)
+                    self._removed_list_feedback.append(identifier)
+                    self.__scheduled.pop(identifier, None)
+                    if self.__journal is not None:
+                        self.__journal.append_drop(identifier)
 
             #
             # Process
+            #     due tasks run on the worker pool, results are collected once completed
             #
-            to_add_list = []
-            done_list = []
-            for a in self._task_list:
-                if not a.started:
-                    a.start(self, self.aux_data)                                    # Start
-                    a.started = True
-                done, new_tasks, msg = a.run(self, self.aux_data)                   # Run
-                if done:
-                    done_list.append(a.identifier)
-                for new_task in new_tasks:
-                    to_add_list.append(new_task)
-                if msg is not None:
-                    self._msg_feedback.append(msg)
+            now = time.time()
+            self.__process_woken_tasks(now)
+            for a in self.__pop_due_tasks(now):
+                self.__running.add(a.identifier)
+                self.__executor.submit(self.__run_task, a)
 
             #
-            # Remove done tasks.
-            #
-            if len(done_list) != 0:
-                tmp_list = []
-                for a in self._task_list:
-                    if a.identifier in done_list:
-                        a.stop(self, self.aux_data)                                 # Stop
-                    else:
-                        tmp_list.append(a)
-                self._task_list = tmp_list
-                self._done_list_feedback += done_list
-
-            #
-            # Add new tasks.
+            # End
             #
-            self._task_list += to_add_list
+            self.__loop_latency.observe(time.perf_counter() - loop_start)
+            self._mutex.release()
 
             #
-            # End
+            # make the changes of this loop durable (no _mutex held)
             #
-            self._mutex.release()
+            self.__sync_journal()
 
         #
+        # wait for the running tasks
         #
-        #
-        self.__save_status()
+        self.__executor.shutdown(wait=True)
+        self._mutex.acquire()
+        self.__collect_completed_tasks()
+        self._mutex.release()
+        self.__close_journal()
         print('JobServer stopped.')
 
     #
@@ -195,7 +419,7 @@ class JobServer(threading.Thread):
     #
     def list_open_tasks(self):
         self._mutex.acquire()
-        for a in self._task_list:
+        for a in self._tasks.values():
             print(a)
         print()
         self._mutex.release()
@@ -205,20 +429,36 @@ class JobServer(threading.Thread):
     #
     def add(self, task):
         self._mutex.acquire()
-        self._task_list.append(task)
+        self.__insert_task(task, time.time())
         self._mutex.release()
+        self.__wakeup.set()
 
     #
     #
     #
     def remove(self, task_id: int):
         self._mutex.acquire()
-        if task_id in [a.identifier for a in self._task_list]:
-            self.__remove_list.append(task_id)
+        if task_id in self._tasks:
+            self.__remove_requests.add(task_id)
+            if self.__journal is not None:
+                self.__journal.append_remove(task_id)
         else:
             print(str(task_id) + ' not found')
             print()
         self._mutex.release()
+        self.__wakeup.set()
+
+    #
+    #
+    #
+    def wake_up(self, task_id: int) -> None:
+        """
+            run the task as soon as possible (thread safe, does not wait for _mutex)
+        """
+        self.__woken_mutex.acquire()
+        self.__woken.add(task_id)
+        self.__woken_mutex.release()
+        self.__wakeup.set()
 
     #
     #
@@ -227,38 +467,129 @@ class JobServer(threading.Thread):
         self._mutex.acquire()
         self.__exiting.set()
         self._mutex.release()
+        self.__wakeup.set()
+
+    #
+    # journal (scheduler thread)
+    #
+    def __sync_journal(self) -> None:
+        if self.__journal is None:
+            return
+        try:
+            t0 = time.perf_counter()
+            if self.__journal.sync():
+                self.__journal_sync_latency.observe(time.perf_counter() - t0)
+        except OSError as e:
+            print('JobServer: journal ' + str(e))
+
+        #
+        # checkpoint (in background, skipped while the previous one is being written)
+        #
+        due = self.__journal.records >= self.journal_compact_records
+        if self.checkpoint_interval_sec is not None and self.__journal.records != 0:
+            due = due or time.monotonic() - self.__last_checkpoint >= self.checkpoint_interval_sec
+        if due and (self.__checkpoint_thread is None or not self.__checkpoint_thread.is_alive()):
+            checkpoint = self.__begin_checkpoint()
+            self.__checkpoint_thread = threading.Thread(target=self.__write_checkpoint, args=(checkpoint,),
+                                                        name='JobServerCheckpoint', daemon=True)
+            self.__checkpoint_thread.start()
 
     #
     #
     #
-    def __save_status(self):
-        if self.__status_file_path:
-            self._mutex.acquire()
-            self.__next_id_mutex.acquire()
-            #
-            status = [self.__next_valid_id, self.__remove_list]
-            for a in self._task_list:
-                a_state = a.state()
-                if a_state is not None:
-                    status.append([a.__class__.__name__, a_state])
-            pickle.dump(status, open(self.__status_file_path, 'wb'))
-            #
-            self.__next_id_mutex.release()
-            self._mutex.release()
+    def __begin_checkpoint(self) -> tuple:
+        t0 = time.perf_counter()
+        self.__next_id_mutex.acquire()
+        next_valid_id = self.__next_valid_id
+        self.__next_id_mutex.release()
+        checkpoint = self.__journal.begin_checkpoint(next_valid_id)
+        self.__last_checkpoint = time.monotonic()
+        self.__checkpoint_capture_latency.observe(time.perf_counter() - t0)
+        return checkpoint
+
+    #
+    # JobServerCheckpoint thread (no lock held)
+    #
+    def __write_checkpoint(self, checkpoint: tuple) -> None:
+        try:
+            t0 = time.perf_counter()
+            size = self.__journal.write_checkpoint(checkpoint)
+            self.__checkpoint_latency.observe(time.perf_counter() - t0)
+            self.__checkpoint_size.observe(size / 1e6)
+        except OSError as e:
+            print('JobServer: checkpoint ' + str(e))
+
+    #
+    #
+    #
+    def __close_journal(self) -> None:
+        if self.__journal is None:
+            return
+        if self.__checkpoint_thread is not None:
+            self.__checkpoint_thread.join()
+        try:
+            self.__journal.sync()
+            self.__write_checkpoint(self.__begin_checkpoint())
+            self.__journal.close()
+        except OSError as e:
+            print('JobServer: journal ' + str(e))
 
     #
     #
     #
-    def load_or_create(self, status_file_path: str, clear_jobs: bool):
-        self.__status_file_path = status_file_path
-        if (not clear_jobs) and os.path.isfile(status_file_path):
-            o = pickle.load(open(status_file_path, 'rb'))
-            self.__next_valid_id = o[0]
-            self.__remove_list = copy.deepcopy(o[1])
-            for task_desc in o[2:]:
-                class_module = importlib.import_module('tasks')       # TODO to test
-                class_type = getattr(class_module, task_desc[0])
-                task = class_type(None, task_desc[1])
-                self.add(task)
-            if (len(self._task_list) == 0) and (len(self.__remove_list) == 0):
-                self.__next_valid_id = 0
+    def load_or_create(self, status_file_path: str, clear_jobs: bool, legacy_status_file_path: Optional[str] = None):
+        """
+            status_file_path        = JobJournal of the tasks (created if missing)
+            legacy_status_file_path = status pickle of the previous versions,
+                                      imported once when the journal does not exist yet (trusted file),
+                                      then renamed to legacy_status_file_path.imported
+            the states of the journal are migrated to the current state_version of their class
+        """
+        self.__journal = JobJournal(status_file_path)
+        next_valid_id = 0
+        remove_list = []
+        groups = []
+        imported = False
+        if not clear_jobs:
+            if os.path.isfile(status_file_path):
+                next_valid_id, groups, remove_list = self.__journal.load()
+            elif legacy_status_file_path and os.path.isfile(legacy_status_file_path):
+                imported = True
+                o = pickle.load(open(legacy_status_file_path, 'rb'))
+                next_valid_id = o[0]
+                remove_list = list(o[1])
+                groups = [[class_name, None, None, [state['identifier']], [state]] for class_name, state in o[2:]]
+
+        class_module = importlib.import_module('tasks')
+        tasks = dict()
+        for class_name, version, fields, ids, rows in groups:
+            class_type = getattr(class_module, class_name, None)
+            if class_type is None or not hasattr(class_type, 'state_schema'):
+                raise ValueError('load_or_create: unknown task class ' + str(class_name) + '.')
+            states = rows if version is None else decode_states(class_type, version, fields, rows)
+            tasks.update(zip(ids, map(class_type, itertools.repeat(None), states)))
+
+        self._mutex.acquire()
+        now = time.time()
+        # in order of insertion
+        for identifier in sorted(tasks):
+            self.__insert_task(tasks[identifier], now)
+        self.__remove_requests = set(identifier for identifier in remove_list if identifier in self._tasks)
+        for identifier in self.__remove_requests:
+            self.__journal.append_remove(identifier)
+        if (len(self._tasks) == 0) and (len(self.__remove_requests) == 0):
+            next_valid_id = 0
+        self._mutex.release()
+
+        self.__next_id_mutex.acquire()
+        self.__next_valid_id = next_valid_id
+        self.__next_id_mutex.release()
+        self.__write_checkpoint(self.__begin_checkpoint())
+
+        # the journal holds the imported tasks -> the pickle is not read again
+        if imported and os.path.isfile(status_file_path):
+            try:
+                os.replace(legacy_status_file_path, legacy_status_file_path + '.imported')
+                print('JobServer: ' + legacy_status_file_path + ' imported in ' + status_file_path + '.')
+            except OSError as e:
+                print('JobServer: ' + str(e))
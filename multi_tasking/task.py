@@ -1,3 +1,4 @@
+import datetime
 from typing import Optional, Any
 
 from multi_tasking.job_server import JobServer
@@ -9,6 +10,12 @@ from multi_tasking.job_server import JobServer
 class Task:
     identifier: int = -1
     started: bool = False
+    #
+    # schema of state() (see multi_tasking.task_state)
+    #
+    state_version: int = 1
+    state_schema: dict = {'identifier': 'int'}
+    state_migrations: dict = {}
 
     #
     #
@@ -69,6 +76,29 @@ class Task:
         """
         raise NotImplementedError
 
+    #
+    #
+    #
+    def next_run_time(self) -> Optional[datetime.datetime]:
+        """Returns when the job has to run next.
+
+        Used by the JobServer to schedule the job.
+
+        Returns:
+            Time of the next run. None means run at every JobServer tick.
+        """
+        return None
+
+    #
+    #
+    #
+    def wake_up(self) -> None:
+        """Notifies the job that it has been woken up before its next run time.
+
+        Called by the JobServer just before running the job.
+        """
+        pass
+
     #
     #
     #
@@ -104,6 +134,10 @@ class Task:
 
         Use:  return super().state() + {'...': ...., ...}
 
+        Each field has to be declared in state_schema. When the fields
+        change, increase state_version and add the migration from the
+        previous version to state_migrations.
+
         Returns:
             dict: Information necessary to recover the state of the job
                   once out of the sleep state.
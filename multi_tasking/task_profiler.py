@@ -0,0 +1,169 @@
+import cProfile
+import io
+import pstats
+import random
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from tabulate import tabulate
+
+
+#
+#
+#
+class TaskProfiler:
+    """
+        - opt-in wall and cpu time accounting of the start, run and stop calls of each task
+        - cprofile_sample_rate = fraction of the calls also profiled with cProfile (0 = never),
+                                 the samples of all the tasks are merged in a single pstats.Stats,
+                                 one sampled call at a time (a call is not sampled while another one is profiled)
+        - cpu time = time.thread_time() of the thread running the call (workers and scheduler)
+        - thread safe
+    """
+    phases = ('start', 'run', 'stop')
+    enabled = False
+    cprofile_sample_rate = 0.0
+    top_n = 5                       # tasks listed by the jobs command
+    file_path = 'profile.txt'       # default dump file
+
+    __mutex = None
+    __cprofile_mutex = None
+    __tasks = None          # identifier -> [class name, description, done, {phase: [calls, wall, cpu, max wall]}]
+    __stats = None          # pstats.Stats of the cProfile samples
+    __samples = None
+    __random = None
+
+    def __init__(self):
+        self.__mutex = threading.Lock()
+        self.__cprofile_mutex = threading.Lock()
+        self.__random = random.Random()
+        self.reset()
+
+    #
+    #
+    #
+    def reset(self) -> None:
+        self.__mutex.acquire()
+        self.__tasks = dict()
+        self.__stats = None
+        self.__samples = 0
+        self.__mutex.release()
+
+    #
+    #
+    #
+    def call(self, task: Any, phase: str, f: Callable, *args) -> Any:
+        """Calls f(*args), the phase of task, and accounts for its cost (when enabled)."""
+        if not self.enabled:
+            return f(*args)
+
+        profile = None
+        if self.cprofile_sample_rate > 0.0 and self.__random.random() < self.cprofile_sample_rate:
+            if self.__cprofile_mutex.acquire(blocking=False):
+                profile = cProfile.Profile()
+        wall_0 = time.perf_counter()
+        cpu_0 = time.thread_time()
+        try:
+            if profile is not None:
+                return profile.runcall(f, *args)
+            return f(*args)
+        finally:
+            wall = time.perf_counter() - wall_0
+            cpu = time.thread_time() - cpu_0
+            if profile is not None:
+                self.__cprofile_mutex.release()
+            self.__account(task, phase, wall, cpu, profile)
+
+    #
+    #
+    #
+    def __account(self, task: Any, phase: str, wall: float, cpu: float, profile: Optional[cProfile.Profile]) -> None:
+        self.__mutex.acquire()
+        entry = self.__tasks.get(task.identifier)
+        if entry is None:
+            try:
+                description = str(task).strip()
+            except Exception:
+                description = ''
+            entry = [task.__class__.__name__, description, False, {p: [0, 0.0, 0.0, 0.0] for p in self.phases}]
+            self.__tasks[task.identifier] = entry
+        if phase == 'stop':
+            entry[2] = True
+        phase_entry = entry[3][phase]
+        phase_entry[0] += 1
+        phase_entry[1] += wall
+        phase_entry[2] += cpu
+        phase_entry[3] = max(phase_entry[3], wall)
+        if profile is not None:
+            if self.__stats is None:
+                self.__stats = pstats.Stats(profile)
+            else:
+                self.__stats.add(profile)
+            self.__samples += 1
+        self.__mutex.release()
+
+    #
+    #
+    #
+    def ranking(self, n: Optional[int] = None) -> list:
+        """
+            tasks sorted by cumulative wall time (start + run + stop), the n most expensive ones
+            [identifier, class, description, done, calls, wall, cpu, max wall] (sec)
+        """
+        self.__mutex.acquire()
+        table = []
+        for identifier, (class_name, description, done, phases) in self.__tasks.items():
+            table.append([identifier, class_name, description, done,
+                          sum(phases[p][0] for p in self.phases),
+                          sum(phases[p][1] for p in self.phases),
+                          sum(phases[p][2] for p in self.phases),
+                          max(phases[p][3] for p in self.phases)])
+        self.__mutex.release()
+        table.sort(key=lambda x: -x[5])
+        return table if n is None else table[:n]
+
+    #
+    #
+    #
+    def report(self, n: Optional[int] = None) -> str:
+        table = [[x[0], x[1] + (' (done)' if x[3] else ''), x[4], x[5] * 1e3, x[6] * 1e3, x[5] * 1e3 / x[4], x[7] * 1e3] for x in self.ranking(n)]
+        return tabulate(table, headers=['id', 'task', 'calls', 'wall (ms)', 'cpu (ms)', 'mean (ms)', 'max (ms)'], floatfmt='.2f', stralign='left')
+
+    #
+    #
+    #
+    def dump(self, file_path: str) -> None:
+        """
+            writes the ranking of all the tasks and the cProfile summary to file_path,
+            the raw cProfile samples to file_path + '.prof' (pstats / snakeviz)
+        """
+        self.__mutex.acquire()
+        tasks = {identifier: (entry[0], entry[1], {p: list(entry[3][p]) for p in self.phases}) for identifier, entry in self.__tasks.items()}
+        stats = self.__stats
+        samples = self.__samples
+        self.__mutex.release()
+
+        with open(file_path, 'w') as fp:
+            fp.write(time.strftime('%Y-%m-%d %H:%M:%S') + '\n\n')
+            fp.write(self.report() + '\n\n')
+            table = []
+            for x in self.ranking():
+                if x[0] not in tasks:
+                    continue
+                class_name, description, phases = tasks[x[0]]
+                for p in self.phases:
+                    if phases[p][0] != 0:
+                        table.append([x[0], p, phases[p][0], phases[p][1] * 1e3, phases[p][2] * 1e3, phases[p][3] * 1e3])
+            fp.write(tabulate(table, headers=['id', 'phase', 'calls', 'wall (ms)', 'cpu (ms)', 'max (ms)'], floatfmt='.2f') + '\n\n')
+            for identifier in tasks:
+                fp.write(str(identifier) + ': ' + tasks[identifier][1] + '\n')
+            if stats is not None:
+                fp.write('\ncProfile (' + str(samples) + ' sampled calls)\n')
+                stream = io.StringIO()
+                self.__mutex.acquire()
+                stats.stream = stream
+                stats.sort_stats('cumulative').print_stats(40)
+                stats.dump_stats(file_path + '.prof')
+                self.__mutex.release()
+                fp.write(stream.getvalue())
@@ -0,0 +1,116 @@
+import datetime
+import json
+import operator
+from typing import Any
+
+
+#
+# versioned json form of the state() of the tasks (JobJournal)
+#
+#     each Task subclass declares
+#         state_schema     -> field: type of all the fields of state(), None is valid for any type
+#                                 int, float, str, bool
+#                                 json     = dict / list of int, float, str, bool, None
+#                                 datetime = timezone aware datetime.datetime (iso 8601 text)
+#         state_version    -> version of state_schema, increased at each change of the fields
+#         state_migrations -> version: f(json state of version) -> json state of version + 1
+#
+#     json form = list of the values in the order of state_schema (JobJournal stores the field names once per file)
+#
+state_types = ('int', 'float', 'str', 'bool', 'json', 'datetime')
+_json_types = {'int': {int, type(None)}, 'float': {float, int, type(None)}, 'str': {str, type(None)},
+               'bool': {bool, type(None)}, 'datetime': {str, type(None)}}
+_fields = dict()                # task class -> fields of state_schema, indexes of its datetime fields
+_encoder = json.JSONEncoder(separators=(',', ':'))
+
+
+#
+#
+#
+def encode_state(task_class: Any, state: dict) -> str:
+    """state() of a task_class instance -> json text of the json form (values in the order of state_schema)"""
+    fields, datetime_indexes = _schema_fields(task_class)
+    if tuple(state) == fields:
+        # built in the order of state_schema (fast path)
+        values = list(state.values())
+    elif state.keys() == set(fields):
+        values = [state[field] for field in fields]
+    else:
+        raise ValueError('encode_state: ' + task_class.__name__ + ' fields ' + str(sorted(state)) + ' do not match state_schema ' + str(sorted(fields)) + '.')
+    for j in datetime_indexes:
+        if values[j] is not None:
+            values[j] = values[j].isoformat()
+    return '[' + ','.join(map(_json_text, values)) + ']'
+
+
+#
+#
+#
+def _json_text(value: Any) -> str:
+    """-> json text of value (int, None and bool without the JSONEncoder call)"""
+    value_type = type(value)
+    if value_type is int:
+        return int.__repr__(value)
+    if value is None:
+        return 'null'
+    if value_type is bool:
+        return 'true' if value else 'false'
+    return _encoder.encode(value)
+
+
+#
+#
+#
+def decode_states(task_class: Any, version: int, fields: list, rows: list) -> list:
+    """
+        json form of version (rows of values in the order of fields) -> states of the current task_class version
+        (migrated and checked one column at a time)
+    """
+    name = task_class.__name__
+    schema = task_class.state_schema
+    if version > task_class.state_version:
+        raise ValueError('decode_states: ' + name + ' state version ' + str(version) + ' is newer than ' + str(task_class.state_version) + '.')
+    if len(set(map(len, rows)) - {len(fields)}) != 0:
+        raise ValueError('decode_states: ' + name + ' rows do not match the fields ' + str(fields) + '.')
+    if version < task_class.state_version or tuple(fields) != tuple(schema):
+        states = [dict(zip(fields, row)) for row in rows]
+        while version < task_class.state_version:
+            migration = task_class.state_migrations.get(version)
+            if migration is None:
+                raise ValueError('decode_states: ' + name + ' has no migration from version ' + str(version) + '.')
+            states = [migration(state) for state in states]
+            version += 1
+        for state in states:
+            if state.keys() != schema.keys():
+                raise ValueError('decode_states: ' + name + ' fields ' + str(sorted(state)) + ' do not match state_schema ' + str(sorted(schema)) + '.')
+        fields = tuple(schema)
+        rows = [[state[field] for field in fields] for state in states]
+
+    for j, (field, field_type) in enumerate(schema.items()):
+        if field_type == 'json':
+            continue
+        column = list(map(operator.itemgetter(j), rows))
+        wrong = set(map(type, column)) - _json_types[field_type]
+        if len(wrong) != 0:
+            value = next(value for value in column if type(value) in wrong)
+            raise ValueError('decode_states: ' + name + '.' + field + ' = ' + repr(value) + ' is not ' + field_type + '.')
+    fields, datetime_indexes = _schema_fields(task_class)
+    states = [dict(zip(fields, row)) for row in rows]
+    for j in datetime_indexes:
+        field = fields[j]
+        for state in states:
+            if state[field] is not None:
+                state[field] = datetime.datetime.fromisoformat(state[field])
+    return states
+
+
+#
+#
+#
+def _schema_fields(task_class: Any) -> tuple:
+    """-> fields of the state_schema of task_class, indexes of its datetime fields"""
+    fields = _fields.get(task_class)
+    if fields is None:
+        schema = task_class.state_schema
+        fields = _fields[task_class] = (tuple(schema), tuple(j for j, field_type in enumerate(schema.values()) if field_type == 'datetime'))
+    return fields
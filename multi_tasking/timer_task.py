@@ -10,6 +10,7 @@ from trade_interface import current_time
 #
 #
 class TimerTask(Task):
+    state_schema = {**Task.state_schema, '__utc_time': 'datetime'}
 
     #
     #
@@ -42,6 +43,18 @@ class TimerTask(Task):
         # not ready
         return False, [], None
 
+    #
+    #
+    #
+    def next_run_time(self) -> Optional[datetime.datetime]:
+        return self.__utc_time
+
+    #
+    #
+    #
+    def wake_up(self) -> None:
+        self.__utc_time = current_time()
+
     #
     #
     #
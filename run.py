@@ -4,9 +4,10 @@ import platform
 import sys
 import threading
 
+from metrics import MetricsServer
 from multi_tasking import JobServer, SubProcessManager
 from tasks import KeepConnectionAlive
-from trade_interface import TradeInterface
+from trade_interface import TradeInterface, ReplayBroker, simulate_market_session
 from trading_platform_servers import QuoteServer, GraphServer
 from trading_platform_shell import ShellServer
 
@@ -51,6 +52,7 @@ if __name__ == '__main__':
     # Parse command line.
     clear_jobs = False
     use_sandbox = False
+    use_replay = False
     for arg in sys.argv[1:]:
         if arg.lower() == 'clear':
             clear_jobs = True
@@ -58,11 +60,16 @@ if __name__ == '__main__':
         if arg.lower() == 'sandbox':
             use_sandbox = True
             print('Use sandbox.')
+        if arg.lower() == 'replay':
+            use_replay = True
+            print('Use replay broker (simulated account, no connection).')
 
     # Load keys.
     with open('keys.txt', 'r') as fp:
         keys = json.load(fp)
-        if (use_sandbox and keys['sandbox']['consumer_key'] == '') or (not use_sandbox and keys['production']['consumer_key'] == ''):
+        if use_replay:
+            pass
+        elif (use_sandbox and keys['sandbox']['consumer_key'] == '') or (not use_sandbox and keys['production']['consumer_key'] == ''):
             print('Consumer key and secret need to be set in keys.txt for the platform to connect to your account.')
             print('See README.md for additional information.')
             print('')
@@ -78,18 +85,59 @@ if __name__ == '__main__':
     browser_path = settings['browser_path_' + platform.system()]
     quote_update_time = settings['quote_update_time_sec']
     job___update_time = settings['job___update_time_sec']
+    job___workers = settings['job___workers']
+    job___checkpoint_interval_sec = settings['job___checkpoint_interval_sec']
+    job___journal_compact_records = settings['job___journal_compact_records']
+    job___profiling = settings['job___profiling']
 
     # Start JobServer.
     job_server = JobServer()
-    job_server.load_or_create(status_file_path='status.pickle', clear_jobs=clear_jobs)
+    job_server.load_or_create(status_file_path='status.journal', clear_jobs=clear_jobs, legacy_status_file_path='status.pickle')
     job_server.time_frequency_sec = job___update_time
+    job_server.max_workers = job___workers
+    job_server.checkpoint_interval_sec = job___checkpoint_interval_sec
+    job_server.journal_compact_records = job___journal_compact_records
+    job_server.profiler.enabled = job___profiling['enabled']
+    job_server.profiler.cprofile_sample_rate = job___profiling['cprofile_sample_rate']
+    job_server.profiler.top_n = job___profiling['top_n']
+    job_server.profiler.file_path = job___profiling['file']
 
     # Init TradeInterface.
-    trade_interface = TradeInterface(keys=keys, use_sandbox=use_sandbox, browser_path=browser_path)
+    trade_interface = TradeInterface(keys=keys, use_sandbox=use_sandbox, browser_path=browser_path, concurrency=settings['trade_concurrency'])
+    trade_interface.order_cache_max_age_sec = settings['order_cache_max_age_sec']
+    trade_interface.transport = settings['transport']
+    trade_interface.use_async_api = settings['use_async_api']
+    if use_replay:
+        replay_settings = settings['replay']
+        trade_interface.replay_broker = ReplayBroker(latency_sec=replay_settings['latency_sec'],
+                                                     jitter_sec=replay_settings['jitter_sec'],
+                                                     error_rate=replay_settings['error_rate'],
+                                                     seed=replay_settings['seed'],
+                                                     cash=replay_settings['cash'],
+                                                     positions=replay_settings['positions'],
+                                                     recorded_quotes=replay_settings['recorded_quotes'])
+        if replay_settings['http']:
+            trade_interface.replay_broker.start_http_server()
+        simulate_market_session(replay_settings['market_session'])
 
     # Init QuoteServer.
     quote_server = QuoteServer(trade_interface)
-    QuoteServer.time_frequency_sec = quote_update_time
+    quote_server.time_frequency_sec = quote_update_time
+    quote_server.max_requests_per_sec = settings['quote_max_requests_per_sec']
+    quote_server.tick_directory = settings['quote_tick_directory']
+    quote_server.tick_policy = settings['quote_ticker']['policy']
+    quote_server.tick_max_burst = settings['quote_ticker']['max_burst']
+    quote_server.tick_adaptive = settings['quote_ticker']['adaptive']
+    quote_server.tick_max_interval_sec = settings['quote_ticker']['max_interval_sec']
+    quote_server.tick_latency_factor = settings['quote_ticker']['latency_factor']
+
+    # Init MetricsServer.
+    metrics_settings = settings['metrics']
+    metrics_server = MetricsServer(file_path=metrics_settings['file'],
+                                   interval_sec=metrics_settings['interval_sec'],
+                                   http_port=metrics_settings['http_port'])
+    if metrics_server.http_url is not None:
+        print('Metrics at ' + metrics_server.http_url)
 
     # Init GraphServer
     graph_server = GraphServer()
@@ -125,10 +173,11 @@ if __name__ == '__main__':
             trade_interface.select_account()
             job_server.add(KeepConnectionAlive(job_server.next_valid_task_id()))
 
-        # Start job_server, quote_server, shell_server.
+        # Start job_server, quote_server, shell_server, metrics_server.
         job_server.start()
         quote_server.start()
         shell_server.start()
+        metrics_server.start()
 
         # Main Loop.
         graph_server.loop()
@@ -148,11 +197,24 @@ if __name__ == '__main__':
             job_server.join()
             job_server.list_done_tasks()
 
+        # Save the job profile.
+        if job_server.profiler.enabled:
+            try:
+                job_server.profiler.dump(job_server.profiler.file_path)
+                print('Job profile saved in ' + job_server.profiler.file_path)
+            except OSError as e:
+                print('Job profile: ' + str(e))
+
         # Stop quote_server.
         if quote_server.is_alive():
             quote_server.quit()
             quote_server.join()
 
+        # Stop metrics_server (last dump).
+        if metrics_server.is_alive():
+            metrics_server.quit()
+            metrics_server.join()
+
         # Stop trade_interface.
         if not offline:
             try:
@@ -162,6 +224,10 @@ if __name__ == '__main__':
                 print('Trading platform disconnection: FAILED')
                 print(str(e))
 
+        # Stop replay broker.
+        if trade_interface.replay_broker is not None:
+            trade_interface.replay_broker.stop_http_server()
+
         # Kill all quote_figure in manager.
         quote_figure_manager.remove_all()
 
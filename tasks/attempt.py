@@ -8,6 +8,7 @@ from multi_tasking import TimerTask
 #
 #
 class Attempt(TimerTask):
+    state_schema = {**TimerTask.state_schema, 'operation_started': 'bool'}
     operation_started = None
 
     def __init__(self, identifier, state=None):
@@ -1,18 +1,26 @@
 import datetime
+from functools import partial
 from typing import Optional, Any
 
 import numpy
 
 from multi_tasking import Task, TimerTask, JobServer
 from trade_interface import next_session, market_session
+from trading_platform_servers import TickBuffer
 
 
 #
 #
 #
 class FollowSymbolTask(TimerTask):
+    state_schema = {**TimerTask.state_schema, 'symbol': 'str'}
+    quote_freshness_sec = None          # max age of the quotes (None = every QuoteServer tick), see _quote_freshness_sec
     _symbol = None
     __following_symbol = None
+    __freshness_sec = None              # freshness passed to add_quote (the same one goes to remove_quote)
+    __quote_listener = None
+    __history = None
+    __cursor = None
 
     #
     #
@@ -20,6 +28,9 @@ class FollowSymbolTask(TimerTask):
     def __init__(self, identifier: int, state: dict = None):
         super().__init__(identifier, state)
         self.__following_symbol = False
+        self.__quote_listener = None
+        self.__history = None
+        self.__cursor = 0
         if state is not None:
             self._symbol = state['symbol']
         else:
@@ -45,27 +56,44 @@ class FollowSymbolTask(TimerTask):
         # closed market
         #
         if market_session() == 'NO_TRADE':
-            if self.__following_symbol:
-                data['quote_server'].remove_quote(self._symbol)
-                self.__following_symbol = False
+            self._unfollow_symbol(data)
             return False, next_session()
 
         #
         # open market
         #
         if not self.__following_symbol:
-            data['quote_server'].add_quote(self._symbol)
+            self.__freshness_sec = self._quote_freshness_sec()
+            data['quote_server'].add_quote(self._symbol, self.__freshness_sec)
             self.__following_symbol = True
+        if self.__quote_listener is None:
+            # new quotes wake up the job
+            self.__quote_listener = partial(data['job_server'].wake_up, self.identifier)
+            data['quote_server'].add_symbol_listener(self._symbol, self.__quote_listener)
         return True, None
 
     #
     #
     #
     def _unfollow_symbol(self, data: Any) -> None:
+        if self.__quote_listener is not None:
+            data['quote_server'].remove_symbol_listener(self._symbol, self.__quote_listener)
+            self.__quote_listener = None
         if self.__following_symbol:
-            data['quote_server'].remove_quote(self._symbol)
+            data['quote_server'].remove_quote(self._symbol, self.__freshness_sec)
             self.__following_symbol = False
 
+    #
+    #
+    #
+    def _quote_freshness_sec(self) -> Optional[float]:
+        """
+            max age of the quotes of the symbol (None = every QuoteServer tick)
+            a task that looks at the price every few seconds asks for that period, the symbol
+            is then fetched in the background and not at every tick
+        """
+        return self.quote_freshness_sec
+
     #
     #
     #
@@ -79,12 +107,17 @@ class FollowSymbolTask(TimerTask):
         self._symbol = task._symbol
         if task.__following_symbol:
             self.__following_symbol = True
+            self.__freshness_sec = task.__freshness_sec
             task.__following_symbol = False
 
     #
     #
     #
-    def _pre_process_data(self, data: Any):
+    def _pre_process_data(self, data: Any) -> (numpy.ndarray, numpy.ndarray):
+        """
+            -> times, prices of the history of the symbol since the last gap
+               (read-only views of the history, valid until the next call)
+        """
         #
         # TODO check that quote_server does not have gap between time
         # TODO otherwise it will look like a big jump
@@ -96,13 +129,30 @@ class FollowSymbolTask(TimerTask):
         # from pykalman -> Kalman and Unscented
         # Kalma
 
-        data_x, data_y = data['quote_server'].get_quote(symbol=self._symbol, all_data=True)
-        derivative = numpy.abs(data_x[1:] - data_x[:-1])
-        occurrences = numpy.where(derivative >= 3 * data['quote_server'].time_frequency_sec)
+        quote_server = data['quote_server']
+        if self.__history is None:
+            self.__history = TickBuffer(quote_server.maxlen, mirrored=True)
+
+        # only the samples added after the previous call
+        new_x, new_y, self.__cursor = quote_server.get_quote_since(self._symbol, self.__cursor)
+        if new_x is None or len(new_x) == 0:
+            return self.__history.view()
+
+        # restart the history after the last gap
+        interval_sec = quote_server.quote_interval_sec(self._symbol) or quote_server.tick_interval_sec
+        max_gap = numpy.timedelta64(int(3 * interval_sec * 1e9), 'ns')
+        if len(self.__history) != 0:
+            last_x, _ = self.__history.view(1)
+            new_x_ = numpy.concatenate((last_x, new_x))
+        else:
+            new_x_ = numpy.concatenate((new_x[:1], new_x))
+        occurrences = numpy.nonzero(numpy.diff(new_x_) >= max_gap)[0]
         if len(occurrences) != 0:
-            data_x = data_x[occurrences[-1]:]
-            data_y = data_y[occurrences[-1]:]
-        return data_x, data_y
+            self.__history = TickBuffer(quote_server.maxlen, mirrored=True)
+            new_x = new_x[occurrences[-1]:]
+            new_y = new_y[occurrences[-1]:]
+        self.__history.extend(new_x, new_y)
+        return self.__history.view()
 
     #
     #
@@ -9,6 +9,7 @@ from trade_interface import datetime_delay, next_session, market_session
 #
 #
 class OrderWhenOpen(Attempt):
+    state_schema = {**Attempt.state_schema, 'order_data': 'json'}
     order_data = None
 
     def __init__(self, identifier, state=None):
@@ -9,6 +9,7 @@ from trade_interface import datetime_delay
 #
 #
 class SellTrailing(FollowSymbolTask):
+    state_schema = {**FollowSymbolTask.state_schema, '__order_data': 'json'}
     __order_data = None
 
     def __init__(self, identifier, state=None):
@@ -19,7 +20,7 @@ class SellTrailing(FollowSymbolTask):
             self.__order_data = dict()
 
     def set_order_data(self, symbol, qty, margin, order_term, prev_order_id, update_freq):
-        self.symbol = symbol
+        self._symbol = symbol
         self.__order_data['quantity'] = qty
         self.__order_data['margin'] = margin
         self.__order_data['order_term'] = order_term
@@ -27,7 +28,7 @@ class SellTrailing(FollowSymbolTask):
         self.__order_data['update_freq'] = update_freq
 
     def __str__(self) -> str:
-        return super().__str__() + '  ' + 'SELL'.ljust(9) + ' ' + self.symbol.ljust(5) + ' margin = ' + str(self.__order_data['margin'] * 100.0) + '%' + '  qty = ' + str(self.__order_data['quantity'])
+        return super().__str__() + '  ' + 'SELL'.ljust(9) + ' ' + self._symbol.ljust(5) + ' margin = ' + str(self.__order_data['margin'] * 100.0) + '%' + '  qty = ' + str(self.__order_data['quantity'])
 
     def state(self) -> Optional[dict]:
         c_state = super().state()
@@ -39,7 +40,7 @@ class SellTrailing(FollowSymbolTask):
         limit_price = round(limit_price, 2)
 
         try:
-            # order_no, msg = trade.place_limit_order(action='SELL', symbol=self.symbol, quantity=self.__order_data['quantity'], limit_price=limit_price, order_term=self.__order_data['order_term'], prev_order_id=self.__order_data['prev_order_id'], session=market_session())
+            # order_no, msg = trade.place_limit_order(action='SELL', symbol=self._symbol, quantity=self.__order_data['quantity'], limit_price=limit_price, order_term=self.__order_data['order_term'], prev_order_id=self.__order_data['prev_order_id'], session=market_session())
             # TODO
             msg = 'limit_price = ' + str(limit_price) + '   '
             order_no = 0
@@ -94,7 +95,7 @@ class SellTrailing(FollowSymbolTask):
         #
         #
         #
-        data_x, data_y = data['quote_server'].get_quote(symbol=self.symbol, all_data=False)
+        data_x, data_y = data['quote_server'].get_quote(symbol=self._symbol, all_data=False)
         if len(data_y) == 0:
             return False, [], None, datetime_delay(seconds=self.__order_data['update_freq'])
         data_x = data_x[0]
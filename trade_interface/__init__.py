@@ -1,3 +1,4 @@
-from trade_interface.market_session import market_session, next_session, market_session_extended_info, datetime_delay, current_time
+from trade_interface.market_session import market_session, next_session, market_session_extended_info, simulate_market_session, datetime_delay, current_time, time_from_epoch_ns, market_timezone
+from trade_interface.replay_broker import ReplayBroker, ReplaySession
 from trade_interface.trade_interface import TradeInterface
 from trade_interface.utils import format_order_action
@@ -1,8 +1,14 @@
+import time
+import urllib.parse
 from typing import Tuple, List, Optional, Union, Any, Sequence, Dict
 
 import xmltodict
 from requests_oauthlib import OAuth1Session, requests
 
+from metrics import counter, histogram
+from trade_interface.e_trade_json import parse_response as parse_json_response, dumps as dumps_json
+from trade_interface.e_trade_xml import parse_quotes, parse_orders, parse_positions
+
 
 #
 #
@@ -22,9 +28,14 @@ class EtradeAuthorization:
         return self.__auth_session.fetch_access_token('https://api.etrade.com/oauth/access_token', verifier=verifier)
 
     @staticmethod
-    def get_session(consumer_key: str, consumer_secret: str, tokens: dict) -> OAuth1Session:
-        return OAuth1Session(consumer_key, consumer_secret, tokens['oauth_token'],
-                             tokens['oauth_token_secret'], signature_type='AUTH_HEADER')
+    def get_session(consumer_key: str, consumer_secret: str, tokens: dict, pool_size: int = 16) -> OAuth1Session:
+        session = OAuth1Session(consumer_key, consumer_secret, tokens['oauth_token'],
+                                tokens['oauth_token_secret'], signature_type='AUTH_HEADER')
+        # Keep-alive connections shared by all threads.
+        # Retries are handled by EtradeApi so that each attempt is signed again.
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        session.mount('https://', adapter)
+        return session
 
 
 #
@@ -33,21 +44,93 @@ class EtradeAuthorization:
 class EtradeApi:
     QuoteData = Tuple[str, Dict[str, float]]
 
+    # pool_size    : connections kept alive per host
+    # timeout_sec  : per endpoint (connect, read) timeout
+    # retries      : retries of idempotent requests (GET) on connection errors and 5xx
+    # backoff_sec  : wait before the first retry, doubled at every retry
+    # format       : xml or json, format of responses and order payloads (same results)
+    # base_url     : replaces the E*Trade url (e.g. ReplayBroker http stand-in)
+    # streaming_parser : xml quotes, orders and portfolio are parsed by e_trade_xml (only the needed fields)
+    #                    instead of xmltodict
+    #
+    # metrics: broker.<endpoint> (latency, retries included), broker.<endpoint>.retries, broker.<endpoint>.errors
+    default_transport = {
+        'pool_size': 16,
+        'timeout_sec': {'default': 10.0, 'quote': 3.0, 'orders': 10.0, 'balance': 5.0, 'portfolio': 5.0, 'accounts': 10.0, 'order_placement': 15.0},
+        'retries': 2,
+        'backoff_sec': 0.25,
+        'format': 'xml',
+        'base_url': None,
+    }
+    data_formats = ('xml', 'json')
+    retry_status = (500, 502, 503, 504)
+    base_url_dev = 'https://apisb.etrade.com/v1/'
+    base_url_prod = 'https://api.etrade.com/v1/'
+    revoke_url = 'https://api.etrade.com/oauth/revoke_access_token'
+    streaming_parser = True
+
+    #
+    #
+    #
+    def __init__(self, session: OAuth1Session, use_product_key: bool, transport: Optional[dict] = None):
+        self.__use_product_key = use_product_key
+        self.__base_url_dev = self.base_url_dev
+        self.__base_url_prod = self.base_url_prod
+        self.__session = session
+        self.__transport = dict(self.default_transport)
+        if transport is not None:
+            self.__transport.update(transport)
+            self.__transport['timeout_sec'] = dict(self.default_transport['timeout_sec'], **transport.get('timeout_sec', {}))
+        self.__format = self.__transport['format']
+        if self.__format not in self.data_formats:
+            raise ValueError('__init__: invalid format ' + str(self.__format) + '.')
+        self.__revoke_url = self.revoke_url
+        if self.__transport['base_url']:
+            self.__base_url_dev = self.__transport['base_url']
+            self.__base_url_prod = self.__transport['base_url']
+            self.__revoke_url = urllib.parse.urljoin(self.__transport['base_url'], '/oauth/revoke_access_token')
+
     #
     #
     #
-    def __init__(self, session: OAuth1Session, use_product_key: bool):
-        self.__use_product_key = use_product_key
-        self.__base_url_dev = 'https://apisb.etrade.com/v1/'
-        self.__base_url_prod = 'https://api.etrade.com/v1/'
-        self.__session = session
+    def __timeout(self, endpoint: str) -> float:
+        timeouts = self.__transport['timeout_sec']
+        return timeouts.get(endpoint, timeouts['default'])
+
+    #
+    #
+    #
+    def __get(self, endpoint: str, api_url: str, params: Optional[dict] = None) -> requests.models.Response:
+        """GET with timeout and retry/backoff (GET requests are idempotent)."""
+        retries = self.__transport['retries']
+        backoff_sec = self.__transport['backoff_sec']
+        headers = {'Accept': 'application/json'} if self.__format == 'json' else None
+        t0 = time.perf_counter()
+        attempt = 0
+        try:
+            while True:
+                try:
+                    resp = self.__session.get(api_url, params=params, headers=headers, timeout=self.__timeout(endpoint))
+                    if resp.status_code not in self.retry_status or attempt >= retries:
+                        if resp.status_code >= 400:
+                            counter('broker.' + endpoint + '.errors').inc()
+                        return resp
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                    if attempt >= retries:
+                        counter('broker.' + endpoint + '.errors').inc()
+                        raise
+                counter('broker.' + endpoint + '.retries').inc()
+                time.sleep(backoff_sec * (2 ** attempt))
+                attempt += 1
+        finally:
+            histogram('broker.' + endpoint).observe(time.perf_counter() - t0)
 
     #
     #
     #
     def revoke_access_token(self) -> None:
         """Revokes access token."""
-        resp = self.__session.get('https://api.etrade.com/oauth/revoke_access_token')
+        resp = self.__session.get(self.__revoke_url, timeout=self.__timeout('default'))
         resp.raise_for_status()
         resp = xmltodict.parse(resp.text)
         if 'Error' in resp:          # TODO Not fully tested.
@@ -66,7 +149,7 @@ class EtradeApi:
     #
     #
     @staticmethod
-    def __to_list(list_or_object: Union[Sequence, Any]) -> List[Any]:
+    def _to_list(list_or_object: Union[Sequence, Any]) -> List[Any]:
         if isinstance(list_or_object, list):
             return list_or_object
         if isinstance(list_or_object, tuple):
@@ -88,9 +171,15 @@ class EtradeApi:
             Amount of cash not settled
         """
         api_url = self.__get_url('accounts/' + account_id + '/balance?instType=BROKERAGE&realTimeNAV=true')
-        resp = self.__session.get(api_url)
+        resp = self.__get('balance', api_url)
 
-        info = self.__retrieve_response(resp)
+        return self._parse_balance(self.__retrieve_response(resp))
+
+    #
+    #
+    #
+    @staticmethod
+    def _parse_balance(info: dict) -> Tuple[float, float, float]:
         info = info['BalanceResponse']['Computed']
         return (float(info['RealTimeValues']['totalAccountValue']),
                 float(info['settledCashForInvestment']),
@@ -106,10 +195,16 @@ class EtradeApi:
             A list of (account number, account id, account description, account key)
         """
         api_url = self.__get_url('accounts/list')
-        resp = self.__session.get(api_url)
+        resp = self.__get('accounts', api_url)
 
-        accounts = self.__retrieve_response(resp)
-        accounts = self.__to_list(accounts['AccountListResponse']['Accounts']['Account'])
+        return self._parse_accounts(self.__retrieve_response(resp))
+
+    #
+    #
+    #
+    @staticmethod
+    def _parse_accounts(accounts: dict) -> List[Tuple[int, int, str, str]]:
+        accounts = EtradeApi._to_list(accounts['AccountListResponse']['Accounts']['Account'])
         accounts = [(i, accounts[i]['accountId'], accounts[i]['accountDesc'], accounts[i]['accountIdKey']) for i in range(len(accounts))]
         return accounts
 
@@ -127,10 +222,19 @@ class EtradeApi:
         """
         # TODO Paging is not implemented.
         api_url = self.__get_url('accounts/' + str(account_id) + '/portfolio')
-        resp = self.__session.get(api_url)
+        resp = self.__get('portfolio', api_url)
 
-        positions = self.__retrieve_response(resp)
-        positions = self.__to_list(positions['PortfolioResponse']['AccountPortfolio']['Position'])
+        if self.streaming_parser and self.__format == 'xml':
+            resp.raise_for_status()
+            return parse_positions(resp.content)
+        return self._parse_positions(self.__retrieve_response(resp))
+
+    #
+    #
+    #
+    @staticmethod
+    def _parse_positions(positions: dict) -> List[Tuple[str, float, float, float]]:
+        positions = EtradeApi._to_list(positions['PortfolioResponse']['AccountPortfolio']['Position'])
         positions = [(
             p['Product']['symbol'].strip().upper(),
             float(p['quantity']),
@@ -142,7 +246,7 @@ class EtradeApi:
     #
     #
     @staticmethod
-    def __format_quote(data: dict, label: str) -> Dict[str, float]:
+    def _format_quote(data: dict, label: str) -> Dict[str, float]:
         export_data = {'ask': float(data['ask']),
                        'bid': float(data['bid']),
                        'high': float(data['high']),
@@ -182,30 +286,40 @@ class EtradeApi:
 
         api_url = self.__get_url('market/quote/' + ','.join(symbols))
         params = {'detailFlag': 'ALL'} if not only_intraday_data else {'detailFlag': 'INTRADAY'}
-        resp = self.__session.get(api_url, params=params)
+        resp = self.__get('quote', api_url, params=params)
 
-        data = self.__retrieve_response(resp)
+        if self.streaming_parser and self.__format == 'xml':
+            resp.raise_for_status()
+            return parse_quotes(resp.content, only_intraday_data)
+        return self._parse_quotes(self.__retrieve_response(resp), only_intraday_data)
+
+    #
+    #
+    #
+    @staticmethod
+    def _parse_quotes(data: dict, only_intraday_data: bool) -> List[QuoteData]:
         data = data['QuoteResponse']['QuoteData']
         label = 'All' if not only_intraday_data else 'Intraday'
         if isinstance(data, dict):
-            return [(data['Product']['symbol'], self.__format_quote(data[label], label))]
+            return [(data['Product']['symbol'], EtradeApi._format_quote(data[label], label))]
         else:
-            return [(x['Product']['symbol'], self.__format_quote(x[label], label)) for x in data]
+            return [(x['Product']['symbol'], EtradeApi._format_quote(x[label], label)) for x in data]
 
     #
     #
     #
-    def list_orders(self, account_id: str, count: int, marker: Optional[int]) -> Tuple[Sequence[dict], Optional[int]]:
+    def list_orders(self, account_id: str, count: int, marker: Optional[str]) -> Tuple[Sequence[dict], Optional[str]]:
         """Retrieves all orders.
 
         Args:
             account_id: Id of the account where the request has to be performed.
             count: Number of orders to retrieve.
-            marker: Marker of the first order to retrieve.
+            marker: Marker of the first order to retrieve (returned with the
+                previous page, opaque).
 
         Returns:
             order_data: List of orders.
-            current_marker: Next marker.
+            current_marker: Marker of the next page, None on the last page.
         """
         api_url = self.__get_url('accounts/' + account_id + '/orders')
 
@@ -213,15 +327,23 @@ class EtradeApi:
         if marker is not None:
             params['marker'] = marker
 
-        resp = self.__session.get(api_url, params=params)
+        resp = self.__get('orders', api_url, params=params)
 
-        resp = self.__retrieve_response(resp)
-        resp = resp['OrdersResponse']
+        if self.streaming_parser and self.__format == 'xml':
+            resp.raise_for_status()
+            return parse_orders(resp.content)
+        return self._parse_orders(self.__retrieve_response(resp))
+
+    #
+    #
+    #
+    @staticmethod
+    def _parse_orders(resp: dict) -> Tuple[Sequence[dict], Optional[str]]:
+        resp = resp['OrdersResponse'] or {}     # no orders -> empty response
         current_marker = None
-        if 'marker' in resp:
-            if len(resp['marker']) != 0:
-                current_marker = int(resp['marker'])
-        order_list = self.__to_list(resp['Order'])
+        if resp.get('marker'):
+            current_marker = str(resp['marker'])
+        order_list = EtradeApi._to_list(resp.get('Order', []))
 
         order_data = []
         for o in order_list:
@@ -253,7 +375,7 @@ class EtradeApi:
     #
     #
     @staticmethod
-    def __check_order(**kwargs) -> None:
+    def _check_order(**kwargs) -> None:
         mandatory = [
             'accountId',
             'symbol',
@@ -265,22 +387,22 @@ class EtradeApi:
             'marketSession',
         ]
         if not all(param in kwargs for param in mandatory):
-            raise ValueError('__check_order: input parameters missing.')
+            raise ValueError('_check_order: input parameters missing.')
 
         if kwargs['priceType'] == 'STOP' and 'stopPrice' not in kwargs:
-            raise ValueError('__check_order: stopPrice missing.')
+            raise ValueError('_check_order: stopPrice missing.')
         if kwargs['priceType'] == 'LIMIT' and 'limitPrice' not in kwargs:
-            raise ValueError('__check_order: limitPrice missing.')
+            raise ValueError('_check_order: limitPrice missing.')
         if (kwargs['priceType'] == 'STOP_LIMIT'
                 and 'limitPrice' not in kwargs
                 and 'stopPrice' not in kwargs):
-            raise ValueError('__check_order: stopPrice or limitPrice missing.')
+            raise ValueError('_check_order: stopPrice or limitPrice missing.')
 
     #
     #
     #
     @staticmethod
-    def __build_order_payload(order_type: str, **kwargs) -> dict:
+    def _build_order_payload(order_type: str, **kwargs) -> dict:
         instrument = {
             'Product': {'securityType': 'EQ',
                         'symbol': kwargs['symbol']},
@@ -304,14 +426,22 @@ class EtradeApi:
     #
     #
     #
-    @staticmethod
-    def __retrieve_response(resp: requests.models.Response) -> dict:
+    def __retrieve_response(self, resp: requests.models.Response) -> dict:
         resp.raise_for_status()
-        resp = xmltodict.parse(resp.text)
+        return self._parse_response(resp.content, data_format=self.__format)
+
+    #
+    #
+    #
+    @staticmethod
+    def _parse_response(text: Union[str, bytes], check_messages: bool = True, data_format: str = 'xml') -> dict:
+        if data_format == 'json':
+            return parse_json_response(text, check_messages)
+        resp = xmltodict.parse(text)
         # TODO Not fully tested.
-        if len(resp.keys()) == 1:
+        if check_messages and len(resp.keys()) == 1:
             body = resp[next(iter(resp))]
-            if len(body.keys()) == 1:
+            if isinstance(body, dict) and len(body.keys()) == 1:
                 if 'Messages' in body:
                     raise ValueError(body['Messages']['Message']['description'])
         if 'Error' in resp:
@@ -321,43 +451,58 @@ class EtradeApi:
     #
     #
     #
-    def __perform_request(self, request_type: str, api_url: str, payload: dict) -> dict:
-        headers = {'Content-Type': 'application/xml'}
-        payload = xmltodict.unparse(payload, encoding='utf-8')
+    @staticmethod
+    def _encode_payload(payload: dict, data_format: str = 'xml') -> Tuple[str, dict]:
+        """Returns the request body and its headers."""
+        if data_format == 'json':
+            return dumps_json(payload), {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        return xmltodict.unparse(payload, encoding='utf-8'), {'Content-Type': 'application/xml'}
+
+    #
+    #
+    #
+    def __perform_request(self, endpoint: str, request_type: str, api_url: str, payload: dict) -> dict:
+        payload, headers = self._encode_payload(payload, self.__format)
         resp = None
-        if request_type == 'post':
-            resp = self.__session.post(api_url, data=payload, headers=headers)
-        if request_type == 'put':
-            resp = self.__session.put(api_url, data=payload, headers=headers)
-        if resp is not None:
-            resp.raise_for_status()
-            resp = xmltodict.parse(resp.text)
-            if 'Error' in resp:
-                raise ValueError(resp['Error']['message'])
-        else:
-            raise ValueError('__perform_request: invalid value in request_type.')
+        timeout = self.__timeout('order_placement')
+        t0 = time.perf_counter()
+        try:
+            if request_type == 'post':
+                resp = self.__session.post(api_url, data=payload, headers=headers, timeout=timeout)
+            if request_type == 'put':
+                resp = self.__session.put(api_url, data=payload, headers=headers, timeout=timeout)
+            if resp is not None:
+                resp.raise_for_status()
+                resp = self._parse_response(resp.content, check_messages=False, data_format=self.__format)
+            else:
+                raise ValueError('__perform_request: invalid value in request_type.')
+        except Exception:
+            counter('broker.' + endpoint + '.errors').inc()
+            raise
+        finally:
+            histogram('broker.' + endpoint).observe(time.perf_counter() - t0)
         return resp
 
     #
     #
     #
     def __generate_order_preview(self, **kwargs) -> int:
-        self.__check_order(**kwargs)
+        self._check_order(**kwargs)
         api_url = self.__get_url('accounts/' + kwargs['accountId'] + '/orders/preview')
-        payload = self.__build_order_payload(order_type='PreviewOrderRequest', **kwargs)
+        payload = self._build_order_payload(order_type='PreviewOrderRequest', **kwargs)
 
-        resp = self.__perform_request(request_type='post', api_url=api_url, payload=payload)
+        resp = self.__perform_request(endpoint='order_preview', request_type='post', api_url=api_url, payload=payload)
         return int(resp['PreviewOrderResponse']['PreviewIds']['previewId'])
 
     #
     #
     #
     def __generate_change_order_preview(self, **kwargs) -> int:
-        self.__check_order(**kwargs)
+        self._check_order(**kwargs)
         api_url = self.__get_url('accounts/' + kwargs['accountId'] + '/orders/' + str(kwargs['orderId']) + '/change/preview')
-        payload = self.__build_order_payload(order_type='PreviewOrderRequest', **kwargs)
+        payload = self._build_order_payload(order_type='PreviewOrderRequest', **kwargs)
 
-        resp = self.__perform_request(request_type='put', api_url=api_url, payload=payload)
+        resp = self.__perform_request(endpoint='order_change_preview', request_type='put', api_url=api_url, payload=payload)
         return int(resp['PreviewOrderResponse']['PreviewIds']['previewId'])
 
     #
@@ -382,7 +527,7 @@ class EtradeApi:
         Returns:
             Order number.
         """
-        self.__check_order(**kwargs)
+        self._check_order(**kwargs)
 
         if 'prev_order_id' in kwargs:
             prev_order_id = kwargs.pop('prev_order_id')
@@ -394,24 +539,24 @@ class EtradeApi:
             kwargs['previewId'] = self.__generate_order_preview(**kwargs)
 
         api_url = self.__get_url('accounts/' + kwargs['accountId'] + '/orders/place')
-        payload = self.__build_order_payload(order_type='PlaceOrderRequest', **kwargs)
+        payload = self._build_order_payload(order_type='PlaceOrderRequest', **kwargs)
 
-        resp = self.__perform_request(request_type='post', api_url=api_url, payload=payload)
+        resp = self.__perform_request(endpoint='order_place', request_type='post', api_url=api_url, payload=payload)
         return int(resp['PlaceOrderResponse']['OrderIds']['orderId'])
 
     #
     #
     #
     def __change_equity_order(self, **kwargs) -> int:
-        self.__check_order(**kwargs)
+        self._check_order(**kwargs)
 
         if 'previewId' not in kwargs:
             kwargs['previewId'] = self.__generate_change_order_preview(**kwargs)
 
         api_url = self.__get_url('accounts/' + kwargs['accountId'] + '/orders/' + str(kwargs['orderId']) + '/change/place')
-        payload = self.__build_order_payload(order_type='PlaceOrderRequest', **kwargs)
+        payload = self._build_order_payload(order_type='PlaceOrderRequest', **kwargs)
 
-        resp = self.__perform_request(request_type='put', api_url=api_url, payload=payload)
+        resp = self.__perform_request(endpoint='order_change', request_type='put', api_url=api_url, payload=payload)
         return int(resp['PlaceOrderResponse']['OrderIds']['orderId'])
 
     #
@@ -430,5 +575,5 @@ class EtradeApi:
         api_url = self.__get_url('accounts/' + account_id + '/orders/cancel')
         payload = {'CancelOrderRequest': {'orderId': order_id}}
 
-        resp = self.__perform_request(request_type='put', api_url=api_url, payload=payload)
+        resp = self.__perform_request(endpoint='order_cancel', request_type='put', api_url=api_url, payload=payload)
         return resp['CancelOrderResponse']['Messages']['Message']['description']
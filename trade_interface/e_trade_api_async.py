@@ -0,0 +1,384 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+import urllib.parse
+from typing import Tuple, List, Optional, Sequence, Awaitable
+
+import aiohttp
+from oauthlib import oauth1
+from yarl import URL
+
+from metrics import counter, histogram
+from trade_interface.e_trade_api import EtradeApi
+from trade_interface.e_trade_xml import parse_quotes, parse_orders, parse_positions
+
+
+#
+#
+#
+class AsyncEtradeApi:
+    """
+        - asyncio version of EtradeApi (same methods, same results)
+        - one aiohttp session (connection pool) shared by all the requests in flight
+        - requests are signed with OAuth1 (AUTH_HEADER) one by one, so retries are signed again
+        - open() and all the methods must be called from the same event loop
+        - same metrics of EtradeApi (broker.<endpoint>)
+    """
+    QuoteData = EtradeApi.QuoteData
+
+    __client = None
+    __session = None
+    __transport = None
+    __format = None
+    __base_url = None
+    __revoke_url = None
+
+    #
+    #
+    #
+    def __init__(self, consumer_key: str, consumer_secret: str, tokens: dict, use_product_key: bool, transport: Optional[dict] = None):
+        self.__client = oauth1.Client(consumer_key, client_secret=consumer_secret,
+                                      resource_owner_key=tokens['oauth_token'],
+                                      resource_owner_secret=tokens['oauth_token_secret'],
+                                      signature_type=oauth1.SIGNATURE_TYPE_AUTH_HEADER)
+        self.__session = None
+        self.__transport = dict(EtradeApi.default_transport)
+        if transport is not None:
+            self.__transport.update(transport)
+            self.__transport['timeout_sec'] = dict(EtradeApi.default_transport['timeout_sec'], **transport.get('timeout_sec', {}))
+        self.__format = self.__transport['format']
+        if self.__format not in EtradeApi.data_formats:
+            raise ValueError('__init__: invalid format ' + str(self.__format) + '.')
+        self.__base_url = EtradeApi.base_url_prod if use_product_key else EtradeApi.base_url_dev
+        self.__revoke_url = EtradeApi.revoke_url
+        if self.__transport['base_url']:
+            self.__base_url = self.__transport['base_url']
+            self.__revoke_url = urllib.parse.urljoin(self.__transport['base_url'], '/oauth/revoke_access_token')
+
+    #
+    #
+    #
+    async def open(self) -> None:
+        if self.__session is None:
+            pool_size = self.__transport['pool_size']
+            connector = aiohttp.TCPConnector(limit=pool_size, limit_per_host=pool_size)
+            self.__session = aiohttp.ClientSession(connector=connector)
+
+    #
+    #
+    #
+    async def close(self) -> None:
+        if self.__session is not None:
+            await self.__session.close()
+            self.__session = None
+
+    #
+    #
+    #
+    def __timeout(self, endpoint: str) -> aiohttp.ClientTimeout:
+        timeouts = self.__transport['timeout_sec']
+        return aiohttp.ClientTimeout(total=timeouts.get(endpoint, timeouts['default']))
+
+    #
+    #
+    #
+    def __get_url(self, command: str = '') -> str:
+        return self.__base_url + command
+
+    #
+    #
+    #
+    def __sign(self, method: str, api_url: str, params: Optional[dict] = None, headers: Optional[dict] = None) -> Tuple[URL, dict]:
+        # the query string is part of the signature -> sign the final url and send it as is
+        if params:
+            api_url += ('&' if '?' in api_url else '?') + urllib.parse.urlencode(params)
+        uri, headers, _ = self.__client.sign(api_url, http_method=method, headers=headers)
+        return URL(uri, encoded=True), headers
+
+    #
+    #
+    #
+    async def __get(self, endpoint: str, api_url: str, params: Optional[dict] = None, data_format: Optional[str] = None) -> bytes:
+        """GET with timeout and retry/backoff (GET requests are idempotent)."""
+        if self.__session is None:
+            raise ValueError('__get: session not open.')
+        data_format = self.__format if data_format is None else data_format
+        retries = self.__transport['retries']
+        backoff_sec = self.__transport['backoff_sec']
+        t0 = time.perf_counter()
+        attempt = 0
+        try:
+            while True:
+                url, headers = self.__sign('GET', api_url, params, headers={'Accept': 'application/json'} if data_format == 'json' else None)
+                try:
+                    async with self.__session.get(url, headers=headers, timeout=self.__timeout(endpoint)) as resp:
+                        if resp.status not in EtradeApi.retry_status or attempt >= retries:
+                            resp.raise_for_status()
+                            return await resp.read()
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    if attempt >= retries:
+                        raise
+                counter('broker.' + endpoint + '.retries').inc()
+                await asyncio.sleep(backoff_sec * (2 ** attempt))
+                attempt += 1
+        except Exception:
+            counter('broker.' + endpoint + '.errors').inc()
+            raise
+        finally:
+            histogram('broker.' + endpoint).observe(time.perf_counter() - t0)
+
+    #
+    #
+    #
+    async def __perform_request(self, endpoint: str, request_type: str, api_url: str, payload: dict) -> dict:
+        if self.__session is None:
+            raise ValueError('__perform_request: session not open.')
+        if request_type not in ('post', 'put'):
+            raise ValueError('__perform_request: invalid value in request_type.')
+        payload, headers = EtradeApi._encode_payload(payload, self.__format)
+        url, headers = self.__sign(request_type.upper(), api_url, headers=headers)
+        t0 = time.perf_counter()
+        try:
+            async with self.__session.request(request_type.upper(), url, data=payload.encode('utf-8'), headers=headers,
+                                              timeout=self.__timeout('order_placement')) as resp:
+                resp.raise_for_status()
+                return EtradeApi._parse_response(await resp.read(), check_messages=False, data_format=self.__format)
+        except Exception:
+            counter('broker.' + endpoint + '.errors').inc()
+            raise
+        finally:
+            histogram('broker.' + endpoint).observe(time.perf_counter() - t0)
+
+    #
+    #
+    #
+    async def revoke_access_token(self) -> None:
+        """Revokes access token."""
+        text = await self.__get('default', self.__revoke_url, data_format='xml')
+        EtradeApi._parse_response(text, check_messages=False)
+
+    #
+    #
+    #
+    async def get_account_balance(self, account_id: str) -> Tuple[float, float, float]:
+        """See EtradeApi.get_account_balance."""
+        api_url = self.__get_url('accounts/' + account_id + '/balance?instType=BROKERAGE&realTimeNAV=true')
+        text = await self.__get('balance', api_url)
+        return EtradeApi._parse_balance(EtradeApi._parse_response(text, data_format=self.__format))
+
+    #
+    #
+    #
+    async def list_accounts(self) -> List[Tuple[int, int, str, str]]:
+        """See EtradeApi.list_accounts."""
+        text = await self.__get('accounts', self.__get_url('accounts/list'))
+        return EtradeApi._parse_accounts(EtradeApi._parse_response(text, data_format=self.__format))
+
+    #
+    #
+    #
+    async def get_account_positions(self, account_id: str) -> List[Tuple[str, float, float, float]]:
+        """See EtradeApi.get_account_positions."""
+        text = await self.__get('portfolio', self.__get_url('accounts/' + str(account_id) + '/portfolio'))
+        if EtradeApi.streaming_parser and self.__format == 'xml':
+            return parse_positions(text)
+        return EtradeApi._parse_positions(EtradeApi._parse_response(text, data_format=self.__format))
+
+    #
+    #
+    #
+    async def get_quote(self, symbols: Sequence[str], only_intraday_data: bool) -> List[QuoteData]:
+        """See EtradeApi.get_quote."""
+        if len(symbols) > 25:
+            raise ValueError('get_quote: Too many symbols to quote.')
+
+        api_url = self.__get_url('market/quote/' + ','.join(symbols))
+        params = {'detailFlag': 'ALL'} if not only_intraday_data else {'detailFlag': 'INTRADAY'}
+        text = await self.__get('quote', api_url, params=params)
+        if EtradeApi.streaming_parser and self.__format == 'xml':
+            return parse_quotes(text, only_intraday_data)
+        return EtradeApi._parse_quotes(EtradeApi._parse_response(text, data_format=self.__format), only_intraday_data)
+
+    #
+    #
+    #
+    async def list_orders(self, account_id: str, count: int, marker: Optional[str]) -> Tuple[Sequence[dict], Optional[str]]:
+        """See EtradeApi.list_orders."""
+        api_url = self.__get_url('accounts/' + account_id + '/orders')
+        params = {'count': count}
+        if marker is not None:
+            params['marker'] = marker
+        text = await self.__get('orders', api_url, params=params)
+        if EtradeApi.streaming_parser and self.__format == 'xml':
+            return parse_orders(text)
+        return EtradeApi._parse_orders(EtradeApi._parse_response(text, data_format=self.__format))
+
+    #
+    #
+    #
+    async def __generate_order_preview(self, **kwargs) -> int:
+        EtradeApi._check_order(**kwargs)
+        api_url = self.__get_url('accounts/' + kwargs['accountId'] + '/orders/preview')
+        payload = EtradeApi._build_order_payload(order_type='PreviewOrderRequest', **kwargs)
+
+        resp = await self.__perform_request(endpoint='order_preview', request_type='post', api_url=api_url, payload=payload)
+        return int(resp['PreviewOrderResponse']['PreviewIds']['previewId'])
+
+    #
+    #
+    #
+    async def __generate_change_order_preview(self, **kwargs) -> int:
+        EtradeApi._check_order(**kwargs)
+        api_url = self.__get_url('accounts/' + kwargs['accountId'] + '/orders/' + str(kwargs['orderId']) + '/change/preview')
+        payload = EtradeApi._build_order_payload(order_type='PreviewOrderRequest', **kwargs)
+
+        resp = await self.__perform_request(endpoint='order_change_preview', request_type='put', api_url=api_url, payload=payload)
+        return int(resp['PreviewOrderResponse']['PreviewIds']['previewId'])
+
+    #
+    #
+    #
+    async def place_equity_order(self, **kwargs) -> int:
+        """See EtradeApi.place_equity_order."""
+        EtradeApi._check_order(**kwargs)
+
+        if 'prev_order_id' in kwargs:
+            prev_order_id = kwargs.pop('prev_order_id')
+            if prev_order_id is not None:
+                kwargs['orderId'] = prev_order_id
+                return await self.__change_equity_order(**kwargs)
+
+        if 'previewId' not in kwargs:
+            kwargs['previewId'] = await self.__generate_order_preview(**kwargs)
+
+        api_url = self.__get_url('accounts/' + kwargs['accountId'] + '/orders/place')
+        payload = EtradeApi._build_order_payload(order_type='PlaceOrderRequest', **kwargs)
+
+        resp = await self.__perform_request(endpoint='order_place', request_type='post', api_url=api_url, payload=payload)
+        return int(resp['PlaceOrderResponse']['OrderIds']['orderId'])
+
+    #
+    #
+    #
+    async def __change_equity_order(self, **kwargs) -> int:
+        EtradeApi._check_order(**kwargs)
+
+        if 'previewId' not in kwargs:
+            kwargs['previewId'] = await self.__generate_change_order_preview(**kwargs)
+
+        api_url = self.__get_url('accounts/' + kwargs['accountId'] + '/orders/' + str(kwargs['orderId']) + '/change/place')
+        payload = EtradeApi._build_order_payload(order_type='PlaceOrderRequest', **kwargs)
+
+        resp = await self.__perform_request(endpoint='order_change', request_type='put', api_url=api_url, payload=payload)
+        return int(resp['PlaceOrderResponse']['OrderIds']['orderId'])
+
+    #
+    #
+    #
+    async def cancel_order(self, account_id: str, order_id: int) -> str:
+        """See EtradeApi.cancel_order."""
+        api_url = self.__get_url('accounts/' + account_id + '/orders/cancel')
+        payload = {'CancelOrderRequest': {'orderId': order_id}}
+
+        resp = await self.__perform_request(endpoint='order_cancel', request_type='put', api_url=api_url, payload=payload)
+        return resp['CancelOrderResponse']['Messages']['Message']['description']
+
+
+#
+#
+#
+class SyncEtradeApiAdapter:
+    """
+        - EtradeApi interface on top of AsyncEtradeApi
+        - the event loop runs in a daemon thread, any thread can call the methods (blocking)
+        - submit() returns a concurrent.futures.Future, to keep many requests in flight from one thread
+    """
+    QuoteData = EtradeApi.QuoteData
+
+    __api = None
+    __loop = None
+    __thread = None
+
+    #
+    #
+    #
+    def __init__(self, api: AsyncEtradeApi):
+        self.__api = api
+        self.__loop = asyncio.new_event_loop()
+        self.__thread = threading.Thread(target=self.__loop.run_forever, name='EtradeApiLoop', daemon=True)
+        self.__thread.start()
+        self.submit(self.__api.open()).result()
+
+    #
+    #
+    #
+    @property
+    def api(self) -> AsyncEtradeApi:
+        return self.__api
+
+    #
+    #
+    #
+    def submit(self, coroutine: Awaitable) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(coroutine, self.__loop)
+
+    #
+    #
+    #
+    def close(self) -> None:
+        if self.__loop.is_running():
+            self.submit(self.__api.close()).result()
+            self.__loop.call_soon_threadsafe(self.__loop.stop)
+            self.__thread.join()
+
+    #
+    #
+    #
+    def revoke_access_token(self) -> None:
+        try:
+            return self.submit(self.__api.revoke_access_token()).result()
+        finally:
+            self.close()
+
+    #
+    #
+    #
+    def get_account_balance(self, account_id: str) -> Tuple[float, float, float]:
+        return self.submit(self.__api.get_account_balance(account_id)).result()
+
+    #
+    #
+    #
+    def list_accounts(self) -> List[Tuple[int, int, str, str]]:
+        return self.submit(self.__api.list_accounts()).result()
+
+    #
+    #
+    #
+    def get_account_positions(self, account_id: str) -> List[Tuple[str, float, float, float]]:
+        return self.submit(self.__api.get_account_positions(account_id)).result()
+
+    #
+    #
+    #
+    def get_quote(self, symbols: Sequence[str], only_intraday_data: bool) -> List[QuoteData]:
+        return self.submit(self.__api.get_quote(symbols, only_intraday_data)).result()
+
+    #
+    #
+    #
+    def list_orders(self, account_id: str, count: int, marker: Optional[str]) -> Tuple[Sequence[dict], Optional[str]]:
+        return self.submit(self.__api.list_orders(account_id, count, marker)).result()
+
+    #
+    #
+    #
+    def place_equity_order(self, **kwargs) -> int:
+        return self.submit(self.__api.place_equity_order(**kwargs)).result()
+
+    #
+    #
+    #
+    def cancel_order(self, account_id: str, order_id: int) -> str:
+        return self.submit(self.__api.cancel_order(account_id, order_id)).result()
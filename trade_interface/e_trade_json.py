@@ -0,0 +1,64 @@
+import json
+from typing import Tuple, Union, Any
+
+
+#
+# elements that E*Trade always sends as json arrays
+#
+array_keys = ('Order', 'Instrument')
+response_array_keys = ('QuoteData', 'Order', 'OrderDetail', 'Instrument', 'AccountPortfolio', 'Position', 'Account', 'Message')
+
+
+#
+#
+#
+def _normalize(value: Any) -> Any:
+    """
+        json -> same structure produced by xmltodict for the xml response
+        - scalars become strings (booleans as 'true' and 'false')
+        - one element arrays become the element (xmltodict returns a list only for repeated elements)
+    """
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        if len(value) == 1:
+            return _normalize(value[0])
+        return [_normalize(v) for v in value]
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if value is None or isinstance(value, str):
+        return value
+    return str(value)
+
+
+#
+#
+#
+def parse_response(text: Union[str, bytes], check_messages: bool = True) -> dict:
+    """Json version of EtradeApi._parse_response (same result and same checks)."""
+    resp = _normalize(json.loads(text))
+    if check_messages and len(resp.keys()) == 1:
+        body = resp[next(iter(resp))]
+        if isinstance(body, dict) and len(body.keys()) == 1:
+            if 'Messages' in body:
+                message = body['Messages']['Message']
+                if isinstance(message, list):
+                    message = message[0]
+                raise ValueError(message['description'])
+    if 'Error' in resp:
+        raise ValueError(resp['Error']['message'])
+    return resp
+
+
+#
+#
+#
+def dumps(payload: dict, keys: Tuple[str, ...] = array_keys) -> str:
+    """Payload (as built for xml) -> json body, the elements in keys become arrays."""
+    def to_json(value: Any) -> Any:
+        if isinstance(value, dict):
+            return {k: ([to_json(v)] if k in keys and not isinstance(v, list) else to_json(v)) for k, v in value.items()}
+        if isinstance(value, list):
+            return [to_json(v) for v in value]
+        return value
+    return json.dumps(to_json(payload))
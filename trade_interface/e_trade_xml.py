@@ -0,0 +1,151 @@
+import io
+import xml.etree.ElementTree as ElementTree
+from typing import Tuple, List, Optional, Sequence, Union, Iterator, Dict
+
+
+#
+#
+#
+def _iter_elements(text: Union[str, bytes], tags: Tuple[str, ...]) -> Iterator[ElementTree.Element]:
+    """
+        streaming parse of an E*Trade response
+        - yields the elements named as one of tags once complete, then discards them
+        - raises ValueError on error responses (same checks of EtradeApi._parse_response)
+    """
+    if isinstance(text, str):
+        text = text.encode('utf-8')
+    context = ElementTree.iterparse(io.BytesIO(text), events=('end',))
+    for _, element in context:
+        if element.tag in tags:
+            yield element
+            element.clear()
+
+    root = context.root
+    if root.tag == 'Error':
+        raise ValueError(root.findtext('message'))
+    if len(root) == 1 and root[0].tag == 'Messages':
+        raise ValueError(root[0].findtext('Message/description'))
+
+
+#
+#
+#
+def _find_text(element: ElementTree.Element, path: str) -> str:
+    text = element.findtext(path)
+    if text is None:
+        raise KeyError(path)
+    return text.strip()
+
+
+#
+#
+#
+def _find_float(element: ElementTree.Element, path: str) -> float:
+    return float(_find_text(element, path))
+
+
+#
+#
+#
+def parse_quotes(text: Union[str, bytes], only_intraday_data: bool) -> List[Tuple[str, Dict[str, float]]]:
+    """Streaming version of EtradeApi._parse_quotes (same result).
+
+    Args:
+        text: QuoteResponse xml.
+        only_intraday_data: Boolean indicating if the response contains only intraday data.
+
+    Returns:
+        A list of (symbol, symbol_data), see EtradeApi.get_quote.
+    """
+    label = 'All' if not only_intraday_data else 'Intraday'
+    quotes = []
+    for quote in _iter_elements(text, ('QuoteData',)):
+        data = quote.find(label)
+        if data is None:
+            raise KeyError(label)
+        export_data = {'ask': _find_float(data, 'ask'),
+                       'bid': _find_float(data, 'bid'),
+                       'high': _find_float(data, 'high'),
+                       'low': _find_float(data, 'low'),
+                       'lastTrade': _find_float(data, 'lastTrade'),
+                       'totalVolume': _find_float(data, 'totalVolume')}
+        if export_data['bid'] == 0 and export_data['ask'] == 0:
+            export_data['ask'] = export_data['lastTrade']
+            export_data['bid'] = export_data['lastTrade']
+        if label == 'All':
+            export_data['askSize'] = _find_float(data, 'askSize')
+            export_data['bidSize'] = _find_float(data, 'bidSize')
+            export_data['eps'] = _find_float(data, 'eps')
+            export_data['estEarnings'] = _find_float(data, 'estEarnings')
+            export_data['dividend'] = _find_float(data, 'dividend')
+            export_data['symbolDescription'] = _find_text(data, 'symbolDescription')
+        quotes.append((_find_text(quote, 'Product/symbol'), export_data))
+    return quotes
+
+
+#
+#
+#
+def parse_orders(text: Union[str, bytes]) -> Tuple[Sequence[dict], Optional[str]]:
+    """Streaming version of EtradeApi._parse_orders (same result).
+
+    Args:
+        text: OrdersResponse xml.
+
+    Returns:
+        order_data: List of orders.
+        current_marker: Next marker.
+    """
+    order_data = []
+    current_marker = None
+    for order in _iter_elements(text, ('Order', 'marker')):
+        if order.tag == 'marker':
+            if order.text is not None and len(order.text.strip()) != 0:
+                current_marker = order.text.strip()
+            continue
+        o = order.find('OrderDetail')
+        i = o.find('Instrument')
+        order_info = {'orderId': int(_find_text(order, 'orderId')),
+                      'orderStatus': _find_text(o, 'status'),
+                      'symbol': _find_text(i, 'Product/symbol'),
+                      'orderAction': _find_text(i, 'orderAction'),
+                      'orderedQuantity': _find_text(i, 'orderedQuantity'),
+                      'orderTerm': _find_text(o, 'orderTerm'),
+                      'marketSession': _find_text(o, 'marketSession')}
+        if order_info['orderStatus'] == 'EXECUTED':
+            order_info['executedPrice'] = _find_text(i, 'averageExecutionPrice')
+            order_info['filledQuantity'] = _find_text(i, 'filledQuantity')
+        if order_info['orderStatus'] == 'OPEN':
+            order_info['priceType'] = _find_text(o, 'priceType')
+            if order_info['priceType'] == 'LIMIT':
+                order_info['limitPrice'] = _find_text(o, 'limitPrice')
+            if order_info['priceType'] == 'STOP':
+                order_info['stopPrice'] = _find_text(o, 'stopPrice')
+            if order_info['priceType'] == 'STOP_LIMIT':
+                order_info['limitPrice'] = _find_text(o, 'limitPrice')
+                order_info['stopPrice'] = _find_text(o, 'stopPrice')
+        order_data.append(order_info)
+    return order_data, current_marker
+
+
+#
+#
+#
+def parse_positions(text: Union[str, bytes]) -> List[Tuple[str, float, float, float]]:
+    """Streaming version of EtradeApi._parse_positions (same result).
+
+    Args:
+        text: PortfolioResponse xml.
+
+    Returns:
+        A list of (symbol, qty, currentPrice, costBasis)
+    """
+    positions = []
+    for p in _iter_elements(text, ('Position',)):
+        quantity = _find_float(p, 'quantity')
+        positions.append((
+            _find_text(p, 'Product/symbol').upper(),
+            quantity,
+            _find_float(p, 'marketValue') / quantity,
+            _find_float(p, 'totalCost')))
+    return positions
@@ -5,17 +5,43 @@ import pytz
 #
 #
 #
+market_timezone = pytz.timezone('US/Eastern')
 market_sessions = [[datetime.time(0, 00), datetime.time(7, 00), 'NO_TRADE', 'BEFORE_PRE_MARKET'],
                    [datetime.time(7, 00), datetime.time(9, 30), 'EXTENDED', 'PRE_MARKET'],
                    [datetime.time(9, 30), datetime.time(16, 00), 'REGULAR', 'REGULAR'],
                    [datetime.time(16, 00), datetime.time(20, 00), 'EXTENDED', 'POST_MARKET'],
                    [datetime.time(20, 00), None, 'NO_TRADE', 'AFTER_POST_MARKET']]
 
+#
+# replay and benchmarks: session reported at any time (row of market_sessions), None = real session
+#
+_simulated_session = None
+
+
+#
+#
+#
+def simulate_market_session(session_info: str = None) -> None:
+    """
+        session_info = REGULAR, PRE_MARKET, ... (see market_sessions) or None to use the current time
+    """
+    global _simulated_session
+    if session_info is None:
+        _simulated_session = None
+        return
+    for session in market_sessions:
+        if session[3] == session_info:
+            _simulated_session = session
+            return
+    raise ValueError('simulate_market_session: unknown session ' + session_info + '.')
+
 
 #
 #
 #
 def market_session() -> str:
+    if _simulated_session is not None:
+        return _simulated_session[2]
     eastern_time_now = current_time()
 
     for i in range(len(market_sessions)):
@@ -32,6 +58,8 @@ def market_session() -> str:
 #
 #
 def market_session_extended_info() -> str:
+    if _simulated_session is not None:
+        return _simulated_session[3]
     eastern_time_now = current_time()
 
     for i in range(len(market_sessions)):
@@ -79,4 +107,11 @@ def datetime_delay(days: int = 0, hours: int = 0, minutes: int = 0, seconds: int
 #
 #
 def current_time():
-    return datetime.datetime.now(pytz.timezone('US/Eastern'))
+    return datetime.datetime.now(market_timezone)
+
+
+#
+#
+#
+def time_from_epoch_ns(time_ns: int) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(time_ns / 1e9, market_timezone)
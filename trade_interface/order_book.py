@@ -0,0 +1,148 @@
+import threading
+import time
+from typing import Optional, List, Tuple, Set
+
+
+#
+#
+#
+class OrderBook:
+    """
+        - thread safe cache of the account orders
+        - indexed by orderId and by (symbol, orderAction, orderStatus)
+        - orders in a final status never change
+    """
+    final_status = ('EXECUTED', 'CANCELLED', 'REJECTED', 'EXPIRED')
+
+    __mutex = None
+    __orders = None
+    __index = None
+    __refresh_time = None
+
+    #
+    #
+    #
+    def __init__(self):
+        self.__mutex = threading.Lock()
+        self.__orders = dict()
+        self.__index = dict()
+        self.__refresh_time = None
+
+    #
+    #
+    #
+    @staticmethod
+    def __key(order: dict) -> Tuple[str, str, str]:
+        return order['symbol'], order['orderAction'], order['orderStatus']
+
+    #
+    #
+    #
+    def is_complete(self) -> bool:
+        """True if the book has been filled with the full order history at least once."""
+        self.__mutex.acquire()
+        complete = self.__refresh_time is not None
+        self.__mutex.release()
+        return complete
+
+    #
+    #
+    #
+    def is_fresh(self, max_age_sec: float) -> bool:
+        self.__mutex.acquire()
+        fresh = (self.__refresh_time is not None) and (time.monotonic() - self.__refresh_time <= max_age_sec)
+        self.__mutex.release()
+        return fresh
+
+    #
+    #
+    #
+    def mark_refreshed(self) -> None:
+        self.__mutex.acquire()
+        self.__refresh_time = time.monotonic()
+        self.__mutex.release()
+
+    #
+    #
+    #
+    def invalidate(self) -> None:
+        """Forces an update at the next lookup (the content is kept)."""
+        self.__mutex.acquire()
+        if self.__refresh_time is not None:
+            self.__refresh_time = -float('inf')
+        self.__mutex.release()
+
+    #
+    #
+    #
+    def update(self, order: dict) -> bool:
+        """Adds or updates an order.
+
+        Args:
+            order: Order as returned by EtradeApi.list_orders.
+
+        Returns:
+            True if the order was already known and unchanged.
+        """
+        self.__mutex.acquire()
+        order_id = order['orderId']
+        old_order = self.__orders.get(order_id)
+        if old_order == order:
+            self.__mutex.release()
+            return True
+        if old_order is not None:
+            self.__index[self.__key(old_order)].discard(order_id)
+        self.__orders[order_id] = order
+        self.__index.setdefault(self.__key(order), set()).add(order_id)
+        self.__mutex.release()
+        return False
+
+    #
+    #
+    #
+    def discard(self, order_ids: Set[int]) -> None:
+        self.__mutex.acquire()
+        for order_id in order_ids:
+            order = self.__orders.pop(order_id, None)
+            if order is not None:
+                self.__index[self.__key(order)].discard(order_id)
+        self.__mutex.release()
+
+    #
+    #
+    #
+    def pending_ids(self) -> Set[int]:
+        """Ids of the orders that can still change status."""
+        self.__mutex.acquire()
+        ids = set(order_id for order_id, o in self.__orders.items() if o['orderStatus'] not in self.final_status)
+        self.__mutex.release()
+        return ids
+
+    #
+    #
+    #
+    def get(self, order_id: int) -> Optional[dict]:
+        self.__mutex.acquire()
+        order = self.__orders.get(order_id)
+        self.__mutex.release()
+        return dict(order) if order is not None else None
+
+    #
+    #
+    #
+    def find(self, symbol: str, action: str, status: str) -> List[Tuple[int, dict]]:
+        self.__mutex.acquire()
+        ids = sorted(self.__index.get((symbol, action, status), ()), reverse=True)
+        orders = [(order_id, dict(self.__orders[order_id])) for order_id in ids]
+        self.__mutex.release()
+        return orders
+
+    #
+    #
+    #
+    def orders(self) -> List[dict]:
+        """All orders, newest first."""
+        self.__mutex.acquire()
+        orders = [dict(self.__orders[order_id]) for order_id in sorted(self.__orders, reverse=True)]
+        self.__mutex.release()
+        return orders
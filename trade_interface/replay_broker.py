@@ -0,0 +1,666 @@
+import http.client
+import math
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Tuple, List, Optional, Sequence, Dict, Any
+
+import requests
+import xmltodict
+
+from trade_interface.e_trade_api import EtradeApi
+from trade_interface.e_trade_json import dumps as dumps_json, response_array_keys
+
+
+#
+#
+#
+class ReplayBroker:
+    """
+        - simulated E*Trade account, answers the v1 REST endpoints used by EtradeApi in xml or json
+        - quotes: recorded QuoteResponse files (replayed in a loop) or a synthetic random walk
+        - orders: kept in memory, MARKET orders execute immediately, LIMIT and STOP orders
+                  execute when the quoted price crosses their price
+        - latency_sec + uniform(0, jitter_sec) of delay per request
+        - error_rate: fraction of the requests answered with 503 or a dropped connection
+        - thread safe, served in process (ReplaySession) or over http (start_http_server)
+    """
+    account_id = '12345678'
+    account_key = 'REPLAY0000000001'
+    volatility = 0.001
+    max_orders_per_page = 100
+
+    latency_sec = None
+    jitter_sec = None
+    error_rate = None
+
+    __mutex = None
+    __random = None
+    __quotes = None
+    __recorded = None
+    __orders = None
+    __open_orders = None
+    __positions = None
+    __cash = None
+    __next_order_id = None
+    __next_preview_id = None
+    __stats = None
+    __http_server = None
+    __http_thread = None
+
+    #
+    #
+    #
+    def __init__(self, latency_sec: float = 0.0, jitter_sec: float = 0.0, error_rate: float = 0.0, seed: Optional[int] = None,
+                 cash: float = 100000.0, positions: Optional[Dict[str, Sequence[float]]] = None,
+                 recorded_quotes: Sequence[str] = ()):
+        """
+            positions       = symbol: (quantity, total cost)
+            recorded_quotes = paths of QuoteResponse files (xml or json)
+        """
+        self.latency_sec = latency_sec
+        self.jitter_sec = jitter_sec
+        self.error_rate = error_rate
+        self.__mutex = threading.Lock()
+        self.__random = random.Random(seed)
+        self.__quotes = dict()
+        self.__recorded = dict()
+        self.__orders = dict()
+        self.__open_orders = dict()
+        self.__positions = dict()
+        self.__cash = cash
+        self.__next_order_id = 1000
+        self.__next_preview_id = 1
+        self.__stats = {'requests': 0, 'faults': 0}
+        for symbol, (quantity, total_cost) in (positions or {}).items():
+            self.__positions[symbol.strip().upper()] = [float(quantity), float(total_cost)]
+        for path in recorded_quotes:
+            self.load_recorded_quotes(path)
+
+    #
+    #
+    #
+    def load_recorded_quotes(self, path: str) -> None:
+        """Adds the snapshots of a recorded QuoteResponse, replayed in order for each symbol."""
+        with open(path, 'rb') as fp:
+            text = fp.read()
+        data_format = 'json' if text.lstrip().startswith(b'{') else 'xml'
+        data = EtradeApi._parse_response(text, data_format=data_format)
+        self.__mutex.acquire()
+        for quote in EtradeApi._to_list(data['QuoteResponse']['QuoteData']):
+            symbol = quote['Product']['symbol'].strip().upper()
+            self.__recorded.setdefault(symbol, [0, []])[1].append(quote)
+        self.__mutex.release()
+
+    #
+    #
+    #
+    def stats(self) -> dict:
+        self.__mutex.acquire()
+        stats = dict(self.__stats)
+        self.__mutex.release()
+        return stats
+
+    #
+    # http stand-in
+    #
+    def start_http_server(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Serves the broker over http, returns the base url to use in place of the E*Trade one."""
+        if self.__http_server is None:
+            self.__http_server = ThreadingHTTPServer((host, port), _ReplayRequestHandler)
+            self.__http_server.daemon_threads = True
+            self.__http_server.broker = self
+            self.__http_thread = threading.Thread(target=self.__http_server.serve_forever, name='ReplayBroker', daemon=True)
+            self.__http_thread.start()
+        return self.http_url
+
+    #
+    #
+    #
+    @property
+    def http_url(self) -> Optional[str]:
+        if self.__http_server is None:
+            return None
+        host, port = self.__http_server.server_address[:2]
+        return 'http://' + host + ':' + str(port) + '/v1/'
+
+    #
+    #
+    #
+    def stop_http_server(self) -> None:
+        if self.__http_server is not None:
+            self.__http_server.shutdown()
+            self.__http_server.server_close()
+            self.__http_thread.join()
+            self.__http_server = None
+            self.__http_thread = None
+
+    #
+    #
+    #
+    def handle(self, method: str, url: str, body: Optional[bytes] = None, json_format: bool = False) -> Tuple[int, str, bytes]:
+        """Answers a request.
+
+        Args:
+            method: GET, POST or PUT.
+            url: Request url (or path), query string included.
+            body: Request body (xml or json).
+            json_format: True if the client accepts json.
+
+        Returns:
+            status: Http status (0 = connection dropped).
+            content_type: Content type of the response.
+            body: Response body.
+        """
+        delay = self.latency_sec + (self.__random.uniform(0.0, self.jitter_sec) if self.jitter_sec > 0.0 else 0.0)
+        if delay > 0.0:
+            time.sleep(delay)
+
+        self.__mutex.acquire()
+        self.__stats['requests'] += 1
+        fault = self.__random.random() < self.error_rate
+        if fault:
+            self.__stats['faults'] += 1
+            dropped = self.__random.random() < 0.5
+        self.__mutex.release()
+        if fault:
+            if dropped:
+                return 0, '', b''
+            return 503, 'text/plain', b'Service Unavailable'
+
+        split_url = urllib.parse.urlsplit(url)
+        query = dict(urllib.parse.parse_qsl(split_url.query))
+        try:
+            status, data = self.__route(method, split_url.path, query, self.__decode(body))
+        except (KeyError, TypeError, ValueError) as e:
+            status, data = 400, {'Error': {'code': 100, 'message': 'replay: ' + str(e)}}
+        return self.__encode(status, data, json_format)
+
+    #
+    #
+    #
+    @staticmethod
+    def __decode(body: Optional[bytes]) -> Optional[dict]:
+        if not body:
+            return None
+        if body.lstrip().startswith(b'{'):
+            return EtradeApi._parse_response(body, check_messages=False, data_format='json')
+        return EtradeApi._parse_response(body, check_messages=False)
+
+    #
+    #
+    #
+    @staticmethod
+    def __encode(status: int, data: dict, json_format: bool) -> Tuple[int, str, bytes]:
+        if json_format:
+            return status, 'application/json', dumps_json(data, response_array_keys).encode('utf-8')
+        return status, 'application/xml', xmltodict.unparse(data, encoding='utf-8').encode('utf-8')
+
+    #
+    #
+    #
+    def __route(self, method: str, path: str, query: dict, body: Optional[dict]) -> Tuple[int, dict]:
+        if path.endswith('/oauth/revoke_access_token'):
+            return 200, {'RevokeAccessTokenResponse': {'message': 'Revoked Access Token'}}
+        match = re.search(r'/v1/(.*?)(\.json|\.xml)?$', path)
+        if match is None:
+            return 404, {'Error': {'code': 404, 'message': 'not found ' + path}}
+        command = match.group(1).split('/')
+
+        if method == 'GET' and command[:2] == ['market', 'quote']:
+            symbols = [s.strip().upper() for s in urllib.parse.unquote(command[2]).split(',')]
+            return 200, self.__quote_response(symbols, query.get('detailFlag', 'ALL'))
+        if method == 'GET' and command == ['accounts', 'list']:
+            return 200, self.__account_list_response()
+
+        if len(command) < 3 or command[0] != 'accounts':
+            return 404, {'Error': {'code': 404, 'message': 'not found ' + path}}
+        if command[1] != self.account_key:
+            return 400, {'Error': {'code': 100, 'message': 'invalid account key ' + command[1]}}
+        command = command[2:]
+
+        if method == 'GET' and command == ['balance']:
+            return 200, self.__balance_response()
+        if method == 'GET' and command == ['portfolio']:
+            return 200, self.__portfolio_response()
+        if method == 'GET' and command == ['orders']:
+            count = int(query.get('count', 25))
+            try:
+                return 200, self.__orders_response(count, query.get('marker'))
+            except ValueError:
+                return 400, {'Error': {'code': 100, 'message': 'invalid marker ' + str(query['marker'])}}
+        if method == 'POST' and command == ['orders', 'preview']:
+            return 200, self.__place_order(body['PreviewOrderRequest'], 'PreviewOrderResponse', None)
+        if method == 'POST' and command == ['orders', 'place']:
+            return 200, self.__place_order(body['PlaceOrderRequest'], 'PlaceOrderResponse', None)
+        if method == 'PUT' and len(command) == 4 and command[0] == 'orders' and command[2] == 'change':
+            request = 'PreviewOrderRequest' if command[3] == 'preview' else 'PlaceOrderRequest'
+            response = 'PreviewOrderResponse' if command[3] == 'preview' else 'PlaceOrderResponse'
+            return 200, self.__place_order(body[request], response, int(command[1]))
+        if method == 'PUT' and command == ['orders', 'cancel']:
+            return 200, self.__cancel_order(int(body['CancelOrderRequest']['orderId']))
+        return 404, {'Error': {'code': 404, 'message': 'not found ' + path}}
+
+    #
+    # quotes (__mutex)
+    #
+    def __next_price(self, symbol: str) -> dict:
+        quote = self.__quotes.get(symbol)
+        if quote is None:
+            price = round(10.0 + (sum(ord(c) for c in symbol) * 7.919) % 490.0, 2)
+            quote = {'lastTrade': price, 'open': price, 'high': price, 'low': price, 'previousClose': price, 'totalVolume': 0}
+            self.__quotes[symbol] = quote
+        else:
+            price = round(max(quote['lastTrade'] * math.exp(self.__random.gauss(0.0, self.volatility)), 0.01), 2)
+            quote['lastTrade'] = price
+            quote['high'] = max(quote['high'], price)
+            quote['low'] = min(quote['low'], price)
+        quote['totalVolume'] += self.__random.randint(100, 10000)
+        return quote
+
+    #
+    # quotes (__mutex)
+    #
+    def __quote_data(self, symbol: str, detail_flag: str) -> dict:
+        label = 'Intraday' if detail_flag == 'INTRADAY' else 'All'
+
+        recorded = self.__recorded.get(symbol)
+        if recorded is not None:
+            quote = recorded[1][recorded[0] % len(recorded[1])]
+            recorded[0] += 1
+            if label in quote:
+                q = self.__quotes[symbol] if symbol in self.__quotes else self.__next_price(symbol)
+                q['lastTrade'] = float(quote[label]['lastTrade'])
+                q['high'] = max(q['high'], q['lastTrade'])
+                q['low'] = min(q['low'], q['lastTrade'])
+                self.__execute_orders(symbol)
+                return quote
+
+        q = self.__next_price(symbol)
+        price = q['lastTrade']
+        spread = max(round(price * 0.0002, 2), 0.01)
+        data = {'ask': round(price + spread, 2),
+                'bid': round(price - spread, 2),
+                'changeClose': round(price - q['previousClose'], 2),
+                'changeClosePercentage': round((price - q['previousClose']) / q['previousClose'] * 100.0, 2),
+                'companyName': symbol + ' INC',
+                'high': q['high'],
+                'low': q['low'],
+                'lastTrade': price,
+                'totalVolume': q['totalVolume']}
+        if label == 'All':
+            data.update({'askSize': 100, 'bidSize': 100, 'eps': 1.0, 'estEarnings': 1.0, 'dividend': 0.0,
+                         'open': q['open'], 'previousClose': q['previousClose'],
+                         'symbolDescription': symbol + ' INC COM'})
+        self.__execute_orders(symbol)
+        return {'dateTime': time.strftime('%H:%M:%S EDT %m-%d-%Y'),
+                'dateTimeUTC': int(time.time()),
+                'quoteStatus': 'REALTIME',
+                'ahFlag': False,
+                label: data,
+                'Product': {'symbol': symbol, 'securityType': 'EQ'}}
+
+    #
+    #
+    #
+    def __quote_response(self, symbols: List[str], detail_flag: str) -> dict:
+        if len(symbols) > 25:
+            raise ValueError('too many symbols')
+        self.__mutex.acquire()
+        try:
+            quotes = [self.__quote_data(symbol, detail_flag) for symbol in symbols]
+        finally:
+            self.__mutex.release()
+        return {'QuoteResponse': {'QuoteData': quotes}}
+
+    #
+    #
+    #
+    def __account_list_response(self) -> dict:
+        return {'AccountListResponse': {'Accounts': {'Account': {
+            'accountId': self.account_id,
+            'accountIdKey': self.account_key,
+            'accountMode': 'MARGIN',
+            'accountDesc': 'Replay',
+            'accountName': '',
+            'accountType': 'INDIVIDUAL',
+            'institutionType': 'BROKERAGE',
+            'accountStatus': 'ACTIVE'}}}}
+
+    #
+    # (__mutex)
+    #
+    def __last_price(self, symbol: str) -> float:
+        if symbol not in self.__quotes:
+            self.__next_price(symbol)
+        return self.__quotes[symbol]['lastTrade']
+
+    #
+    #
+    #
+    def __balance_response(self) -> dict:
+        self.__mutex.acquire()
+        market_value = sum(p[0] * self.__last_price(symbol) for symbol, p in self.__positions.items())
+        cash = self.__cash
+        self.__mutex.release()
+        return {'BalanceResponse': {
+            'accountId': self.account_id,
+            'accountType': 'MARGIN',
+            'Computed': {
+                'cashAvailableForInvestment': round(cash, 2),
+                'settledCashForInvestment': round(cash, 2),
+                'unSettledCashForInvestment': 0.0,
+                'RealTimeValues': {'totalAccountValue': round(cash + market_value, 2),
+                                   'netMv': round(market_value, 2)}}}}
+
+    #
+    #
+    #
+    def __portfolio_response(self) -> dict:
+        self.__mutex.acquire()
+        positions = []
+        for j, (symbol, (quantity, total_cost)) in enumerate(sorted(self.__positions.items())):
+            if quantity == 0:
+                continue
+            price = self.__last_price(symbol)
+            positions.append({'positionId': j + 1,
+                              'Product': {'symbol': symbol, 'securityType': 'EQ'},
+                              'symbolDescription': symbol + ' INC COM',
+                              'pricePaid': round(total_cost / quantity, 4),
+                              'quantity': quantity,
+                              'positionType': 'LONG' if quantity > 0 else 'SHORT',
+                              'marketValue': round(quantity * price, 2),
+                              'totalCost': round(total_cost, 2),
+                              'Quick': {'lastTrade': price}})
+        self.__mutex.release()
+        return {'PortfolioResponse': {'AccountPortfolio': {'accountId': self.account_id, 'Position': positions, 'totalPages': 1}}}
+
+    #
+    # orders (__mutex)
+    #
+    @staticmethod
+    def __order_data(order: dict) -> dict:
+        detail = {'placedTime': order['placedTime'],
+                  'orderValue': round(order['quantity'] * order.get('limitPrice', order.get('stopPrice', 0.0)), 2),
+                  'status': order['status'],
+                  'orderTerm': order['orderTerm'],
+                  'priceType': order['priceType'],
+                  'limitPrice': order.get('limitPrice', 0),
+                  'stopPrice': order.get('stopPrice', 0),
+                  'marketSession': order['marketSession'],
+                  'allOrNone': False}
+        if order['executedTime'] is not None:
+            detail['executedTime'] = order['executedTime']
+        detail['Instrument'] = {'Product': {'symbol': order['symbol'], 'securityType': 'EQ'},
+                                'symbolDescription': order['symbol'] + ' INC COM',
+                                'orderAction': order['orderAction'],
+                                'quantityType': 'QUANTITY',
+                                'orderedQuantity': order['quantity'],
+                                'filledQuantity': order['filledQuantity'],
+                                'averageExecutionPrice': order['averageExecutionPrice']}
+        return {'orderId': order['orderId'], 'orderType': 'EQ', 'OrderDetail': detail}
+
+    #
+    #
+    #
+    def __orders_response(self, count: int, marker: Optional[str]) -> dict:
+        """
+            newest first, pages of up to min(count, max_orders_per_page) orders
+            marker = opaque text returned with the previous page (None = first page)
+                     hex of the orderId of the first order of the page, the pages do not shift
+                     when orders are placed in the meantime
+        """
+        first_id = int(marker, 16) if marker is not None else None
+        page = min(count, self.max_orders_per_page)
+        self.__mutex.acquire()
+        ids = sorted(self.__orders, reverse=True)
+        start = 0 if first_id is None else next((j for j, order_id in enumerate(ids) if order_id <= first_id), len(ids))
+        orders = [self.__order_data(self.__orders[order_id]) for order_id in ids[start:start + page]]
+        self.__mutex.release()
+        resp = {}
+        if len(ids) > start + page:
+            resp['marker'] = '%x' % ids[start + page]
+        resp['Order'] = orders
+        return {'OrdersResponse': resp}
+
+    #
+    #
+    #
+    def __place_order(self, request: dict, response: str, prev_order_id: Optional[int]) -> dict:
+        order = request['Order']
+        instrument = order['Instrument']
+        symbol = instrument['Product']['symbol'].strip().upper()
+        action = instrument['orderAction']
+        quantity = float(instrument['quantity'])
+        price_type = order['priceType']
+        if action not in ('BUY', 'SELL'):
+            raise ValueError('invalid orderAction ' + str(action))
+        if price_type not in ('MARKET', 'LIMIT', 'STOP', 'STOP_LIMIT'):
+            raise ValueError('invalid priceType ' + str(price_type))
+        if quantity <= 0:
+            raise ValueError('invalid quantity')
+
+        self.__mutex.acquire()
+        try:
+            if prev_order_id is not None:
+                prev_order = self.__orders.get(prev_order_id)
+                if prev_order is None or prev_order['status'] != 'OPEN':
+                    raise ValueError('order ' + str(prev_order_id) + ' cannot be changed')
+            held = self.__positions.get(symbol, [0.0, 0.0])[0]
+            if action == 'SELL' and quantity > held - self.__committed_quantity(symbol, 'SELL', prev_order_id):
+                raise ValueError('not enough shares of ' + symbol)
+
+            if response == 'PreviewOrderResponse':
+                preview_id = self.__next_preview_id
+                self.__next_preview_id += 1
+                return {response: {'orderType': 'EQ', 'PreviewIds': {'previewId': preview_id}}}
+
+            if prev_order_id is not None:
+                self.__close_order(self.__orders[prev_order_id], 'CANCELLED')
+            order_id = self.__next_order_id
+            self.__next_order_id += 1
+            new_order = {'orderId': order_id,
+                         'symbol': symbol,
+                         'orderAction': action,
+                         'quantity': quantity,
+                         'priceType': price_type,
+                         'orderTerm': order['orderTerm'],
+                         'marketSession': order['marketSession'],
+                         'status': 'OPEN',
+                         'placedTime': int(time.time() * 1000),
+                         'executedTime': None,
+                         'filledQuantity': 0,
+                         'averageExecutionPrice': 0}
+            if 'limitPrice' in order:
+                new_order['limitPrice'] = float(order['limitPrice'])
+            if 'stopPrice' in order:
+                new_order['stopPrice'] = float(order['stopPrice'])
+            self.__orders[order_id] = new_order
+            self.__open_orders.setdefault(symbol, set()).add(order_id)
+            self.__execute_orders(symbol)
+            return {response: {'orderType': 'EQ', 'OrderIds': {'orderId': order_id}}}
+        finally:
+            self.__mutex.release()
+
+    #
+    # orders (__mutex)
+    #     shares already committed to the open orders of action (exclude_id excluded)
+    #
+    def __committed_quantity(self, symbol: str, action: str, exclude_id: Optional[int]) -> float:
+        quantity = 0.0
+        for order_id in self.__open_orders.get(symbol, ()):
+            if order_id != exclude_id and self.__orders[order_id]['orderAction'] == action:
+                quantity += self.__orders[order_id]['quantity']
+        return quantity
+
+    #
+    #
+    #
+    def __cancel_order(self, order_id: int) -> dict:
+        self.__mutex.acquire()
+        try:
+            order = self.__orders.get(order_id)
+            if order is None or order['status'] != 'OPEN':
+                raise ValueError('order ' + str(order_id) + ' cannot be cancelled')
+            self.__close_order(order, 'CANCELLED')
+        finally:
+            self.__mutex.release()
+        return {'CancelOrderResponse': {
+            'accountId': self.account_id,
+            'orderId': order_id,
+            'cancelTime': int(time.time() * 1000),
+            'Messages': {'Message': {'code': 5011, 'description': 'Your request to cancel your order is being processed.', 'type': 'WARNING'}}}}
+
+    #
+    # orders (__mutex)
+    #
+    def __close_order(self, order: dict, status: str) -> None:
+        order['status'] = status
+        open_orders = self.__open_orders.get(order['symbol'])
+        if open_orders is not None:
+            open_orders.discard(order['orderId'])
+
+    #
+    # orders (__mutex)
+    #
+    def __execute_orders(self, symbol: str) -> None:
+        open_orders = self.__open_orders.get(symbol)
+        if not open_orders:
+            return
+        price = self.__last_price(symbol)
+        for order_id in sorted(open_orders):
+            order = self.__orders[order_id]
+            buy = order['orderAction'] == 'BUY'
+            if order['priceType'] in ('STOP', 'STOP_LIMIT') and 'triggered' not in order:
+                if (buy and price < order['stopPrice']) or (not buy and price > order['stopPrice']):
+                    continue
+                order['triggered'] = True
+            if order['priceType'] in ('LIMIT', 'STOP_LIMIT'):
+                if (buy and price > order['limitPrice']) or (not buy and price < order['limitPrice']):
+                    continue
+
+            # fill
+            quantity = order['quantity']
+            position = self.__positions.setdefault(symbol, [0.0, 0.0])
+            if buy:
+                position[0] += quantity
+                position[1] += quantity * price
+                self.__cash -= quantity * price
+            else:
+                position[1] -= position[1] * min(quantity / position[0], 1.0) if position[0] > 0 else 0.0
+                position[0] -= quantity
+                self.__cash += quantity * price
+            order['filledQuantity'] = quantity
+            order['averageExecutionPrice'] = price
+            order['executedTime'] = int(time.time() * 1000)
+            self.__close_order(order, 'EXECUTED')
+
+
+#
+#
+#
+class ReplaySession:
+    """
+        in process stand-in of the requests session used by EtradeApi (get, post, put)
+        - no network and no authorization
+        - a dropped connection raises requests.exceptions.ConnectionError
+    """
+    __broker = None
+
+    #
+    #
+    #
+    def __init__(self, broker: ReplayBroker):
+        self.__broker = broker
+
+    #
+    #
+    #
+    def __request(self, method: str, url: str, params: Optional[dict], data: Any, headers: Optional[dict]) -> requests.models.Response:
+        if params:
+            url += ('&' if '?' in url else '?') + urllib.parse.urlencode(params)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        json_format = headers is not None and headers.get('Accept') == 'application/json'
+        status, content_type, body = self.__broker.handle(method, url, data, json_format)
+        if status == 0:
+            raise requests.exceptions.ConnectionError('replay: connection dropped')
+
+        resp = requests.models.Response()
+        resp.status_code = status
+        resp.reason = http.client.responses.get(status, '')
+        resp.headers['Content-Type'] = content_type
+        resp.url = url
+        resp.encoding = 'utf-8'
+        resp._content = body
+        return resp
+
+    #
+    #
+    #
+    def get(self, url: str, params: Optional[dict] = None, headers: Optional[dict] = None, timeout: Any = None) -> requests.models.Response:
+        return self.__request('GET', url, params, None, headers)
+
+    #
+    #
+    #
+    def post(self, url: str, data: Any = None, headers: Optional[dict] = None, timeout: Any = None) -> requests.models.Response:
+        return self.__request('POST', url, None, data, headers)
+
+    #
+    #
+    #
+    def put(self, url: str, data: Any = None, headers: Optional[dict] = None, timeout: Any = None) -> requests.models.Response:
+        return self.__request('PUT', url, None, data, headers)
+
+
+#
+#
+#
+class _ReplayRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'       # keep-alive, as E*Trade
+    disable_nagle_algorithm = True
+
+    #
+    #
+    #
+    def log_message(self, format: str, *args) -> None:
+        return
+
+    #
+    #
+    #
+    def __handle(self, method: str) -> None:
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length > 0 else None
+        json_format = 'application/json' in self.headers.get('Accept', '')
+        status, content_type, data = self.server.broker.handle(method, self.path, body, json_format)
+        if status == 0:
+            self.close_connection = True
+            return
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    #
+    #
+    #
+    def do_GET(self) -> None:
+        self.__handle('GET')
+
+    #
+    #
+    #
+    def do_POST(self) -> None:
+        self.__handle('POST')
+
+    #
+    #
+    #
+    def do_PUT(self) -> None:
+        self.__handle('PUT')
@@ -7,18 +7,22 @@ from typing import Tuple, List, Optional, Callable, Any, Sequence
 
 from tabulate import tabulate
 
+from metrics import InstrumentedLock
+
 from trade_interface.e_trade_api import EtradeApi, EtradeAuthorization
 from trade_interface.market_session import market_session
+from trade_interface.order_book import OrderBook
+from trade_interface.replay_broker import ReplayBroker, ReplaySession
 from trade_interface.utils import format_order_action
 
 
 #
 #
 #
-def synchronized():
+def synchronized(lock_name: str = 'mutex'):
     def wrap(f):
         def new_function(*args, **kwargs):
-            lock = args[0].mutex
+            lock = getattr(args[0], lock_name)
             lock.acquire()
             try:
                 return f(*args, **kwargs)
@@ -32,20 +36,46 @@ def synchronized():
 #
 #
 class TradeInterface:
-    mutex: threading.RLock
+    #
+    # mutex               -> session (connect, disconnect, select_account)
+    # quote_semaphore     -> concurrent quote requests
+    # account_semaphore   -> concurrent balance and positions requests
+    # orders_semaphore    -> concurrent order listing requests
+    # order_mutex         -> order placement, change and cancel (serialized per account)
+    #
+    # mutex and order_mutex are instrumented (metrics trade.mutex.* and trade.order_mutex.*)
+    #
+    default_concurrency = {'quote': 8, 'account': 4, 'orders': 2}
+    mutex: InstrumentedLock
+    quote_semaphore: threading.BoundedSemaphore
+    account_semaphore: threading.BoundedSemaphore
+    orders_semaphore: threading.BoundedSemaphore
+    order_mutex: InstrumentedLock
     _api: Optional[EtradeApi] = None
     _selected_account: Optional[str] = None
+    _order_book: OrderBook
+    order_cache_max_age_sec: float = 5.0
+    transport: Optional[dict] = None
+    use_async_api: bool = False
+    replay_broker: Optional[ReplayBroker] = None
 
     #
     #
     #
-    def __init__(self, keys: dict, use_sandbox: bool, browser_path: str):
+    def __init__(self, keys: dict, use_sandbox: bool, browser_path: str, concurrency: Optional[dict] = None):
         keys = keys['sandbox'] if use_sandbox else keys['production']
         self._consumer_key = keys['consumer_key']
         self._consumer_secret = keys['consumer_secret']
         self._browser_path = browser_path
-        self.mutex = threading.RLock()
+        concurrency = dict(self.default_concurrency, **(concurrency or {}))
+        self.mutex = InstrumentedLock('trade.mutex', threading.RLock())
+        self.quote_semaphore = threading.BoundedSemaphore(concurrency['quote'])
+        self.account_semaphore = threading.BoundedSemaphore(concurrency['account'])
+        self.orders_semaphore = threading.BoundedSemaphore(concurrency['orders'])
+        self.order_mutex = InstrumentedLock('trade.order_mutex', threading.RLock())
         self.__use_product_key = not use_sandbox
+        self._order_book = OrderBook()
+        self.__order_book_mutex = threading.Lock()
 
     #
     # TODO Not fully tested.
@@ -73,6 +103,9 @@ class TradeInterface:
     #
     @synchronized()
     def connect(self) -> bool:
+        if self.replay_broker is not None:
+            return self.__connect_replay()
+
         oauth = EtradeAuthorization()
 
         # 1) get request token
@@ -101,12 +134,50 @@ class TradeInterface:
             return self.__error_report('connect', e)
 
         # 5) start session
+        if self.use_async_api:
+            # aiohttp is an optional dependency -> imported only if used
+            from trade_interface.e_trade_api_async import AsyncEtradeApi, SyncEtradeApiAdapter
+            try:
+                api = AsyncEtradeApi(self._consumer_key, self._consumer_secret, tokens,
+                                     use_product_key=self.__use_product_key, transport=self.transport)
+                self._api = SyncEtradeApiAdapter(api)
+            except Exception as e:
+                return self.__error_report('connect', e)
+            return True
+
+        transport = dict(EtradeApi.default_transport, **(self.transport or {}))
         try:
-            session = oauth.get_session(self._consumer_key, self._consumer_secret, tokens)
+            session = oauth.get_session(self._consumer_key, self._consumer_secret, tokens, pool_size=transport['pool_size'])
         except Exception as e:
             return self.__error_report('connect', e)
 
-        self._api = EtradeApi(session=session, use_product_key=self.__use_product_key)
+        self._api = EtradeApi(session=session, use_product_key=self.__use_product_key, transport=self.transport)
+        return True
+
+    #
+    #
+    #
+    def __connect_replay(self) -> bool:
+        """Connects to replay_broker (no authorization).
+
+        In process by default, through its http stand-in if started or if use_async_api is set.
+        """
+        tokens = {'oauth_token': 'replay', 'oauth_token_secret': 'replay'}
+        transport = dict(EtradeApi.default_transport, **(self.transport or {}))
+        try:
+            if self.use_async_api or self.replay_broker.http_url is not None:
+                transport['base_url'] = self.replay_broker.start_http_server()
+            if self.use_async_api:
+                from trade_interface.e_trade_api_async import AsyncEtradeApi, SyncEtradeApiAdapter
+                api = AsyncEtradeApi('replay', 'replay', tokens, use_product_key=self.__use_product_key, transport=transport)
+                self._api = SyncEtradeApiAdapter(api)
+            elif transport['base_url'] is not None:
+                session = EtradeAuthorization.get_session('replay', 'replay', tokens, pool_size=transport['pool_size'])
+                self._api = EtradeApi(session=session, use_product_key=self.__use_product_key, transport=transport)
+            else:
+                self._api = EtradeApi(session=ReplaySession(self.replay_broker), use_product_key=self.__use_product_key, transport=transport)
+        except Exception as e:
+            return self.__error_report('connect', e)
         return True
 
     #
@@ -127,12 +198,14 @@ class TradeInterface:
     #
     #
     @synchronized()
-    def select_account(self) -> None:
-        """Asks user to select an account."""
+    def select_account(self, selection: Optional[int] = None) -> None:
+        """Asks user to select an account (selection = index of the account, to skip the question)."""
         try:
             accounts = self._api.list_accounts()
+            if selection is not None:
+                self._selected_account = accounts[selection][3]
+                return
             print(tabulate(accounts, headers=['', 'Id', 'Desc', 'Key'], stralign='center'))
-            selection = None
             while True:
                 try:
                     selection = int(float(input('select > ')))
@@ -149,7 +222,7 @@ class TradeInterface:
     #
     #
     #
-    @synchronized()
+    @synchronized('account_semaphore')
     def get_account_balance(self) -> Tuple[float, float, float]:
         """Retrieves account balance.
 
@@ -168,7 +241,7 @@ class TradeInterface:
     #
     #
     #
-    @synchronized()
+    @synchronized('account_semaphore')
     def list_positions(self) -> List[Tuple[str, float, float, float]]:
         """Retrieves all account positions.
 
@@ -186,7 +259,7 @@ class TradeInterface:
     #
     #
     #
-    @synchronized()
+    @synchronized('quote_semaphore')
     def get_quote(self, symbols: Sequence[str],
                   only_intraday_data: bool = False) -> List[EtradeApi.QuoteData]:
         """Retrieves quote information.
@@ -262,7 +335,7 @@ class TradeInterface:
     #
     #
     #
-    @synchronized()
+    @synchronized('orders_semaphore')
     def _parse_orders(self, f: Callable[[dict], bool]) -> None:
         request_orders = 25
         marker = None
@@ -284,11 +357,45 @@ class TradeInterface:
                     if f(order):
                         return
 
-            # Next batch.
+            # Next batch (marker returned by the api).
             if marker is None:
                 break
             time.sleep(0.5)  # TODO This value can be reduced.
-            marker += request_orders
+
+    #
+    #
+    #
+    def _refresh_order_book(self, force: bool = False) -> None:
+        """Updates the order book if older than order_cache_max_age_sec.
+
+        Orders are listed newest first. The first update reads the full
+        history, the next ones stop at the first known and unchanged order
+        once all the orders that could still change have been seen.
+        """
+        self.__order_book_mutex.acquire()
+        try:
+            if (not force) and self._order_book.is_fresh(self.order_cache_max_age_sec):
+                return
+
+            incremental = self._order_book.is_complete()
+            unseen_pending = self._order_book.pending_ids()
+
+            stopped = False
+
+            def f(order: dict):
+                nonlocal stopped
+                known = self._order_book.update(order)
+                unseen_pending.discard(order['orderId'])
+                stopped = incremental and known and len(unseen_pending) == 0
+                return stopped
+
+            self._parse_orders(f)
+            if not stopped:
+                # full history read -> drop the orders that disappeared
+                self._order_book.discard(unseen_pending)
+            self._order_book.mark_refreshed()
+        finally:
+            self.__order_book_mutex.release()
 
     #
     #
@@ -299,14 +406,8 @@ class TradeInterface:
         Returns:
             List of all orders.
         """
-        order_list = []
-
-        def f(order: dict):
-            order_list.append(order)
-            return False
-
-        self._parse_orders(f)
-        return tuple(order_list)
+        self._refresh_order_book()
+        return tuple(self._order_book.orders())
 
     #
     #
@@ -320,17 +421,44 @@ class TradeInterface:
         Returns:
             Order status.
         """
-        order_status = None
+        # final status never changes
+        order = self._order_book.get(order_id)
+        if order is not None and order['orderStatus'] in OrderBook.final_status:
+            return order['orderStatus']
+
+        if self._order_book.is_complete():
+            self._refresh_order_book()
+            order = self._order_book.get(order_id)
+            if order is None:
+                # placed after the last update?
+                self._refresh_order_book(force=True)
+                order = self._order_book.get(order_id)
+        else:
+            order = self._find_order(order_id)
+        return order['orderStatus'] if order is not None else None
+
+    #
+    #
+    #
+    def _find_order(self, order_id: int) -> Optional[dict]:
+        """Looks up a single order without reading the full history.
+
+        Orders are listed newest first, in decreasing orderId, so the search
+        stops at the order or at the first older order. A recent order costs
+        a single request.
+        """
+        found = None
 
         def f(order: dict):
-            nonlocal order_status
+            nonlocal found
+            self._order_book.update(order)
             if order['orderId'] == order_id:
-                order_status = order['orderStatus']
+                found = order
                 return True
-            return False
+            return order['orderId'] < order_id
 
         self._parse_orders(f)
-        return order_status
+        return found
 
     #
     #
@@ -345,20 +473,8 @@ class TradeInterface:
         Returns:
             List of orders.
         """
-        order_list = []
-
-        def f(order: dict):
-            if order['symbol'] != symbol:
-                return False
-            if order['orderAction'] != action:
-                return False
-            if order['orderStatus'] != 'OPEN':
-                return False
-            order_list.append((order['orderId'], order))
-            return False
-
-        self._parse_orders(f)
-        return order_list
+        self._refresh_order_book()
+        return self._order_book.find(symbol, action, 'OPEN')
 
     #
     #
@@ -372,16 +488,14 @@ class TradeInterface:
         Returns:
             None
         """
-        def f(order: dict):
+        self._refresh_order_book()
+        for order in self._order_book.orders():
             order_function(order)
-            return False
-
-        self._parse_orders(f)
 
     #
     #
     #
-    @synchronized()
+    @synchronized('order_mutex')
     def cancel_order(self, order_id: int) -> str:
         """Cancels an order.
 
@@ -398,12 +512,14 @@ class TradeInterface:
             raise ValueError('cancel_order: wrong response format.')
         except Exception as e:
             raise ValueError('cancel_order: ' + str(e))
+        finally:
+            self._order_book.invalidate()
         return res_msg
 
     #
     # TODO Not fully tested.
     #
-    @synchronized()
+    @synchronized('order_mutex')
     def place_limit_order(self,
                           action: str,
                           symbol: str,
@@ -475,13 +591,15 @@ class TradeInterface:
             raise ValueError('place_limit_order: wrong response format.')
         except Exception as e:
             raise ValueError('place_limit_order: ' + str(e))
+        finally:
+            self._order_book.invalidate()
 
         return order_num, msg
 
     #
     # TODO Not fully tested.
     #
-    @synchronized()
+    @synchronized('order_mutex')
     def place_stop_order(self,
                          action: str,
                          symbol: str,
@@ -532,5 +650,7 @@ class TradeInterface:
             raise ValueError('place_stop_order: wrong response format.')
         except Exception as e:
             raise ValueError('place_stop_order: ' + str(e))
+        finally:
+            self._order_book.invalidate()
 
         return order_num, msg
@@ -1,2 +1,5 @@
 from trading_platform_servers.graph_server import GraphServer
 from trading_platform_servers.quote_server import QuoteServer
+from trading_platform_servers.tick_buffer import TickBuffer
+from trading_platform_servers.tick_file import TickFile
+from trading_platform_servers.ticker import Ticker
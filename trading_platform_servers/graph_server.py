@@ -11,6 +11,9 @@ import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 from functools import partial
 
+from trade_interface import time_from_epoch_ns, market_timezone
+from trading_platform_servers.tick_buffer import TickBuffer
+
 
 #
 #
@@ -20,6 +23,7 @@ from functools import partial
 #
 class GraphServer:
     aux_data = None
+    quote_freshness_sec = 5.0       # max age of the quotes of the figures (None = every QuoteServer tick)
     __mutex = None
     __mutex_inner = None
     __figure_list = None
@@ -50,7 +54,7 @@ class GraphServer:
             return
         self.__mutex.release()
         #
-        self.aux_data['quote_server'].add_quote(symbol)
+        self.aux_data['quote_server'].add_quote(symbol, self.quote_freshness_sec)
         #
         self.__mutex.acquire()
         self.__to_add.append(symbol)
@@ -66,7 +70,7 @@ class GraphServer:
             if f[0] == symbol:
                 f[0] = None
         self.__mutex_inner.release()
-        self.aux_data['quote_server'].remove_quote(symbol)
+        self.aux_data['quote_server'].remove_quote(symbol, self.quote_freshness_sec)
 
     #
     #
@@ -122,7 +126,8 @@ class GraphServer:
                     line, = ax.plot([], 'o-', color='C0')
                     #
                     fig.show()
-                    self.__figure_list.append([symbol, fig, ax, line])
+                    history = TickBuffer(self.aux_data['quote_server'].maxlen)
+                    self.__figure_list.append([symbol, fig, ax, line, history, 0])
                 self.__to_add = []
             #
             self.__mutex.release()
@@ -145,13 +150,16 @@ class GraphServer:
                 try:
                     for f in self.__figure_list:
                         if f[0] is not None:
-                            data_x, data_y = self.aux_data['quote_server'].get_quote(f[0], all_data=True)
-                            if len(data_x) != 0:
-                                title = f[0] + '  ' + data_x[-1].strftime("%H:%M:%S").ljust(8) + '    {0:.2f}'.format(data_y[-1])
+                            data_x, data_y, f[5] = self.aux_data['quote_server'].get_quote_since(f[0], f[5])
+                            if data_x is not None and len(data_x) != 0:
+                                f[4].extend(data_x, data_y)
+                                data_x, data_y = f[4].last()
+                                last_time = time_from_epoch_ns(int(data_x[-1].astype('int64')))
+                                title = f[0] + '  ' + last_time.strftime("%H:%M:%S").ljust(8) + '    {0:.2f}'.format(data_y[-1])
                                 f[2].set_title(title)
                                 f[2].get_yaxis().get_major_formatter().set_scientific(False)
-                                f[2].xaxis.set_minor_formatter(mdates.DateFormatter('%H'))
-                                f[2].xaxis.set_major_formatter(mdates.DateFormatter('%M:%S'))
+                                f[2].xaxis.set_minor_formatter(mdates.DateFormatter('%H', tz=market_timezone))
+                                f[2].xaxis.set_major_formatter(mdates.DateFormatter('%M:%S', tz=market_timezone))
                                 f[3].set_data(data_x, data_y)
                                 f[2].relim()                              # recompute the data limits TODO blocked by HOME Button!!!
                                 f[2].autoscale_view(scalex=True, scaley=True, tight=True)           # automatic axis scaling
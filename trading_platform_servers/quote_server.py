@@ -1,26 +1,86 @@
-import datetime
 import threading
-from collections import deque
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy
 
-from trade_interface import current_time
+from metrics import InstrumentedLock, counter, histogram
+from trade_interface import time_from_epoch_ns
+from trading_platform_servers.tick_buffer import TickBuffer
+from trading_platform_servers.tick_file import TickFile
+from trading_platform_servers.ticker import Ticker
 
 
 #
 #
 #
 class QuoteServer(threading.Thread):
+    #
+    # __mutex         -> guards __quote_db only (never held during I/O)
+    # __quote_db      -> symbol: [freshness, TickBuffer, buffer_mutex, last_fetch, TickFile, day]
+    #                        freshness  = max age (sec) requested by each subscriber (0 = every tick)
+    #                        last_fetch = time.monotonic() of the last price (QuoteServer thread only)
+    #                        TickFile   = samples of the day on disk (None = no tick_directory),
+    #                                     the TickBuffer keeps the last maxlen ones (same cursors)
+    #                        day        = yyyymmdd of the TickBuffer, its cursors restart from 0 when a
+    #                                     new day replaces it (get_quote_since returns it with the cursor)
+    #
     __mutex = None
     __exiting = None
     __quote_db = None
     __mutex_listeners = None
     __listeners = None
+    __symbol_listeners = None
     __maxlen = 60 * 60 * 6
     #
     __trade = None
+    __executor = None
+    #
+    # metrics
+    #     quote_server.fetch_chunk   -> latency of each request (max_symbols_per_request symbols)
+    #     quote_server.tick          -> fetch + store + notify of all the followed symbols
+    #     quote_server.tick_overruns -> ticks ended after the deadline of the next one
+    #     quote_server.ticks_missed  -> deadlines dropped by the ticker policy
+    #     quote_server.tick_interval -> interval between the deadlines (changes only when adaptive)
+    #     quote_server.symbols_fetched / quote_server.symbols_deferred
+    #                                -> symbols requested / due but left to the next tick (max_requests_per_sec)
+    #     quote_server.mutex.*       -> wait and hold times of __mutex
+    #
+    __fetch_latency = None
+    __fetch_errors = None
+    __tick_latency = None
+    __tick_overruns = None
+    __ticks_missed = None
+    __tick_interval = None
+    __symbols_fetched = None
+    __symbols_deferred = None
+    __ticker = None
+    __request_budget = None     # requests left to the next ticks (max_requests_per_sec, QuoteServer thread only)
+    #
+    # time_frequency_sec      -> tick, the highest frequency a symbol can be fetched at
+    # max_requests_per_sec    -> broker budget of quote requests (None = no limit), the due symbols
+    #                            are fetched by urgency, the others wait for the next tick
     #
     time_frequency_sec = None
+    max_symbols_per_request = 25
+    max_concurrent_requests = 8
+    max_requests_per_sec = None
+    #
+    # ticker (see Ticker)
+    #     tick_policy          -> skip, coalesce or burst
+    #     tick_adaptive        -> interval between time_frequency_sec and tick_max_interval_sec
+    #                             following the broker latency and rate limiting
+    #
+    tick_policy = 'skip'
+    tick_max_burst = 5
+    tick_adaptive = False
+    tick_max_interval_sec = 5.0
+    tick_latency_factor = 2.0
+    #
+    # tick_directory          -> tick_directory/yyyymmdd/SYMBOL.ticks, history of each symbol in the
+    #                            market day (None = in memory only, lost at restart)
+    #
+    tick_directory = None
 
     #
     #
@@ -30,61 +90,223 @@ class QuoteServer(threading.Thread):
         self.setName('QuoteServer')
 
         #
-        self.__mutex = threading.Lock()
+        self.__mutex = InstrumentedLock('quote_server.mutex')
         self.__exiting = threading.Event()
         self.__quote_db = dict()
         self.__mutex_listeners = threading.Lock()
         self.__listeners = set()
+        self.__symbol_listeners = dict()
         #
         self.__trade = trade
+        self.__executor = None
+        #
+        self.__fetch_latency = histogram('quote_server.fetch_chunk')
+        self.__fetch_errors = counter('quote_server.fetch_errors')
+        self.__tick_latency = histogram('quote_server.tick')
+        self.__tick_overruns = counter('quote_server.tick_overruns')
+        self.__ticks_missed = counter('quote_server.ticks_missed')
+        self.__tick_interval = histogram('quote_server.tick_interval')
+        self.__symbols_fetched = counter('quote_server.symbols_fetched')
+        self.__symbols_deferred = counter('quote_server.symbols_deferred')
+        self.__ticker = None
+        self.__request_budget = 0.0
         #
         self.time_frequency_sec = 1.0
 
+    #
+    #
+    #
+    @staticmethod
+    def _is_rate_limited(e: Exception) -> bool:
+        msg = str(e).lower()
+        return '429' in msg or 'too many requests' in msg or 'rate limit' in msg
+
+    #
+    #
+    #
+    def __fetch_chunk(self, symbols):
+        """
+            symbols -> (symbols, prices, latency_sec, rate_limited)
+        """
+        t0 = time.perf_counter()
+        try:
+            prices = self.__trade.get_current_price_multi(symbols)
+            latency = time.perf_counter() - t0
+            self.__fetch_latency.observe(latency)
+            return symbols, prices, latency, False
+        except Exception as e:
+            latency = time.perf_counter() - t0
+            self.__fetch_latency.observe(latency)
+            self.__fetch_errors.inc()
+            print('QuoteServer: [' + ','.join(symbols) + '] ' + str(e))  # TODO HANDLE CONNECTION LOST!!! WITH QUIT!!! or retry
+            return symbols, [None] * len(symbols), latency, self._is_rate_limited(e)
+
+    #
+    #
+    #
+    def __fetch_prices(self, symbols):
+        """
+            split symbols in chunks of max_symbols_per_request
+            and fetch them concurrently, a failing chunk does not affect the others
+        """
+        n = self.max_symbols_per_request
+        chunks = [symbols[j:j + n] for j in range(0, len(symbols), n)]
+        if len(chunks) == 1:
+            return [self.__fetch_chunk(chunks[0])]
+        return list(self.__executor.map(self.__fetch_chunk, chunks))
+
+    #
+    #
+    #
+    def __select_symbols(self, entries, now, interval_sec):
+        """
+            entries = symbol: (entry, freshness)
+            -> symbols to fetch in this tick
+            - a symbol is due when its price is older than its freshness (within half tick)
+            - due symbols are sorted by urgency (age / freshness), the most overdue first,
+              and limited to the requests of this tick (max_requests_per_sec), a budget below
+              one request per tick is carried to the next ticks
+            - the free slots of the last request are filled with the next most urgent symbols
+        """
+        urgency = []
+        for symbol, (entry, freshness) in entries.items():
+            age = now - entry[3] if entry[3] is not None else float('inf')
+            urgency.append(((age + interval_sec / 2.0) / max(freshness, interval_sec), symbol))
+        urgency.sort(reverse=True)
+        due = [symbol for u, symbol in urgency if u >= 1.0]
+
+        n = self.max_symbols_per_request
+        if self.max_requests_per_sec is not None:
+            # no more than the requests of one tick (or one request) saved up
+            tick_budget = self.max_requests_per_sec * interval_sec
+            self.__request_budget = min(self.__request_budget + tick_budget, max(tick_budget, 1.0))
+            max_symbols = int(self.__request_budget) * n
+            if len(due) > max_symbols:
+                self.__symbols_deferred.inc(len(due) - max_symbols)
+                self.__request_budget -= int(self.__request_budget)
+                return due[:max_symbols]
+        n_symbols = min(-(-len(due) // n) * n, len(urgency))
+        if self.max_requests_per_sec is not None:
+            self.__request_budget -= -(-n_symbols // n)
+        return [symbol for _, symbol in urgency[:n_symbols]]
+
+    #
+    #
+    #
+    @staticmethod
+    def __day(time_ns):
+        return int(time_from_epoch_ns(time_ns).strftime('%Y%m%d'))
+
+    #
+    #
+    #
+    def __open_ticks(self, symbol, day):
+        """
+            -> TickFile, TickBuffer with the last maxlen samples of the file
+            -> None, empty TickBuffer (no tick_directory or the file cannot be opened)
+        """
+        if self.tick_directory is None:
+            return None, TickBuffer(self.__maxlen)
+        try:
+            tick_file = TickFile(TickFile.path(self.tick_directory, symbol, day), day)
+        except (OSError, ValueError) as e:
+            print('QuoteServer: ' + str(e))
+            return None, TickBuffer(self.__maxlen)
+        n = len(tick_file)
+        start = max(n - self.__maxlen, 0)
+        buffer = TickBuffer(self.__maxlen, start=start)
+        buffer.extend(*tick_file.read(start, n))
+        return tick_file, buffer
+
+    #
+    #
+    #
+    def __store(self, symbol, entry, time_ns, day, price):
+        """
+            called with entry[2] held
+            a new day starts a new file and a new buffer (the cursors restart from 0)
+        """
+        tick_file = entry[4]
+        if tick_file is not None and tick_file.closed:
+            # removed in the meantime
+            tick_file = None
+        elif tick_file is not None and tick_file.day != day:
+            tick_file.close()
+            entry[4], entry[1] = self.__open_ticks(symbol, day)
+            entry[5] = day
+            tick_file = entry[4]
+        entry[1].append(time_ns, price)
+        if tick_file is not None:
+            try:
+                tick_file.append(time_ns, price)
+                tick_file.flush()
+            except OSError as e:
+                print('QuoteServer: ' + symbol + ' ' + str(e))
+                tick_file.close()
+                entry[4] = None
+
+    #
+    #
+    #
+    @property
+    def tick_interval_sec(self):
+        """Current interval between two ticks (time_frequency_sec unless tick_adaptive)."""
+        ticker = self.__ticker
+        return ticker.interval_sec if ticker is not None else self.time_frequency_sec
+
     #
     #
     #
     def run(self):
-        next_time = current_time()
-        while True:
+        self.__executor = ThreadPoolExecutor(max_workers=self.max_concurrent_requests, thread_name_prefix='QuoteServer')
+        self.__ticker = Ticker(self.time_frequency_sec, policy=self.tick_policy, max_burst=self.tick_max_burst,
+                               adaptive=self.tick_adaptive, max_interval_sec=self.tick_max_interval_sec,
+                               latency_factor=self.tick_latency_factor)
+        ticker = self.__ticker
+        #
+        # wait and check exiting
+        #
+        while not ticker.wait(self.__exiting):
+            tick_start = time.perf_counter()
+
             #
-            # wait and check exiting
+            # Snapshot of the followed symbols
             #
-            time_diff = current_time() - next_time
-            second_left = self.time_frequency_sec - (time_diff.seconds + (time_diff.microseconds / (1000.0*1000.0)))
-            if second_left < 0.0:
-                print('lost ticker: reset')
-                second_left = 0.0
-                next_time = current_time()
-            else:
-                next_time = next_time + datetime.timedelta(
-                    milliseconds=self.time_frequency_sec * 1000.0)  # TODO use market time
-            if self.__exiting.wait(second_left):
-                break
+            self.__mutex.acquire()
+            entries = {symbol: (entry, min(entry[0])) for symbol, entry in self.__quote_db.items()}
+            self.__mutex.release()
 
             #
-            # Start
+            # Fetch (no lock held)
             #
-            self.__mutex.acquire()
-            symbols = [symbol for symbol in self.__quote_db]
+            now = time.monotonic()
+            symbols = self.__select_symbols(entries, now, ticker.interval_sec)
+            self.__symbols_fetched.inc(len(symbols))
             if len(symbols) != 0:
-                try:
-                    # ask for prices
-                    prices = self.__trade.get_current_price_multi(symbols)
+                # ask for prices
+                results = self.__fetch_prices(symbols)
 
-                    # fill db
-                    ask_time = current_time()
-                    for j in range(len(symbols)):
+                # fill db
+                #   a symbol removed in the meantime is written to its
+                #   detached buffer and then discarded
+                ask_time = time.time_ns()
+                day = self.__day(ask_time)
+                updated_symbols = []
+                for chunk_symbols, prices, latency, rate_limited in results:
+                    ticker.observe_latency(latency)
+                    if rate_limited:
+                        ticker.rate_limited()
+                    for j in range(len(chunk_symbols)):
                         if prices[j] is not None:
-                            self.__quote_db[symbols[j]][1].append([prices[j],
-                                                                   ask_time])    # TODO Not fully tested.
+                            entry = entries[chunk_symbols[j]][0]
+                            entry[3] = now
+                            entry[2].acquire()
+                            self.__store(chunk_symbols[j], entry, ask_time, day, prices[j])
+                            entry[2].release()
+                            updated_symbols.append(chunk_symbols[j])
 
-                except Exception as e:
-                    print('QuoteServer: ' + str(e))  # TODO HANDLE CONNECTION LOST!!! WITH QUIT!!! or retry
-
-            #
-            # End
-            #
-            self.__mutex.release()
+                # notify symbol listeners
+                self.__notify_symbol_listeners(updated_symbols)
 
             #
             # Wake up consumers
@@ -93,12 +315,39 @@ class QuoteServer(threading.Thread):
             for data_ready_flags in self.__listeners:
                 data_ready_flags.set()
             self.__mutex_listeners.release()
+            self.__tick_latency.observe(time.perf_counter() - tick_start)
+
+            #
+            # next deadline
+            #
+            overruns = ticker.overruns
+            missed = ticker.missed
+            ticker.tick_done()
+            self.__tick_overruns.inc(ticker.overruns - overruns)
+            self.__ticks_missed.inc(ticker.missed - missed)
+            self.__tick_interval.observe(ticker.interval_sec)
 
         #
         #
         #
+        self.__executor.shutdown(wait=True)
+        self.__mutex.acquire()
+        entries = list(self.__quote_db.values())
+        self.__mutex.release()
+        for entry in entries:
+            entry[2].acquire()
+            if entry[4] is not None:
+                entry[4].close()
+            entry[2].release()
         print('QuoteServer stopped.')
 
+    #
+    #
+    #
+    @property
+    def maxlen(self):
+        return self.__maxlen
+
     #
     #
     #
@@ -120,57 +369,197 @@ class QuoteServer(threading.Thread):
     #
     #
     #
-    def add_quote(self, symbol):
+    def add_symbol_listener(self, symbol, callback):
+        """
+            callback() is called, from the QuoteServer thread, every time a new price of symbol is available
+            callback must be fast and non blocking
+        """
         symbol = symbol.strip().upper()
+        self.__mutex_listeners.acquire()
+        if symbol not in self.__symbol_listeners:
+            self.__symbol_listeners[symbol] = []
+        self.__symbol_listeners[symbol].append(callback)
+        self.__mutex_listeners.release()
+
+    #
+    #
+    #
+    def remove_symbol_listener(self, symbol, callback):
+        symbol = symbol.strip().upper()
+        self.__mutex_listeners.acquire()
+        if symbol in self.__symbol_listeners:
+            if callback in self.__symbol_listeners[symbol]:
+                self.__symbol_listeners[symbol].remove(callback)
+            if len(self.__symbol_listeners[symbol]) == 0:
+                self.__symbol_listeners.pop(symbol)
+        self.__mutex_listeners.release()
+
+    #
+    #
+    #
+    def __notify_symbol_listeners(self, symbols):
+        self.__mutex_listeners.acquire()
+        callbacks = [c for symbol in symbols if symbol in self.__symbol_listeners for c in self.__symbol_listeners[symbol]]
+        self.__mutex_listeners.release()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print('QuoteServer: listener ' + str(e))
+
+    #
+    #
+    #
+    def add_quote(self, symbol, freshness_sec=None):
+        """
+            follows symbol, its price is kept at most freshness_sec old (None = every tick)
+            the symbol is fetched at the highest frequency requested by its subscribers
+        """
+        symbol = symbol.strip().upper()
+        freshness_sec = freshness_sec if freshness_sec is not None else 0.0
+        self.__mutex.acquire()
+        if symbol in self.__quote_db:
+            self.__quote_db[symbol][0].append(freshness_sec)
+            self.__mutex.release()
+            return
+        self.__mutex.release()
+
+        # history of the day (file I/O, no lock held)
+        day = self.__day(time.time_ns())
+        tick_file, buffer = self.__open_ticks(symbol, day)
+
         self.__mutex.acquire()
         if symbol not in self.__quote_db:
-            self.__quote_db[symbol] = [1, deque(maxlen=self.__maxlen)]
+            self.__quote_db[symbol] = [[freshness_sec], buffer, threading.Lock(), None, tick_file, day]
+            tick_file = None
         else:
-            self.__quote_db[symbol][0] += 1
+            # added in the meantime
+            self.__quote_db[symbol][0].append(freshness_sec)
         self.__mutex.release()
+        if tick_file is not None:
+            tick_file.close()
 
     #
     #
     #
-    def remove_quote(self, symbol):
+    def remove_quote(self, symbol, freshness_sec=None):
+        """
+            freshness_sec = the one passed to add_quote
+            (no subscriber with that freshness -> the subscribers of symbol are left unchanged)
+        """
         symbol = symbol.strip().upper()
+        freshness_sec = freshness_sec if freshness_sec is not None else 0.0
+        removed = None
+        unknown = False
         self.__mutex.acquire()
         if symbol in self.__quote_db:
-            self.__quote_db[symbol][0] -= 1
-            if self.__quote_db[symbol][0] <= 0:
-                self.__quote_db.pop(symbol)
+            freshness = self.__quote_db[symbol][0]
+            if freshness_sec in freshness:
+                freshness.remove(freshness_sec)
+                if len(freshness) == 0:
+                    removed = self.__quote_db.pop(symbol)
+            else:
+                unknown = True
+        self.__mutex.release()
+        if unknown:
+            print('QuoteServer: remove_quote ' + symbol + ' has no subscriber with freshness_sec = ' + str(freshness_sec) + '.')
+        if removed is not None:
+            removed[2].acquire()
+            if removed[4] is not None:
+                removed[4].close()
+            removed[2].release()
+
+    #
+    #
+    #
+    def quote_interval_sec(self, symbol):
+        """Expected time between two prices of symbol (None if not followed)."""
+        symbol = symbol.strip().upper()
+        self.__mutex.acquire()
+        entry = self.__quote_db.get(symbol)
+        freshness = min(entry[0]) if entry is not None else None
         self.__mutex.release()
+        if freshness is None:
+            return None
+        return max(freshness, self.tick_interval_sec)
 
     #
     #
     #
     def list_quote(self):
         self.__mutex.acquire()
-        list_quote = [x.ljust(6) + ' -> ' + str(self.__quote_db[x][0]) for x in self.__quote_db]
+        list_quote = [x.ljust(6) + ' -> ' + str(len(self.__quote_db[x][0])) + '  every ' + str(max(min(self.__quote_db[x][0]), self.tick_interval_sec)) + ' s' for x in self.__quote_db]
         self.__mutex.release()
         return list_quote
 
+    #
+    #
+    #
+    def __get_entry(self, symbol):
+        self.__mutex.acquire()
+        entry = self.__quote_db.get(symbol)
+        self.__mutex.release()
+        return entry
+
     #
     #
     #
     def get_quote(self, symbol, all_data):
-        if symbol not in self.__quote_db:
+        """
+            data_x = datetime64[ns] array (UTC)
+            data_y = float64 array
+            all_data -> all the samples of the day (the ones out of the TickBuffer are read from the TickFile)
+        """
+        entry = self.__get_entry(symbol)
+        if entry is None:
             return None, None
 
-        self.__mutex.acquire()
-        database = self.__quote_db[symbol][1]
-        if len(database) == 0:
-            self.__mutex.release()
-            return [], numpy.array([])
-        if all_data:
-            data_x = [database[j][1] for j in range(len(database))]
-            data_y = numpy.array([database[j][0] for j in range(len(database))])
+        entry[2].acquire()
+        buffer = entry[1]
+        older = buffer.count - len(buffer)
+        if all_data and entry[4] is not None and older > 0:
+            file_x, file_y = entry[4].read(0, older)
+            data_x, data_y = buffer.last()
+            data_x = numpy.concatenate((file_x, data_x))
+            data_y = numpy.concatenate((file_y, data_y))
         else:
-            data_x = [database[-1][1]]
-            data_y = numpy.array([database[-1][0]])
-        self.__mutex.release()
+            data_x, data_y = buffer.last(None if all_data else 1)
+        entry[2].release()
         return data_x, data_y
 
+    #
+    #
+    #
+    def get_quote_since(self, symbol, cursor):
+        """
+            incremental read -> only the samples added after cursor
+
+            cursor = 0 at the first call, then the returned value (day, samples read), a cursor
+                     of another day reads the day from its first sample
+            data_x = datetime64[ns] array (UTC)
+            data_y = float64 array
+        """
+        entry = self.__get_entry(symbol)
+        if entry is None:
+            return None, None, cursor
+
+        entry[2].acquire()
+        buffer = entry[1]
+        day = entry[5]
+        count = cursor[1] if isinstance(cursor, tuple) and cursor[0] == day else 0
+        older = buffer.count - len(buffer)
+        if entry[4] is not None and count < older:
+            # the samples out of the TickBuffer are read from the TickFile
+            file_x, file_y = entry[4].read(count, older)
+            data_x, data_y = buffer.last()
+            data_x = numpy.concatenate((file_x, data_x))
+            data_y = numpy.concatenate((file_y, data_y))
+            count = buffer.count
+        else:
+            data_x, data_y, count = buffer.since(count)
+        entry[2].release()
+        return data_x, data_y, (day, count)
+
     #
     #
     #
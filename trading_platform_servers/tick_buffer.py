@@ -0,0 +1,162 @@
+import numpy
+
+
+#
+#
+#
+class TickBuffer:
+    """
+        - preallocated ring buffer of (time, price) samples
+        - time  = int64   epoch ns (UTC)
+        - price = float64
+        - mirrored -> every sample is stored twice (2x memory), the last samples are always
+                      contiguous and view() never copies
+        - not thread safe
+    """
+    __capacity = None
+    __copies = None         # offsets of the copies of the samples, (0,) or (0, capacity) if mirrored
+    __times = None
+    __prices = None
+    __count = None
+    __start = None
+
+    #
+    #
+    #
+    def __init__(self, capacity: int, start: int = 0, mirrored: bool = False):
+        """
+            start = cursor of the first sample (the previous ones are kept elsewhere, e.g. TickFile)
+        """
+        self.__capacity = capacity
+        self.__copies = (0, capacity) if mirrored else (0,)
+        self.__times = numpy.zeros(capacity * len(self.__copies), dtype=numpy.int64)
+        self.__prices = numpy.zeros(capacity * len(self.__copies), dtype=numpy.float64)
+        self.__count = start
+        self.__start = start
+
+    #
+    #
+    #
+    def __len__(self) -> int:
+        return min(self.__count - self.__start, self.__capacity)
+
+    #
+    #
+    #
+    @property
+    def count(self) -> int:
+        """Number of samples appended so far (cursor of the next sample)."""
+        return self.__count
+
+    #
+    #
+    #
+    def append(self, time_ns: int, price: float) -> None:
+        j = self.__count % self.__capacity
+        for k in self.__copies:
+            self.__times[k + j] = time_ns
+            self.__prices[k + j] = price
+        self.__count += 1
+
+    #
+    #
+    #
+    def extend(self, times: numpy.ndarray, prices: numpy.ndarray) -> None:
+        times = times.view(numpy.int64)
+        n = len(times)
+        if n > self.__capacity:
+            # only the last capacity samples survive
+            self.__count += n - self.__capacity
+            times = times[-self.__capacity:]
+            prices = prices[-self.__capacity:]
+            n = self.__capacity
+        j = self.__count % self.__capacity
+        first = min(n, self.__capacity - j)
+        for k in self.__copies:
+            self.__times[k + j:k + j + first] = times[:first]
+            self.__prices[k + j:k + j + first] = prices[:first]
+            self.__times[k:k + n - first] = times[first:]
+            self.__prices[k:k + n - first] = prices[first:]
+        self.__count += n
+
+    #
+    #
+    #
+    def last(self, n: int = None) -> (numpy.ndarray, numpy.ndarray):
+        """Returns the last n samples (all if None).
+
+        Args:
+            n: Number of samples.
+
+        Returns:
+            times: datetime64[ns] array.
+            prices: float64 array.
+        """
+        size = len(self)
+        if n is None or n > size:
+            n = size
+        end = self.__count % self.__capacity
+        start = end - n
+        if start >= 0 or len(self.__copies) == 2:
+            if start < 0:
+                # mirrored -> the second copy is contiguous
+                start, end = start + self.__capacity, end + self.__capacity
+            # one contiguous copy
+            times = self.__times[start:end].copy()
+            prices = self.__prices[start:end].copy()
+        else:
+            # wrapped -> one contiguous copy
+            times = numpy.concatenate((self.__times[start:], self.__times[:end]))
+            prices = numpy.concatenate((self.__prices[start:], self.__prices[:end]))
+        return times.view('datetime64[ns]'), prices
+
+    #
+    #
+    #
+    def view(self, n: int = None) -> (numpy.ndarray, numpy.ndarray):
+        """Returns the last n samples (all if None) without copy.
+
+        The arrays are read-only and change with the next append / extend.
+        A buffer that is not mirrored copies the samples when they wrap.
+
+        Args:
+            n: Number of samples.
+
+        Returns:
+            times: datetime64[ns] array.
+            prices: float64 array.
+        """
+        size = len(self)
+        if n is None or n > size:
+            n = size
+        end = self.__count % self.__capacity
+        if end - n < 0:
+            if len(self.__copies) == 1:
+                return self.last(n)
+            end += self.__capacity
+        times = self.__times[end - n:end].view('datetime64[ns]')
+        prices = self.__prices[end - n:end].view()
+        times.flags.writeable = False
+        prices.flags.writeable = False
+        return times, prices
+
+    #
+    #
+    #
+    def since(self, cursor: int) -> (numpy.ndarray, numpy.ndarray, int):
+        """Returns the samples appended after cursor.
+
+        Args:
+            cursor: Value of count at the previous read (0 for all).
+                    A cursor ahead of count means that the buffer has been
+                    recreated, and all the samples are returned.
+
+        Returns:
+            times: datetime64[ns] array.
+            prices: float64 array.
+            cursor: Cursor for the next read.
+        """
+        if cursor > self.__count:
+            cursor = 0
+        times, prices = self.last(self.__count - cursor)
+        return times, prices, self.__count
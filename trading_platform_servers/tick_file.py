@@ -0,0 +1,115 @@
+import os
+import struct
+
+import numpy
+
+
+#
+#
+#
+class TickFile:
+    """
+        - append-only file of the (time, price) samples of one symbol in one market day
+        - header  (16 bytes): magic b'TICK', version (uint16), record size (uint16), day (int64, yyyymmdd)
+        - records (16 bytes): time = int64 epoch ns (UTC), price = float64
+        - reads go through numpy.memmap (only the pages that are read are loaded)
+        - a partial record at the end (crash during a write) is dropped when the file is opened
+        - record j is the sample j of the day (same cursor of TickBuffer when the buffer starts at len(file))
+        - not thread safe
+    """
+    magic = b'TICK'
+    version = 1
+    header = struct.Struct('<4sHHq')
+    record = struct.Struct('<qd')
+    record_dtype = numpy.dtype([('time', '<i8'), ('price', '<f8')])
+
+    __path = None
+    __day = None
+    __fp = None
+    __count = None
+    __flushed = None
+    __map = None
+
+    def __init__(self, path: str, day: int):
+        self.__path = path
+        self.__day = day
+        if os.path.isfile(path) and os.path.getsize(path) >= self.header.size:
+            self.__fp = open(path, 'r+b')
+            magic, version, record_size, file_day = self.header.unpack(self.__fp.read(self.header.size))
+            if magic != self.magic or version != self.version or record_size != self.record.size or file_day != day:
+                self.__fp.close()
+                raise ValueError('TickFile: ' + path + ' is not a tick file of ' + str(day) + '.')
+            size = os.path.getsize(path)
+            self.__count = (size - self.header.size) // self.record.size
+            self.__fp.truncate(self.header.size + self.__count * self.record.size)
+            self.__fp.seek(0, os.SEEK_END)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.__fp = open(path, 'w+b')
+            self.__fp.write(self.header.pack(self.magic, self.version, self.record.size, day))
+            self.__fp.flush()
+            self.__count = 0
+        self.__flushed = self.__count
+        self.__map = None
+
+    #
+    #
+    #
+    @staticmethod
+    def path(directory: str, symbol: str, day: int) -> str:
+        return os.path.join(directory, str(day), symbol + '.ticks')
+
+    #
+    #
+    #
+    def __len__(self) -> int:
+        return self.__count
+
+    @property
+    def day(self) -> int:
+        return self.__day
+
+    @property
+    def closed(self) -> bool:
+        return self.__fp is None
+
+    #
+    #
+    #
+    def append(self, time_ns: int, price: float) -> None:
+        self.__fp.write(self.record.pack(time_ns, price))
+        self.__count += 1
+
+    #
+    #
+    #
+    def flush(self) -> None:
+        self.__fp.flush()
+        self.__flushed = self.__count
+
+    #
+    #
+    #
+    def read(self, start: int, end: int) -> (numpy.ndarray, numpy.ndarray):
+        """Returns the samples [start, end) (only flushed samples can be read).
+
+        Returns:
+            times: datetime64[ns] array.
+            prices: float64 array.
+        """
+        end = min(end, self.__flushed)
+        if start >= end:
+            return numpy.zeros(0, dtype='datetime64[ns]'), numpy.zeros(0, dtype=numpy.float64)
+        if self.__map is None or len(self.__map) < end:
+            self.__map = numpy.memmap(self.__path, dtype=self.record_dtype, mode='r', offset=self.header.size, shape=(self.__flushed,))
+        records = self.__map[start:end]
+        return records['time'].copy().view('datetime64[ns]'), records['price'].copy()
+
+    #
+    #
+    #
+    def close(self) -> None:
+        if self.__fp is not None:
+            self.__fp.close()
+            self.__fp = None
+        self.__map = None
@@ -0,0 +1,150 @@
+import threading
+import time
+from typing import Optional
+
+
+#
+#
+#
+class Ticker:
+    """
+        - periodic deadlines on time.monotonic(): tick k is due at start + k * interval (no drift)
+        - overrun = a tick starts before the deadline of the next one and ends after it
+                    (the ticks that run back to back to catch up are not overruns), then depending on policy:
+            skip     -> the missed deadlines are dropped, the next tick waits for the next deadline
+            coalesce -> a single tick runs right away for all the missed ones
+            burst    -> the missed ticks run back to back (at most max_burst), then back on schedule
+          in all cases the phase of the schedule is kept
+        - adaptive: the interval follows the observed latency (latency_factor * average latency)
+                    and backs off on rate limiting, always within [interval_sec, max_interval_sec]
+        - not thread safe (used by the thread that ticks)
+    """
+    policies = ('skip', 'coalesce', 'burst')
+
+    policy = None
+    max_burst = None
+    adaptive = None
+    latency_factor = None
+    ewma_alpha = 0.2
+
+    __base_interval = None
+    __max_interval = None
+    __interval = None
+    __start = None
+    __k = None
+    __latency = None
+    __backoff = None
+    __tick_start = None     # time.monotonic() at the end of the last wait (None = not waited)
+    #
+    ticks = None
+    overruns = None
+    missed = None
+
+    def __init__(self, interval_sec: float, policy: str = 'skip', max_burst: int = 5,
+                 adaptive: bool = False, max_interval_sec: Optional[float] = None, latency_factor: float = 2.0):
+        if interval_sec <= 0.0:
+            raise ValueError('Ticker: interval_sec must be positive.')
+        if policy not in self.policies:
+            raise ValueError('Ticker: invalid policy ' + str(policy) + '.')
+        self.policy = policy
+        self.max_burst = max(max_burst, 1)
+        self.adaptive = adaptive
+        self.latency_factor = latency_factor
+        self.__base_interval = interval_sec
+        self.__max_interval = max(max_interval_sec if max_interval_sec is not None else interval_sec, interval_sec)
+        self.__interval = interval_sec
+        self.__start = time.monotonic()
+        self.__k = 1
+        self.__latency = None
+        self.__backoff = 1.0
+        self.__tick_start = None
+        self.ticks = 0
+        self.overruns = 0
+        self.missed = 0
+
+    #
+    #
+    #
+    @property
+    def interval_sec(self) -> float:
+        """Current interval (the configured one unless adaptive)."""
+        return self.__interval
+
+    #
+    #
+    #
+    def __deadline(self, k: int) -> float:
+        return self.__start + k * self.__interval
+
+    #
+    #
+    #
+    def wait(self, exiting: threading.Event) -> bool:
+        """Sleeps until the next deadline, True if exiting was set in the meantime."""
+        exiting_set = exiting.wait(max(self.__deadline(self.__k) - time.monotonic(), 0.0))
+        self.__tick_start = time.monotonic()
+        return exiting_set
+
+    #
+    #
+    #
+    def observe_latency(self, latency_sec: float) -> None:
+        """Latency of a request made in this tick (adaptive interval)."""
+        if self.__latency is None:
+            self.__latency = latency_sec
+        else:
+            self.__latency += self.ewma_alpha * (latency_sec - self.__latency)
+
+    #
+    #
+    #
+    def rate_limited(self) -> None:
+        """The broker refused a request of this tick for rate limiting (adaptive interval)."""
+        self.__backoff = min(self.__backoff * 2.0, self.__max_interval / self.__base_interval)
+
+    #
+    #
+    #
+    def __adapt(self) -> float:
+        target = self.__base_interval * self.__backoff
+        if self.__latency is not None:
+            target = max(target, self.latency_factor * self.__latency)
+        # slow recovery after rate limiting
+        self.__backoff = max(self.__backoff * 0.9, 1.0)
+        return min(max(target, self.__base_interval), self.__max_interval)
+
+    #
+    #
+    #
+    def tick_done(self) -> None:
+        """Called at the end of each tick, schedules the next one."""
+        self.ticks += 1
+        if self.adaptive:
+            interval = self.__adapt()
+            if interval != self.__interval:
+                # new interval from the deadline of this tick
+                self.__start = self.__deadline(self.__k)
+                self.__k = 0
+                self.__interval = interval
+
+        self.__k += 1
+        now = time.monotonic()
+        late = now - self.__deadline(self.__k)
+        if late <= 0.0:
+            return
+
+        #
+        # n deadlines already passed
+        #
+        n = int(late // self.__interval) + 1
+        if self.__tick_start is None or self.__tick_start < self.__deadline(self.__k):
+            # overrun, unless the tick started after the deadline (catching up)
+            self.overruns += 1
+        if self.policy == 'skip':
+            skipped = n
+        elif self.policy == 'coalesce':
+            skipped = n - 1
+        else:
+            skipped = max(n - self.max_burst, 0)
+        self.__k += skipped
+        self.missed += skipped
@@ -1,5 +1,6 @@
 from functools import partial
 
+import metrics
 from trade_interface import current_time
 from trading_platform_shell.string_parsers import *
 from trading_platform_shell.utils import *
@@ -32,6 +33,11 @@ def action_jobs_list(_, data):
     job_server = data['job_server']
     job_server.list_done_tasks()
     job_server.list_open_tasks()
+    profiler = job_server.profiler
+    if profiler.enabled:
+        print('slowest ' + str(profiler.top_n) + ' tasks (profiling)')
+        print(profiler.report(profiler.top_n))
+        print()
     return False
 
 
@@ -51,6 +57,62 @@ def action_jobs_remove(params, data):
     return False
 
 
+#
+#
+#
+def help_profile():
+    print('profile               ranking of the profiled tasks by cumulative time (start + run + stop)')
+    print('profile on [rate]     start profiling, rate = fraction of the calls also sampled with cProfile (e.g. 0.05)')
+    print('profile off           stop profiling (the collected data is kept)')
+    print('profile reset         clear the collected data')
+    print('profile dump [file]   save the ranking and the cProfile summary (default file in settings.txt)')
+    print('the slowest tasks are also listed by jobs while profiling')
+
+
+#
+#
+#
+def action_profile(params, data):
+    profiler = data['job_server'].profiler
+    command = params[0].strip().lower() if len(params) != 0 else ''
+
+    if command == 'on':
+        if len(params) > 1:
+            try:
+                rate = float(params[1])
+            except ValueError:
+                print('invalid rate')
+                return False
+            profiler.cprofile_sample_rate = min(max(rate, 0.0), 1.0)
+        profiler.enabled = True
+        print('profiling on (cProfile rate = ' + str(profiler.cprofile_sample_rate) + ')')
+        return False
+    if command == 'off':
+        profiler.enabled = False
+        print('profiling off')
+        return False
+    if command == 'reset':
+        profiler.reset()
+        return False
+    if command == 'dump':
+        file_path = params[1].strip() if len(params) > 1 else profiler.file_path
+        try:
+            profiler.dump(file_path)
+        except OSError as e:
+            print(str(e))
+            return False
+        print('saved in ' + file_path)
+        return False
+    if command != '':
+        help_profile()
+        return False
+
+    if not profiler.enabled:
+        print('profiling is off')
+    print(profiler.report())
+    return False
+
+
 #
 #
 #
@@ -276,6 +338,42 @@ def action_list_quote(_, data):
     return False
 
 
+#
+#
+#
+def help_stats():
+    print('stats            list all counters and latencies (ms)')
+    print('stats prefix     only the metrics starting with prefix (e.g. stats job_server)')
+    print('stats reset      clear all the values')
+    print('metrics are also saved periodically in the file (and http endpoint) set in settings.txt')
+
+
+#
+#
+#
+def action_stats(params, data):
+    if len(params) != 0 and params[0].strip().lower() == 'reset':
+        metrics.reset()
+        return False
+    prefix = params[0].strip() if len(params) != 0 else ''
+
+    histograms = []
+    counters = []
+    for name, m in metrics.snapshot().items():
+        if not name.startswith(prefix):
+            continue
+        if m['type'] == 'counter':
+            counters.append([name, m['value']])
+        elif m['count'] != 0:
+            histograms.append([name, m['count']] + [m[k] * 1000.0 for k in ('mean', 'p50', 'p90', 'p99', 'max')])
+
+    if len(histograms) != 0:
+        print(tabulate(histograms, headers=['', 'count', 'mean', 'p50', 'p90', 'p99', 'max'], floatfmt='.3f', stralign='left'))
+    if len(counters) != 0:
+        print(tabulate(counters, headers=['', 'count'], stralign='left'))
+    return False
+
+
 #
 #
 #
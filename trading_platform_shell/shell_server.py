@@ -45,6 +45,7 @@ class ShellServer(threading.Thread):
                         ['exit', [0, action_quit, '', 'exit platform']],
                         ['jobs', [0, action_jobs_list, '', 'list all the jobs']],
                         ['remove', [1, action_jobs_remove, 'job_id', 'remove a job from the job list']],
+                        ['profile', [0, action_profile, '[on [rate]/off/reset/dump [file]]', 'profile the jobs', help_profile]],
                         [],
                         ['orders', [0, action_order_list, '', 'list active orders']],
                         ['positions', [0, action_positions_list, '', 'list of the open positions']],
@@ -55,6 +56,7 @@ class ShellServer(threading.Thread):
                         ['quote', [1, action_quote, 'symbol', 'get a quote for the equity']],
                         [],
                         ['server', [0, action_list_quote, '', 'list the quotes that are currently followed']],
+                        ['stats', [0, action_stats, '[prefix/reset]', 'hot path counters and latencies', help_stats]],
                         ['w', [1, action_w_create, 'symbol', 'create a real time window']],
                         ['*', [1, action_w_remove, 'symbol/*', 'delete a real time window (* delete all)']],
                         [],